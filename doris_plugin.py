@@ -88,16 +88,14 @@ class DorisPlugin(Plugin):
                 e_context.action = EventAction.BREAK
                 return
 
-            # 3.处理问答（移植原API逻辑）
-            response = self.rag_engine.process_query(
-                question, 
-                self.collection_name
-            )
+            # 3.流式处理问答：渠道支持主动发送时按段落先行推送，剩余内容和参考文档作为最终回复
+            channel = e_context.econtext.get("channel")
+            response = self._stream_answer(question, channel, context)
             
-            # 3.构建回复
+            # 4.构建回复
             reply = Reply()
             reply.type = ReplyType.TEXT
-            reply.content = f"知识库回答：\n{response}"
+            reply.content = response
             e_context['reply'] = reply
             e_context.action = EventAction.BREAK_PASS
             
@@ -107,6 +105,24 @@ class DorisPlugin(Plugin):
             e_context['reply'] = reply
             e_context.action = EventAction.BREAK
 
+    def _stream_answer(self, question, channel, context) -> str:
+        """消费 RAGEngine.stream_query，返回尚未推送的回答内容"""
+        pending = "知识库回答：\n"
+        references = ""
+        for event, data in self.rag_engine.stream_query(question, self.collection_name):
+            if event == "references":
+                references = self.rag_engine.format_references(data)
+            elif event == "delta":
+                pending += data
+                # 遇到段落结束即推送已生成的部分，用户无需等待完整生成
+                if channel and "\n\n" in pending:
+                    ready, pending = pending.rsplit("\n\n", 1)
+                    if ready.strip():
+                        channel.send(Reply(ReplyType.TEXT, ready), context)
+        if not references:
+            return pending
+        return f"{pending}{references}" if pending.strip() else references.lstrip()
+
     def load_config(self):
         try:
             from settings import load_config  # 确保绝对导入
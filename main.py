@@ -6,47 +6,30 @@ import argparse
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from src.data_loader.doris_loader import DorisLoader
 from src.data_loader.jira_loader import JiraLoader
+from src.data_loader.index_manifest import IndexManifest
 from src.vectorstore.milvus_store import MilvusStore
+from src.vectorstore.collection_generation import bump_generation
 from src.qa.rag_engine import RAGEngine
 from settings import config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def process_documents():
-    """处理文档：加载、向量化和存储"""
+async def process_documents(incremental=None):
+    """处理文档：加载、向量化和存储（incremental 为 None 时读取配置 ingest.incremental）"""
+    if incremental is None:
+        incremental = config.incremental_ingest
     try:
         logger.info("初始化组件")
         doris_loader = DorisLoader(config.doris_docs_path)
-        milvus_store = MilvusStore()
-        rag_engine = RAGEngine()
         
-        # 加载文档
-        logger.info("开始加载文档")
-        documents = doris_loader.load_documents()
-        if not documents:
+        # 解析、切分、向量化、写入以流水线方式执行
+        logger.info(f"开始处理文档，集合: {config.doc_collection_name}，增量模式: {incremental}")
+        count = await doris_loader.aprocess(incremental=incremental)
+        if not count and not incremental:
             raise ValueError("没有加载到任何文档")
-        logger.info(f"文档加载完成，共 {len(documents)} 个文档块")
-        
-        # 创建collection
-        collection_name = config.doc_collection_name
-        logger.info(f"创建集合: {collection_name}")
-        milvus_store.create_collection(collection_name)
-        
-        # 处理并存储文档
-        logger.info("开始处理文档向量化")
-        texts = [doc["content"] for doc in documents]
         
-        # 修改后的异步调用
-        await rag_engine.batch_get_embeddings(
-            texts=texts,
-            documents=documents,
-            collection_name=collection_name,
-            batch_size=50,
-            concurrency=10
-        )
-        
-        logger.info("文档处理完成")
+        logger.info(f"文档处理完成，共 {count} 个文档块")
         
     except Exception as e:
         logger.error(f"文档处理失败: {str(e)}")
@@ -83,6 +66,42 @@ def interactive_qa():
         response = rag_engine.process_query(query, collection_name)
         print("\n" + response)
 
+def tune_index(args):
+    """向量索引调优：对比候选索引的召回率和延迟，并把选中的参数写入配置"""
+    from src.vectorstore.index_tuner import IndexTuner
+    MilvusStore()  # 建立连接
+    tuner = IndexTuner(
+        args.collection or config.doc_collection_name,
+        sample_size=args.sample,
+        query_count=args.queries,
+        top_k=args.top_k,
+        target_recall=args.target_recall,
+        index_types=args.index_types.split(",") if args.index_types else None
+    )
+    report = tuner.run()
+    print(f"\n{'索引':<10}{'构建参数':<36}{'检索参数':<20}{'召回率':>8}{'P50(ms)':>10}{'P99(ms)':>10}")
+    for result in report:
+        print(f"{result['index_type']:<10}{str(result['params']):<36}{str(result['search_params']):<20}"
+              f"{result['recall']:>8}{result['p50_ms']:>10}{result['p99_ms']:>10}")
+    best = tuner.choose(report)
+    print(f"\n选定: {best['index_type']} {best['params']} {best['search_params']}")
+    if not args.dry_run:
+        tuner.save(best)
+        print("已写入config.json，重新运行 process 重建集合后生效")
+
+def rollback(args):
+    """把集合别名切回上一代（全量重建后发现问题时使用）"""
+    collection_name = args.collection or config.doc_collection_name
+    previous = MilvusStore().rollback(collection_name)
+    bump_generation(collection_name)
+    print(f"{collection_name} 已回滚到 {previous}")
+    if collection_name == config.doc_collection_name:
+        # 增量入库依据清单计算差异，清单需与回滚后的集合一致
+        if IndexManifest(config.ingest_manifest_path).restore(previous):
+            print(f"索引清单已恢复为 {previous} 的快照")
+        else:
+            print(f"没有 {previous} 的索引清单快照，下次 process 将全量重建")
+
 def start_api():
     """启动API服务"""
     from src.api.server import app
@@ -92,37 +111,55 @@ def start_api():
 def main():
     parser = argparse.ArgumentParser(description='Doris智能问答系统',
                                     formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('command', choices=['process', 'test', 'api', 'jira_sync'], 
+    parser.add_argument('command', choices=['process', 'test', 'api', 'jira_sync', 'tune_index', 'rollback'], 
                          help='''可执行的操作:
-process - 处理文档数据
+process - 处理文档数据（--incremental 增量，--full 全量重建）
 test    - 运行测试
 api     - 启动API服务
-jira_sync - 同步Jira数据（使用--full进行全量刷新）''')
-    parser.add_argument('--full', action='store_true', help='全量刷新模式')
+jira_sync - 同步Jira数据（使用--full进行全量刷新）
+tune_index - 向量索引调优（对比召回率与延迟，写入 vector_index 配置）
+rollback - 集合别名切回上一代（使用--collection指定集合）''')
+    parser.add_argument('--full', action='store_true', help='全量刷新模式（process 时强制全量重建）')
+    parser.add_argument('--incremental', action='store_true', default=None,
+                        help='增量处理文档（仅处理新增/变更/删除的文件），默认读取配置 ingest.incremental')
+    parser.add_argument('--collection', help='调优/回滚的集合，默认为文档集合')
+    parser.add_argument('--sample', type=int, default=50000, help='调优使用的向量条数')
+    parser.add_argument('--queries', type=int, default=200, help='调优使用的查询条数')
+    parser.add_argument('--top-k', type=int, default=10, help='召回率计算的k')
+    parser.add_argument('--target-recall', type=float, default=0.95, help='目标召回率')
+    parser.add_argument('--index-types', help='候选索引类型，逗号分隔，默认 HNSW,IVF_FLAT,IVF_SQ8,IVF_PQ,DISKANN')
+    parser.add_argument('--dry-run', action='store_true', help='只输出测试结果，不写入配置')
     args = parser.parse_args()
 
     if args.command == 'process':
-        asyncio.run(process_documents())
+        asyncio.run(process_documents(incremental=False if args.full else args.incremental))
     elif args.command == 'test':
         test_qa()
     elif args.command == 'api':
         start_api()
+    elif args.command == 'tune_index':
+        tune_index(args)
+    elif args.command == 'rollback':
+        rollback(args)
     elif args.command == 'jira_sync':
         milvus = MilvusStore()
         loader = JiraLoader(config.jira_config)
         
-        if args.full:
-            print("开始全量刷新Jira数据...")
-            milvus.create_jira_collection()
-        else:
-            print("开始增量刷新Jira数据...")
-            
-        count = 0
-        for doc in loader.load_documents(full_refresh=args.full):
-            milvus.upsert("jira_issues", doc)
-            count += 1
+        embed_batch_size = config.jira_sync_config.get("embed_batch_size", 50)
+        
+        if args.full and config.bulk_import_config.get("enabled", False):
+            print("开始全量刷新Jira数据（批量导入）...")
+            count = asyncio.run(loader.abulk_import(milvus, RAGEngine().aembed_documents, batch_size=embed_batch_size))
+            bump_generation("jira_issues")
+            print(f"刷新完成，共导入{count}条数据")
+            return
+        print("开始全量刷新Jira数据..." if args.full else "开始增量刷新Jira数据...")
+        stats = asyncio.run(loader.aupsert(
+            milvus, RAGEngine().aembed_documents, full_refresh=args.full, batch_size=embed_batch_size
+        ))
+        bump_generation("jira_issues")
             
-        print(f"刷新完成，共处理{count}条数据")
+        print(f"刷新完成，更新{stats['upserted']}条，删除{stats['deleted']}条")
     else:
         print("无效命令")
         sys.exit(1)
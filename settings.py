@@ -85,6 +85,31 @@ class ConfigManager:
     def embedding_model(self) -> str:
         return self._config["model_config"]["services"]["embedding"]["model"]
     
+    @property
+    def embedding_config(self) -> dict:
+        return self._config["model_config"]["services"]["embedding"]
+    
+    @property
+    def normalize_embeddings(self) -> bool:
+        """嵌入是否归一化为单位向量（IP度量下内积即余弦相似度）"""
+        return self.embedding_config.get("normalize", True)
+    
+    @property
+    def embedding_cache_config(self) -> dict:
+        return self._config.get("embedding_cache", {})
+    
+    @property
+    def query_config(self) -> dict:
+        return self._config.get("query", {})
+    
+    @property
+    def query_timeout(self) -> float:
+        return self._config.get("timeout", 60)
+    
+    @property
+    def rate_limits_config(self) -> dict:
+        return self._config.get("rate_limits", {})
+    
     @property
     def moderation_keywords(self) -> list:
         return self._config["moderation"]["keywords"]
@@ -101,6 +126,14 @@ class ConfigManager:
     def moderation_config(self) -> dict:
         return self._config["moderation"]
     
+    @property
+    def moderation_vocabulary_path(self) -> Path:
+        return Path(self.moderation_config.get("vocabulary_path", "data/moderation_vocabulary.json"))
+    
+    @property
+    def moderation_centroids_path(self) -> Path:
+        return Path(self.moderation_config.get("centroids_path", "data/moderation_centroids.npy"))
+    
     @property
     def moderation_temperature(self) -> float:
         return self._config["model_config"]["services"]["moderation"]["temperature"]
@@ -139,6 +172,18 @@ class ConfigManager:
     def get_version_weights(self) -> dict:
         return self._config["search_config"]["version_weights"]
     
+    @property
+    def search_config(self) -> dict:
+        return self._config["search_config"]
+    
+    @property
+    def partition_by_version(self) -> bool:
+        return self.search_config.get("partition_by_version", True)
+    
+    @property
+    def hybrid_search_config(self) -> dict:
+        return self._config["search_config"].get("hybrid", {})
+    
     @property
     def get_chat_model(self) -> str:
         return self._config["model_config"]["services"]["chat"]["model"]
@@ -159,6 +204,77 @@ class ConfigManager:
     def get_chat_max_tokens(self) -> int:
         return self._config["model_config"]["services"]["chat"]["max_tokens"]
     
+    @property
+    def ingest_config(self) -> dict:
+        return self._config.get("ingest", {})
+    
+    @property
+    def incremental_ingest(self) -> bool:
+        return self.ingest_config.get("incremental", False)
+    
+    @property
+    def ingest_workers(self) -> int:
+        return self.ingest_config.get("workers", 0)
+    
+    @property
+    def ingest_manifest_path(self) -> Path:
+        return Path(self.ingest_config.get("manifest_path", "data/doris_docs_manifest.json"))
+    
+    @property
+    def collection_generation_path(self) -> Path:
+        return Path(self.ingest_config.get("generation_path", "data/collection_generations.json"))
+    
+    @property
+    def answer_cache_config(self) -> dict:
+        return self._config.get("answer_cache", {})
+    
+    @property
+    def query_cache_config(self) -> dict:
+        return self._config.get("query_cache", {})
+    
+    def vector_index(self, collection_name: str) -> dict:
+        """集合的向量索引与检索参数（tune_index 命令写入），未单独配置时使用 vector_index.default"""
+        indexes = self._config.get("vector_index", {})
+        return indexes.get(collection_name) or indexes.get("default") or {
+            "index_type": "IVF_FLAT",
+            "metric_type": "IP",
+            "params": {"nlist": 1024},
+            "search_params": {"nprobe": 32}
+        }
+    
+    def save_section(self, key: str, value):
+        """更新 config.json 中的一个顶层配置项并立即生效"""
+        config_path = Path(__file__).parent / "config.json"
+        with open(config_path, encoding='utf-8') as f:
+            data = json.load(f)
+        data[key] = value
+        tmp_path = config_path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, config_path)
+        self._config[key] = value
+    
+    @property
+    def blue_green_config(self) -> dict:
+        return self._config.get("blue_green", {})
+    
+    @property
+    def bulk_import_config(self) -> dict:
+        return self._config.get("bulk_import", {})
+    
+    @property
+    def doc_store_config(self) -> dict:
+        return self._config.get("doc_store", {})
+    
+    @property
+    def chunking_config(self) -> dict:
+        return self._config.get("chunking", {})
+    
+    @property
+    def jira_sync_config(self) -> dict:
+        return self._config.get("jira_sync", {})
+    
     @property
     def jira_config(self) -> dict:
         """获取Jira相关配置"""
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from src.data_loader.jira_loader import JiraLoader
-from src.vectorstore.milvus_store import MilvusStore
+from src.vectorstore.collection_generation import bump_generation
 from settings import config
 from src.qa.rag_engine import RAGEngine
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -17,41 +17,51 @@ security = HTTPBearer()
 @router.post("/jira/refresh")
 async def refresh_jira_data(
     req: RefreshRequest,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    rag: RAGEngine = Depends()
 ):
     # 验证访问令牌
     if credentials.credentials != config.jira.api_token:
         raise HTTPException(status_code=403, detail="无访问权限")
     
+    # 使用应用共享的RAG引擎（server 中通过 dependency_overrides 注入），不为每个请求新建连接和线程池
     loader = JiraLoader(config)
-    milvus = MilvusStore()
+    milvus = rag.milvus_store
     
-    if req.full_refresh:
-        milvus.create_jira_collection()
+    embed_batch_size = config.jira_sync_config.get("embed_batch_size", 50)
     
-    count = 0
-    for doc in loader.load_documents(req.full_refresh):
-        milvus.insert("jira_issues", doc)
-        count += 1
+    if req.full_refresh and config.bulk_import_config.get("enabled", False):
+        # 导入新一代集合后切换别名，刷新期间线上集合照常可查
+        count = await loader.abulk_import(milvus, rag.aembed_documents, batch_size=embed_batch_size)
+        bump_generation("jira_issues")
+        return {"status": "success", "inserted": count}
     
-    return {"status": "success", "inserted": count}
+    stats = await loader.aupsert(
+        milvus, rag.aembed_documents, full_refresh=req.full_refresh, batch_size=embed_batch_size
+    )
+    bump_generation("jira_issues")
+    
+    return {"status": "success", "inserted": stats["upserted"], "deleted": stats["deleted"]}
 
 @router.post("/jira/refresh/incremental")
 async def incremental_refresh(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    rag: RAGEngine = Depends()
 ):
     """增量刷新Jira数据"""
     if credentials.credentials != config.jira.api_token:
         raise HTTPException(status_code=403, detail="无访问权限")
     
     loader = JiraLoader(config)
-    milvus = MilvusStore()
+    milvus = rag.milvus_store
     
-    count = 0
-    for doc in loader.load_documents(full_refresh=False):
-        # 使用upsert操作更新现有数据
-        milvus.upsert("jira_issues", doc)
-        count += 1
+    # 按批向量化并批量upsert，整个同步只加载和compact一次
+    stats = await loader.aupsert(
+        milvus, rag.aembed_documents, full_refresh=False,
+        batch_size=config.jira_sync_config.get("embed_batch_size", 50)
+    )
+    count = stats["upserted"]
+    bump_generation("jira_issues")
     
     return {"status": "success", "updated": count}
 
@@ -3,7 +3,8 @@ from pydantic import BaseModel, Field
 from src.data_loader.doris_loader import DorisLoader
 from src.qa.rag_engine import RAGEngine
 from src.data_loader.jira_loader import JiraLoader
-from src.vectorstore.milvus_store import MilvusStore
+from src.vectorstore.collection_generation import bump_generation
+import json
 import logging
 import uvicorn
 import logging.handlers
@@ -22,6 +23,10 @@ class DocProcessRequest(BaseModel):
 class JiraProcessRequest(BaseModel):
     full_refresh: bool = Field(False, description="是否全量刷新")
 
+def _sse_event(event: str, data) -> str:
+    """按Server-Sent Events格式编码一个事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 def create_app():
     app = FastAPI(title="Doris智能问答API")
     
@@ -49,13 +54,16 @@ def create_app():
         ModerationService: lambda: moderation
     })
 
+    @app.on_event("shutdown")
+    async def close_clients():
+        await rag_engine.aclose()
+
     @app.post("/api/ask")
-    def ask_question(query_request: QueryRequest):
-        """问答接口"""
+    async def ask_question(query_request: QueryRequest):
+        """问答接口（全程异步，等待模型响应时不占用线程）"""
         try:
             logger.info(f"收到新问题: {query_request.question}")
-            # 同步处理无需async上下文
-            response = rag_engine.process_query(query_request.question, collection_name)
+            response = await rag_engine.aprocess_query(query_request.question, collection_name)
             return {"code": 0, "data": response}
         except TimeoutError as e:
             logger.error("请求处理超时")
@@ -64,9 +72,31 @@ def create_app():
             logger.exception("处理请求时发生异常")
             return {"code": 500, "message": "服务内部错误"}
 
+    @app.post("/api/ask/stream")
+    async def ask_question_stream(query_request: QueryRequest):
+        """流式问答接口（SSE）：检索完成后先推送 references，随后逐段推送 delta，最后推送 done"""
+        logger.info(f"收到新问题(流式): {query_request.question}")
+
+        async def event_stream():
+            try:
+                async for event, data in rag_engine.astream_query(query_request.question, collection_name):
+                    yield _sse_event(event, data)
+            except TimeoutError:
+                logger.error("请求处理超时")
+                yield _sse_event("error", {"code": 504, "message": "处理超时"})
+            except Exception:
+                logger.exception("处理请求时发生异常")
+                yield _sse_event("error", {"code": 500, "message": "服务内部错误"})
+
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # 禁止代理缓冲
+        )
+
     @app.get("/api/process/doc")
-    async def process_document(background_tasks: BackgroundTasks):
-        """复用现有文档处理流程"""
+    async def process_document(background_tasks: BackgroundTasks, incremental: bool = None):
+        """复用现有文档处理流程（incremental 未指定时使用配置 ingest.incremental）"""
         def process_task():
             # 继承主线程日志配置
             logging.basicConfig(
@@ -81,7 +111,7 @@ def create_app():
                 logger.info(f"处理进度: {current}/{total} ({current/total:.1%})")
             
             try:
-                processed_count = loader.full_process(progress_callback)
+                processed_count = loader.full_process(progress_callback, incremental=incremental)
                 logger.info(f"文档处理完成，共处理 {processed_count} 个文档")
             except Exception as e:
                 logger.error(f"文档处理失败: {str(e)}")
@@ -93,26 +123,29 @@ def create_app():
         return {"message": "文档处理已开始"}
 
     @app.get("/api/process/jira")
-    def process_jira_data(full_refresh: bool = False):
+    async def process_jira_data(full_refresh: bool = False):
         """处理Jira数据"""
         try:
             logger.info(f"收到Jira处理请求，全量模式: {full_refresh}")
             loader = JiraLoader(config)
-            milvus = MilvusStore()
             
-            if full_refresh:
-                milvus.create_jira_collection()
-                
-            count = 0
-            for doc in loader.load_documents(full_refresh=full_refresh):
-                milvus.insert("jira_issues", doc)
-                count += 1
+            # Jira拉取和Milvus写入在线程中执行，同步期间问答请求不受阻塞
+            stats = await loader.aupsert(
+                rag_engine.milvus_store, rag_engine.aembed_documents, full_refresh=full_refresh,
+                batch_size=config.jira_sync_config.get("embed_batch_size", 50)
+            )
+            bump_generation("jira_issues")
                 
-            return {"code": 0, "processed": count}
+            return {"code": 0, "processed": stats["upserted"], "deleted": stats["deleted"]}
         except Exception as e:
             logger.error(f"Jira数据处理失败: {str(e)}")
             return {"code": 500, "message": "Jira数据处理失败"}
 
+    @app.get("/api/cache/stats")
+    def cache_stats():
+        """各级缓存命中率"""
+        return {"code": 0, "data": rag_engine.cache_stats()}
+
     @app.get("/health")
     def health_check():
         return {"status": "ok"}
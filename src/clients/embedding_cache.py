@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """本地持久化嵌入缓存
+
+    以 (嵌入模型, sha256(输入文本)) 为键，float32 向量为值保存在SQLite中（WAL模式，多进程可共享），
+    超过 max_entries 时按最近访问时间淘汰。
+    """
+
+    EVICT_CHECK_INTERVAL = 1000  # 每写入多少条检查一次容量
+
+    def __init__(self, path: Path, max_entries: int = 500000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_check = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                key BLOB NOT NULL,
+                vector BLOB NOT NULL,
+                last_access INTEGER NOT NULL,
+                PRIMARY KEY (model, key)
+            ) WITHOUT ROWID
+        """)
+        self._connect().execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings (last_access)")
+        logger.info(f"嵌入缓存已启用: {self.path}（上限 {max_entries} 条）")
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _execute_many(self, sql: str, rows: list):
+        """批量写入放在同一个事务中"""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.sha256(text.encode()).digest()
+
+    def get_many(self, model: str, texts: list) -> list:
+        """批量查询，命中的位置返回float32向量（直接引用SQLite返回的字节，只读），未命中的位置返回None"""
+        if not texts:
+            return []
+        keys = [self._key(text) for text in texts]
+        found = {}
+        conn = self._connect()
+        for i in range(0, len(keys), 500):
+            batch = list(dict.fromkeys(keys[i:i + 500]))
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({placeholders})",
+                [model, *batch]
+            ).fetchall()
+            found.update(rows)
+        if found:
+            now = int(time.time())
+            self._execute_many(
+                "UPDATE embeddings SET last_access = ? WHERE model = ? AND key = ?",
+                [(now, model, key) for key in found]
+            )
+        results = [
+            np.frombuffer(found[key], dtype=np.float32) if key in found else None
+            for key in keys
+        ]
+        hit_count = sum(1 for vector in results if vector is not None)
+        with self._lock:
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def get(self, model: str, text: str):
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: list, vectors):
+        """vectors 为float32矩阵或向量列表"""
+        if not texts:
+            return
+        now = int(time.time())
+        rows = [
+            (model, self._key(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        self._execute_many("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+        with self._lock:
+            self._writes_since_check += len(rows)
+            should_check = self._writes_since_check >= self.EVICT_CHECK_INTERVAL
+            if should_check:
+                self._writes_since_check = 0
+        if should_check:
+            self._evict()
+
+    def put(self, model: str, text: str, vector):
+        self.put_many(model, [text], [vector])
+
+    def _evict(self):
+        """超过容量时淘汰最久未访问的条目，保留上限的90%"""
+        conn = self._connect()
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        excess = count - int(self.max_entries * 0.9)
+        conn.execute(
+            "DELETE FROM embeddings WHERE (model, key) IN "
+            "(SELECT model, key FROM embeddings ORDER BY last_access LIMIT ?)",
+            (excess,)
+        )
+        logger.info(f"嵌入缓存淘汰 {excess} 条（当前 {count} 条，上限 {self.max_entries}）")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
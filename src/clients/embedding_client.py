@@ -0,0 +1,123 @@
+import asyncio
+import base64
+import contextlib
+import logging
+import numpy as np
+import openai
+from settings import config
+from src.clients.llm_client import async_clients
+from src.clients.rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+def decode_embedding(value) -> np.ndarray:
+    """接口返回的单条嵌入转为float32向量：base64直接按字节解释，不经过Python浮点列表"""
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """按行L2归一化（原地），零向量保持不变"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+class AsyncEmbeddingClient:
+    """异步批量嵌入客户端
+
+    - 按条数和token数把多条输入打包进一次请求
+    - 在途请求数、速率和重试退避由提供商共享的自适应限流器控制
+    - 返回结果与输入顺序一致
+    - 某个子批次失败时只重试该子批次
+    - 以base64格式请求，解码为连续的float32矩阵（每行一个向量），按需整体归一化
+    """
+
+    def __init__(self, token_counter=None):
+        embedding_config = config.embedding_config
+        self.provider = config.embedding_provider
+        self.model = config.embedding_model
+        self.max_batch_size = embedding_config.get("batch_size", 32)
+        self.max_batch_tokens = embedding_config.get("max_batch_tokens", 16384)
+        self.encoding_format = embedding_config.get("encoding_format", "base64")
+        self.normalize = config.normalize_embeddings
+        self.timeout = 60.0
+        self.token_counter = token_counter
+        self.rate_limiter = get_rate_limiter(self.provider)
+
+    def _pack(self, texts: list) -> list:
+        """按条数和token预算打包，返回 [(起始下标, 文本列表, token数)]"""
+        batches = []
+        start = 0
+        current = []
+        current_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = self.token_counter.count(text) if self.token_counter else len(text)
+            if current and (len(current) >= self.max_batch_size or current_tokens + tokens > self.max_batch_tokens):
+                batches.append((start, current, current_tokens))
+                start, current, current_tokens = i, [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            batches.append((start, current, current_tokens))
+        return batches
+
+    async def embed(self, texts: list, concurrency: int = None) -> np.ndarray:
+        """批量生成嵌入，按输入顺序返回 float32 矩阵（形状为 输入条数 × 维度）
+
+        Args:
+            texts: 已预处理的输入文本
+            concurrency: 本次调用额外的在途请求上限，默认只受限流器控制
+        """
+        if not texts:
+            return np.empty((0, config.vector_dimension), dtype=np.float32)
+        # 异步客户端绑定事件循环，与问答、审核共享同一连接池
+        client = async_clients.get(self.provider)
+        semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+        async def run(start, batch, tokens):
+            async with semaphore if semaphore else contextlib.nullcontext():
+                return await self._embed_batch(client, batch, tokens)
+
+        # gather 按提交顺序返回，子批次本身按输入顺序打包，拼接后即与输入对齐
+        parts = await asyncio.gather(*(run(start, batch, tokens) for start, batch, tokens in self._pack(texts)))
+        vectors = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        return normalize_rows(vectors) if self.normalize else vectors
+
+    async def _embed_batch(self, client, batch: list, tokens: int) -> np.ndarray:
+        """发送单个子批次；限流器负责可重试错误的退避重试，请求被拒绝时二分定位问题输入"""
+        try:
+            response = await self.rate_limiter.acall(
+                client.embeddings.create,
+                model=self.model,
+                input=batch,
+                encoding_format=self.encoding_format,
+                timeout=self.timeout,
+                cost=tokens
+            )
+            return np.stack([decode_embedding(item.embedding)
+                             for item in sorted(response.data, key=lambda item: item.index)])
+        except openai.BadRequestError as e:
+            if len(batch) == 1:
+                logger.error(f"嵌入请求被拒绝: {str(e)} | 文本预览: {batch[0][:100]}")
+                raise
+            # 拆分批次，只让有问题的输入失败
+            middle = len(batch) // 2
+            left, right = await asyncio.gather(
+                self._embed_batch(client, batch[:middle], tokens // 2),
+                self._embed_batch(client, batch[middle:], tokens - tokens // 2)
+            )
+            return np.concatenate([left, right])
+
+LOCAL_PROVIDER = "local"
+
+
+def create_embedding_client(token_counter=None):
+    """按 model_config.services.embedding.provider 选择嵌入后端：local 为本地CPU模型，其余为OpenAI兼容接口"""
+    if config.embedding_provider == LOCAL_PROVIDER:
+        from src.clients.local_embedding import LocalEmbeddingClient
+        logger.info(f"使用本地嵌入后端: {config.embedding_model}")
+        return LocalEmbeddingClient(token_counter=token_counter)
+    return AsyncEmbeddingClient(token_counter=token_counter)
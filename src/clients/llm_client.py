@@ -1,5 +1,8 @@
+import asyncio
 import logging
-from openai import OpenAI
+import weakref
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient
 from settings import config
 logger = logging.getLogger(__name__)
 
@@ -39,17 +42,24 @@ class LLMClients:
     def __init__(self):
         """使用同步客户端"""
         self.config = config._config  # 直接使用全局配置实例
+        # 重试由 rate_limiter 统一处理，关闭SDK自带重试
         self.chat = OpenAI(
             api_key=config.llm_api_key(provider=config.chat_provider),
-            base_url=config.llm_endpoint(provider=config.chat_provider)
+            base_url=config.llm_endpoint(provider=config.chat_provider),
+            max_retries=0
         )
         # 获取嵌入服务配置
         embedding_provider = config.embedding_provider
         
-        self.embedding = OpenAI(
-            api_key=config.llm_api_key(provider=embedding_provider),
-            base_url=config.llm_endpoint(provider=embedding_provider)
-        )
+        # 本地嵌入后端不需要远程客户端
+        if embedding_provider == "local":
+            self.embedding = None
+        else:
+            self.embedding = OpenAI(
+                api_key=config.llm_api_key(provider=embedding_provider),
+                base_url=config.llm_endpoint(provider=embedding_provider),
+                max_retries=0
+            )
         logger.info(f"初始化嵌入客户端: {embedding_provider}")
 
     def _init_client(self, config, service_type):
@@ -60,4 +70,36 @@ class LLMClients:
         return OpenAI(
             api_key=config.llm_api_key(provider=provider),
             base_url=config.llm_endpoint(provider=provider)
-        ) 
\ No newline at end of file
+        )
+
+class AsyncLLMClients:
+    """异步客户端：每个事件循环、每个提供商复用一个AsyncOpenAI实例及其连接池"""
+    def __init__(self):
+        self._clients = weakref.WeakKeyDictionary()
+
+    def get(self, provider: str) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        clients = self._clients.setdefault(loop, {})
+        client = clients.get(provider)
+        if client is None:
+            max_connections = config.query_config.get("max_connections", 200)
+            logger.info(f"初始化异步客户端: {provider}（连接池上限 {max_connections}）")
+            client = clients[provider] = AsyncOpenAI(
+                api_key=config.llm_api_key(provider=provider),
+                base_url=config.llm_endpoint(provider=provider),
+                max_retries=0,  # 重试由 rate_limiter 统一处理
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+                )
+            )
+        return client
+
+    async def aclose(self):
+        """关闭当前事件循环上的客户端连接池"""
+        clients = self._clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.close()
+
+
+# 进程内共享的异步客户端
+async_clients = AsyncLLMClients()
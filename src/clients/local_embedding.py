@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import threading
+import time
+import numpy as np
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+
+class LocalEmbeddingClient:
+    """本地CPU嵌入后端（sentence-transformers）
+
+    - 与 AsyncEmbeddingClient 相同的 embed 接口，另提供同步的 encode
+    - 按 batch_size 批量推理，线程数可配置
+    - 支持 torch 动态int8量化，或加载ONNX（含int8量化）模型文件
+    - 模型在首次使用时加载，推理串行执行，由torch/onnxruntime内部线程池并行
+    """
+
+    def __init__(self, token_counter=None):
+        embedding_config = config.embedding_config
+        local_config = embedding_config.get("local", {})
+        self.provider = config.embedding_provider
+        self.model = config.embedding_model
+        self.batch_size = local_config.get("batch_size", 16)
+        self.threads = local_config.get("threads", 0)
+        self.backend = local_config.get("backend", "torch")
+        self.onnx_file = local_config.get("onnx_file")
+        self.quantize = local_config.get("quantize", False)
+        self.max_seq_length = local_config.get("max_seq_length")
+        self.normalize = config.normalize_embeddings
+        self.token_counter = token_counter
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+
+    def _load_model(self):
+        """首次使用时加载模型"""
+        if self._model is not None:
+            return self._model
+        with self._load_lock:
+            if self._model is not None:
+                return self._model
+            try:
+                import torch
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise ImportError("本地嵌入需要安装 sentence-transformers 和 torch（见 requirements.txt 的 local-embeddings 可选依赖组）") from e
+
+            if self.threads > 0:
+                torch.set_num_threads(self.threads)
+            start = time.perf_counter()
+            kwargs = {"device": "cpu"}
+            if self.backend == "onnx":
+                kwargs["backend"] = "onnx"
+                if self.onnx_file:
+                    kwargs["model_kwargs"] = {"file_name": self.onnx_file}
+            model = SentenceTransformer(self.model, **kwargs)
+            if self.max_seq_length:
+                model.max_seq_length = self.max_seq_length
+            if self.quantize and self.backend == "torch":
+                # 对线性层做动态int8量化，CPU上通常能提速且精度损失很小
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+            dimension = model.get_sentence_embedding_dimension()
+            if dimension and dimension != config.vector_dimension:
+                logger.warning(f"本地嵌入模型维度 {dimension} 与配置的 vector_dimension {config.vector_dimension} 不一致")
+            logger.info(
+                f"本地嵌入模型加载完成: {self.model}（backend={self.backend}，"
+                f"int8={'是' if self.quantize or (self.onnx_file and 'qint8' in self.onnx_file) else '否'}，"
+                f"线程数={torch.get_num_threads()}），耗时 {time.perf_counter() - start:.1f}s"
+            )
+            self._model = model
+            return model
+
+    def encode(self, texts: list) -> np.ndarray:
+        """同步批量生成嵌入，按输入顺序返回 float32 矩阵"""
+        if not texts:
+            return np.empty((0, config.vector_dimension), dtype=np.float32)
+        model = self._load_model()
+        start = time.perf_counter()
+        with self._encode_lock:
+            vectors = model.encode(
+                texts,
+                batch_size=self.batch_size,
+                normalize_embeddings=self.normalize,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        logger.debug(f"本地嵌入 {len(texts)} 条，耗时 {elapsed:.2f}s ({len(texts) / elapsed:.1f} 条/秒)")
+        return vectors.astype(np.float32, copy=False)
+
+    async def embed(self, texts: list, concurrency: int = None) -> np.ndarray:
+        """异步接口：在线程中执行推理，避免阻塞事件循环（concurrency 对本地推理无意义，仅为接口兼容）"""
+        return await asyncio.to_thread(self.encode, texts)
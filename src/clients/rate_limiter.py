@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import openai
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+# 说明服务端过载的错误：触发并发乘性减小
+THROTTLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APITimeoutError,
+)
+# 可重试但不代表过载的错误（如网络抖动）
+RETRYABLE_ERRORS = THROTTLE_ERRORS + (openai.APIConnectionError,)
+
+DEFAULT_LIMITS = {
+    "requests_per_second": 0,      # 0 表示不限制
+    "tokens_per_minute": 0,
+    "initial_concurrency": 8,
+    "min_concurrency": 1,
+    "max_concurrency": 64,
+    "decrease_factor": 0.5,
+    "base_delay": 1.0,
+    "max_delay": 30.0,
+    "max_retries": 6
+}
+
+_POLL_INTERVAL = 0.05  # 异步等待并发名额时的轮询间隔(秒)
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充量，capacity 为桶容量；rate<=0 时不限制"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """尝试取出 amount 个令牌，成功返回0，否则返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # 单次请求超过桶容量时按满桶放行，避免永远等待
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class AdaptiveRateLimiter:
+    """按提供商共享的自适应限流器
+
+    - 请求桶/令牌桶控制速率
+    - 在途并发按AIMD调整：每成功一个窗口（等于当前并发上限的请求数）加1，遇到429/5xx/超时减半
+    - 过载时设置共享的暂停截止时间，所有调用方一起退避，避免各自重试造成请求风暴
+    - 退避时间有上限并加随机抖动
+    - 同时支持线程（call）和协程（acall），状态由同一把线程锁保护
+    """
+
+    def __init__(self, name: str, **limits):
+        settings = {**DEFAULT_LIMITS, **limits}
+        self.name = name
+        self.min_concurrency = max(1, settings["min_concurrency"])
+        self.max_concurrency = max(self.min_concurrency, settings["max_concurrency"])
+        self.limit = float(min(max(settings["initial_concurrency"], self.min_concurrency), self.max_concurrency))
+        self.decrease_factor = settings["decrease_factor"]
+        self.base_delay = settings["base_delay"]
+        self.max_delay = settings["max_delay"]
+        self.max_retries = settings["max_retries"]
+        self.request_bucket = TokenBucket(settings["requests_per_second"])
+        self.token_bucket = TokenBucket(settings["tokens_per_minute"] / 60.0, settings["tokens_per_minute"])
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self.stats_counters = {"requests": 0, "throttled": 0, "retries": 0, "failures": 0}
+
+    # ---- 名额获取与释放 ----
+
+    def _try_acquire(self, cost: float) -> float:
+        """在锁内尝试获取一个在途名额和速率令牌，成功返回0，否则返回建议等待秒数"""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= int(self.limit):
+            return _POLL_INTERVAL
+        wait = self.request_bucket.reserve(1, now)
+        if wait:
+            return wait
+        wait = self.token_bucket.reserve(cost, now)
+        if wait:
+            # 请求令牌已取出，归还后再等待
+            self.request_bucket.tokens += 1
+            return wait
+        self.in_flight += 1
+        self.stats_counters["requests"] += 1
+        return 0.0
+
+    def acquire(self, cost: float = 1):
+        with self._cond:
+            while True:
+                wait = self._try_acquire(cost)
+                if not wait:
+                    return
+                self._cond.wait(timeout=wait)
+
+    async def aacquire(self, cost: float = 1):
+        while True:
+            with self._lock:
+                wait = self._try_acquire(cost)
+            if not wait:
+                return
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, throttled: bool = False, retry_after: float = None):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self._on_throttle(retry_after)
+            else:
+                self._on_success()
+            self._cond.notify_all()
+
+    # ---- AIMD ----
+
+    def _on_success(self):
+        self._successes += 1
+        if self._successes >= int(self.limit):
+            self._successes = 0
+            if self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1)
+
+    def _on_throttle(self, retry_after: float = None):
+        now = time.monotonic()
+        self.stats_counters["throttled"] += 1
+        self._successes = 0
+        # 同一波过载只减小一次，避免在途请求集中失败时把并发直接压到最小
+        if now - self._last_decrease >= self.base_delay:
+            self._last_decrease = now
+            old_limit = self.limit
+            self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+            logger.warning(f"[{self.name}] 服务过载，并发上限 {old_limit:.0f} → {self.limit:.0f}")
+        pause = retry_after if retry_after else self.base_delay
+        self.paused_until = max(self.paused_until, now + min(pause, self.max_delay))
+
+    def backoff(self, attempt: int) -> float:
+        """有上限的指数退避，带抖动（取区间后半段，保证最小等待）"""
+        cap = min(self.max_delay, self.base_delay * (2 ** max(0, attempt - 1)))
+        return random.uniform(cap / 2, cap)
+
+    @staticmethod
+    def _retry_after(error) -> float:
+        """读取服务端返回的 Retry-After 头"""
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+        try:
+            return float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+
+    # ---- 带重试的调用 ----
+
+    def call(self, fn, *args, cost: float = 1, max_retries: int = None, **kwargs):
+        """同步调用，自动限流并在可重试错误时退避重试
+
+        stream=True 时返回的流在读完或关闭前一直占用并发名额（生成仍在进行）。
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            self.acquire(cost)
+            try:
+                result = fn(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                attempt = self._handle_error(e, attempt, max_retries)
+                time.sleep(self.backoff(attempt))
+                continue
+            except BaseException:
+                self.release()
+                raise
+            if kwargs.get("stream"):
+                return _HeldStream(result, self.release)
+            self.release()
+            return result
+
+    async def acall(self, fn, *args, cost: float = 1, max_retries: int = None, **kwargs):
+        """异步调用（fn 为协程函数），自动限流并在可重试错误时退避重试，stream=True 时同 call"""
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            await self.aacquire(cost)
+            try:
+                result = await fn(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                attempt = self._handle_error(e, attempt, max_retries)
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+            except BaseException:
+                self.release()
+                raise
+            if kwargs.get("stream"):
+                return _AsyncHeldStream(result, self.release)
+            self.release()
+            return result
+
+    def _handle_error(self, error, attempt: int, max_retries: int) -> int:
+        """释放名额并记录过载，超过重试次数时抛出原错误，否则返回新的重试次数"""
+        self.release(throttled=isinstance(error, THROTTLE_ERRORS), retry_after=self._retry_after(error))
+        attempt += 1
+        if attempt >= max_retries:
+            self.stats_counters["failures"] += 1
+            logger.error(f"[{self.name}] 达到最大重试次数 {max_retries}，放弃请求: {type(error).__name__}")
+            raise error
+        self.stats_counters["retries"] += 1
+        logger.warning(f"[{self.name}] 请求失败({type(error).__name__})，第 {attempt}/{max_retries} 次重试")
+        return attempt
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "concurrency_limit": int(self.limit),
+                "in_flight": self.in_flight,
+                **self.stats_counters
+            }
+
+
+class _HeldStream:
+    """包装流式响应：读完、出错或关闭时才释放并发名额"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._release = release
+        self._released = False
+
+    def _finish(self, error=None):
+        if not self._released:
+            self._released = True
+            self._release(throttled=isinstance(error, THROTTLE_ERRORS))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+
+    def close(self):
+        try:
+            close = getattr(self._stream, "close", None)
+            if close:
+                close()
+        finally:
+            self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        # 调用方中途放弃且未关闭时兜底释放
+        self._finish()
+
+
+class _AsyncHeldStream(_HeldStream):
+    """异步流式响应的包装，语义同 _HeldStream"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._release = release
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._iterator.__anext__()
+        except StopAsyncIteration:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+
+    async def aclose(self):
+        try:
+            close = getattr(self._stream, "close", None)
+            if close:
+                await close()
+        finally:
+            self._finish()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str) -> AdaptiveRateLimiter:
+    """获取提供商共享的限流器，参数来自 rate_limits.default 与 rate_limits.<provider>"""
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            rate_limits = config.rate_limits_config
+            limits = {**rate_limits.get("default", {}), **rate_limits.get(provider, {})}
+            limiter = _limiters[provider] = AdaptiveRateLimiter(provider, **limits)
+        return limiter
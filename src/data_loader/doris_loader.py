@@ -1,16 +1,27 @@
 import os
 import logging
-from glob import glob
 import re
 from typing import List
 from pathlib import Path
 from ..vectorstore.milvus_store import MilvusStore
+from ..vectorstore.collection_generation import bump_generation
+from ..moderation.domain_profile import build_domain_profile
 from settings import config
 from ..qa.rag_engine import RAGEngine
+from .index_manifest import IndexManifest, hash_file
+from .ingest_pipeline import IngestPipeline
+from ..utils.markdown_chunker import MarkdownChunker, TokenCounter
 import hashlib
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+MANIFEST_LAYOUT = 3  # 清单/记录格式版本，变化时强制全量重建
+MAX_RECORD_VERSIONS = 16  # 与集合中 versions/urls 数组字段的容量一致
+
 class DorisLoader:
     def __init__(self, docs_path: Path):
         """
@@ -21,8 +32,22 @@ class DorisLoader:
         self.docs_path = docs_path
         self.versions = ["2.0", "2.1", "3.0"]  # 支持的版本列表
         self.latest_version = "3.0"
-        self.rag_engine = RAGEngine()  # 初始化RAG引擎
+        self._rag_engine = None  # 延迟初始化，避免子进程重复连接Milvus
+        self._chunker = None
         logger.info(f"初始化文档加载器，文档路径: {docs_path}")
+
+    @property
+    def rag_engine(self) -> RAGEngine:
+        if self._rag_engine is None:
+            self._rag_engine = RAGEngine()  # 初始化RAG引擎
+        return self._rag_engine
+
+    def __getstate__(self):
+        """多进程切分时只传递路径和版本信息，不序列化RAG引擎和分词器"""
+        state = self.__dict__.copy()
+        state["_rag_engine"] = None
+        state["_chunker"] = None
+        return state
         
     def _should_hide_version(self, version: str) -> bool:
         """判断是否需要隐藏版本号"""
@@ -45,61 +70,107 @@ class DorisLoader:
             return re.sub(r'/docs/\d+\.\d+/', '/docs/', url)
         return url
 
+    def _doc_roots(self):
+        """按版本列出需要处理的文档目录 (路径, 版本, 是否社区文档)"""
+        # 基础路径：i18n/zh-CN/
+        base_path = os.path.join(self.docs_path, "i18n", "zh-CN")
+        
+        if not os.path.exists(base_path):
+            raise FileNotFoundError(f"基础文档路径不存在: {base_path}")
+        
+        roots = []
+        # 社区文档不区分版本，只处理一次（URL不含版本号，统一归属最新版）
+        community_path = os.path.join(base_path, "docusaurus-plugin-content-docs-community")
+        if os.path.exists(community_path):
+            roots.append((community_path, self.latest_version, True))
+        
+        for version in self.versions:
+            # 版本文档
+            if version == 'dev':
+                docs_path = os.path.join(base_path, f"docusaurus-plugin-content-docs/current")
+            else:
+                docs_path = os.path.join(base_path, f"docusaurus-plugin-content-docs/version-{version}")
+            
+            if os.path.exists(docs_path):
+                roots.append((docs_path, version, False))
+            else:
+                logger.warning(f"文档路径不存在: {docs_path}")
+        return roots
+
     def load_documents(self):
         """加载所有Doris文档并按段落分割"""
         try:
-            text_chunks = []
-            
-            # 基础路径：i18n/zh-CN/
-            base_path = os.path.join(self.docs_path, "i18n", "zh-CN")
+            logger.info(f"开始加载文档，文档路径: {self.docs_path}")
             
-            if not os.path.exists(base_path):
-                raise FileNotFoundError(f"基础文档路径不存在: {base_path}")
-            
-            logger.info(f"开始加载文档，基础路径: {base_path}")
-            
-            for version in self.versions:
-                logger.info(f"处理版本: {version}")
-                
-                # 处理社区文档
-                community_path = os.path.join(base_path, "docusaurus-plugin-content-docs-community")
-                if os.path.exists(community_path):
-                    logger.info(f"处理社区文档: {community_path}")
-                    chunks = self._process_docs(community_path, version, is_community=True)
-                    text_chunks.extend(chunks)
-                    logger.info(f"社区文档处理完成，获取 {len(chunks)} 个文档块")
-                
-                # 处理版本文档
-                if version == 'dev':
-                    docs_path = os.path.join(base_path, f"docusaurus-plugin-content-docs/current")
-                else:
-                    docs_path = os.path.join(base_path, f"docusaurus-plugin-content-docs/version-{version}")
-                
-                if os.path.exists(docs_path):
-                    logger.info(f"处理版本文档: {docs_path}")
-                    chunks = self._process_docs(docs_path, version)
-                    text_chunks.extend(chunks)
-                    logger.info(f"版本文档处理完成，获取 {len(chunks)} 个文档块")
-                else:
-                    logger.warning(f"文档路径不存在: {docs_path}")
+            text_chunks = []
+            for _, chunks in self.iter_file_chunks(self._collect_doc_files()):
+                text_chunks.extend(chunks)
             
             if not text_chunks:
                 raise ValueError("未能加载到任何文档内容")
             
             logger.info(f"文档加载完成，总共获取 {len(text_chunks)} 个文档块")
-            
-            # 在加载文档时添加版本验证
-            for doc in text_chunks:
-                version = self._parse_version(doc['url'])
-                if version not in self.versions:
-                    logger.warning(f"无效版本: {version} | URL: {doc['url']}")
-                doc['version'] = version
-            
             return text_chunks
         
         except Exception as e:
             logger.error(f"加载文档失败: {str(e)}")
             raise
+
+    def _num_workers(self, file_count: int) -> int:
+        """切分进程数，配置为0时使用CPU核数"""
+        workers = config.ingest_workers or os.cpu_count() or 1
+        return max(1, min(workers, file_count))
+
+    def iter_file_chunks(self, doc_files: dict):
+        """多进程并行读取和切分文件，按提交顺序产出 (文件路径, 文档块列表)
+        
+        Args:
+            doc_files: _collect_doc_files 返回的 文件路径 -> [(版本, 是否社区文档)]
+        """
+        paths = list(doc_files)
+        targets = [doc_files[path] for path in paths]
+        workers = self._num_workers(len(paths))
+        start = time.perf_counter()
+        chunk_count = 0
+        
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = self._bounded_map(executor, paths, targets, max_pending=workers * 4)
+        else:
+            results = map(self._load_file_chunks, paths, targets)
+        
+        try:
+            for file_path, chunks in zip(paths, results):
+                chunk_count += len(chunks)
+                yield file_path, chunks
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+            elapsed = max(time.perf_counter() - start, 1e-6)
+            logger.info(
+                f"文档切分完成: {len(paths)} 个文件，{chunk_count} 个文档块，耗时 {elapsed:.1f}s "
+                f"({len(paths) / elapsed:.1f} 文件/秒，{chunk_count / elapsed:.1f} 块/秒，{workers} 进程)"
+            )
+
+    def _bounded_map(self, executor, paths, targets, max_pending):
+        """有序并行map，最多同时提交 max_pending 个任务，消费端变慢时不会堆积切分结果"""
+        pending = deque()
+        for file_path, target in zip(paths, targets):
+            pending.append(executor.submit(self._load_file_chunks, file_path, target))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def _assign_versions(self, chunks):
+        """按URL重新确定文档块版本"""
+        for doc in chunks:
+            version = self._parse_version(doc['url'])
+            if version not in self.versions:
+                logger.warning(f"无效版本: {version} | URL: {doc['url']}")
+            doc['version'] = version
+        return chunks
     
     def _clean_content(self, content):
         """清理文档内容，去除license头等无关内容"""
@@ -115,53 +186,23 @@ class DorisLoader:
         
         return content.strip()
 
+    @property
+    def chunker(self) -> MarkdownChunker:
+        """按token预算切分文档的切分器（每个进程首次使用时加载分词器）"""
+        if self._chunker is None:
+            chunking = config.chunking_config
+            self._chunker = MarkdownChunker(
+                max_tokens=chunking.get("max_tokens", 512),
+                overlap_tokens=chunking.get("overlap_tokens", 64),
+                min_chars=chunking.get("min_chars", 50),
+                token_counter=TokenCounter(chunking.get("tokenizer"))
+            )
+        return self._chunker
+
     def _split_by_headings(self, content, file_path):
-        """按Markdown标题层级精确切分文档"""
+        """按Markdown标题层级和token预算切分文档（忽略代码块内的#注释）"""
         try:
-            lines = content.split('\n')
-            chunks = []
-            current_chunk = []
-            current_headings = []
-            current_level = 0
-
-            for line in lines:
-                # 检测标题行
-                if line.startswith('#'):
-                    # 计算标题层级
-                    level = line.count('#', 0, line.find(' '))
-                    title = line.strip('#').strip()
-                    
-                    # 当遇到同级或上级标题时，提交当前块
-                    if level <= current_level and current_chunk:
-                        chunks.append({
-                            "content": '\n'.join(current_chunk),
-                            "headings": current_headings.copy(),
-                            "level": current_level
-                        })
-                        current_chunk = []
-                    
-                    # 更新当前标题路径
-                    current_headings = current_headings[:level-1] + [title]
-                    current_level = level
-                    
-                    # 添加标题到新块
-                    current_chunk.append(line)
-                else:
-                    # 非标题行添加到当前块
-                    if line.strip():
-                        current_chunk.append(line)
-
-            # 添加最后一个块
-            if current_chunk:
-                chunks.append({
-                    "content": '\n'.join(current_chunk),
-                    "headings": current_headings,
-                    "level": current_level
-                })
-
-            # 过滤空内容块
-            valid_chunks = [chunk for chunk in chunks if len(chunk["content"].strip()) > 50]
-            
+            valid_chunks = self.chunker.split(content)
             logger.debug(f"文件 {file_path} 切分为 {len(valid_chunks)} 个标题块")
             return valid_chunks
 
@@ -225,30 +266,6 @@ class DorisLoader:
             logger.error(f"处理文件失败 {file_path}: {str(e)}")
             return None
     
-    def _process_docs(self, path, version, is_community=False):
-        """处理指定路径下的所有markdown文档"""
-        chunks = []
-        file_count = 0
-        
-        for file_path in glob(os.path.join(path, "**/*.md"), recursive=True):
-            file_count += 1
-            try:
-                # 新增版本验证
-                valid_versions = ['2.0', '2.1', '3.0', 'dev']
-                if version not in valid_versions:
-                    raise ValueError(f"非法版本号: {version}")
-                
-                # 处理单个文件并获取所有文档块
-                file_chunks = self._process_markdown_file(file_path, version, is_community)
-                chunks.extend(file_chunks)
-                logger.debug(f"文件 {file_path} 分割为 {len(file_chunks)} 个文档块")
-                
-            except Exception as e:
-                logger.error(f"处理文件 {file_path} 失败: {str(e)}")
-        
-        logger.info(f"处理完成 {file_count} 个文件，生成 {len(chunks)} 个文档块")
-        return chunks
-
     def _generate_doc_url(self, file_path: str, version: str) -> str:
         """生成文档访问URL"""
         # 将文件系统路径转换为web路径
@@ -263,47 +280,301 @@ class DorisLoader:
         # 保持其他版本的路径结构
         return web_path 
 
-    def full_process(self, progress_callback=None):
-        """完整的文档处理流程"""
-        documents = self.load_documents()
+    def _collect_doc_files(self):
+        """单次遍历文档树，收集所有文档文件: 文件路径 -> [(版本, 是否社区文档)]
         
-        # 创建集合
-        milvus = MilvusStore()
-        milvus.create_collection(config.doc_collection_name)
-        
-        # 批量插入
-        total = len(documents)
-        if progress_callback:
-            progress_callback(0, total)
-        
-        records = []
-        for i, doc in enumerate(documents):
+        结果按文档分组键排序，同一文档的各版本文件相邻，便于流式合并相同内容
+        """
+        doc_files = {}
+        for path, version, is_community in self._doc_roots():
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if file_name.endswith(".md"):
+                        doc_files.setdefault(os.path.join(dir_path, file_name), []).append((version, is_community))
+        logger.info(f"共发现 {len(doc_files)} 个文档文件")
+        ordered = sorted(doc_files, key=lambda file_path: (self._doc_group_key(file_path), file_path))
+        return {file_path: doc_files[file_path] for file_path in ordered}
+
+    def _load_file_chunks(self, file_path, targets):
+        """处理单个文件在所有目标版本下的文档块"""
+        chunks = []
+        for version, is_community in targets:
+            chunks.extend(self._process_markdown_file(file_path, version, is_community))
+        return self._assign_versions(chunks)
+
+    def _doc_group_key(self, file_path) -> str:
+        """文档分组键：各版本目录下相对路径相同的文件视为同一文档"""
+        rel_path = os.path.relpath(file_path, os.path.join(self.docs_path, "i18n", "zh-CN"))
+        parts = rel_path.split(os.sep)
+        if parts[0] == "docusaurus-plugin-content-docs" and len(parts) > 2:
+            # 去掉 version-x.y / current 目录
+            parts = ["docs"] + parts[2:]
+        return "/".join(parts)
+
+    def _group_hash(self, files) -> str:
+        """文档分组的内容哈希（组内任一文件新增/变更/删除都会改变）"""
+        digest = hashlib.sha256()
+        for file_path in sorted(files):
+            digest.update(os.path.relpath(file_path, self.docs_path).encode())
+            digest.update(hash_file(file_path).encode())
+        return digest.hexdigest()
+
+    def _content_id(self, content: str) -> str:
+        """内容寻址ID：相同文本的文档块共用同一条记录和同一个向量"""
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _merge_chunks(self, chunks) -> dict:
+        """合并同一文档分组中内容相同的文档块，返回 {ID: 记录}，记录的 sources 为其所属的 (版本, URL)"""
+        required_fields = ["content", "version", "url"]
+        records = {}
+        for doc in chunks:
             # 验证必要字段
-            required_fields = ["content", "version", "url"]
             if not all(field in doc for field in required_fields):
                 logger.error(f"文档数据不完整: {doc}")
                 continue
-            
-            doc_id = hashlib.md5(doc["url"].encode()).hexdigest()
-            records.append({
-                "id": doc_id,
-                "text": doc["content"],
-                "vector": self.rag_engine.get_embedding(doc["content"]),
-                "version": doc["version"],
-                "url": doc["url"],
-                "is_community": doc.get("is_community", False)
-            })
-            
-            # 每处理50个文档触发一次进度更新
-            if progress_callback and (i % 50 == 0 or i == total-1):
-                progress_callback(i+1, total)
-        
+            doc_id = self._content_id(doc["content"])
+            record = records.get(doc_id)
+            if record is None:
+                record = records[doc_id] = {
+                    "id": doc_id,
+                    "text": doc["content"],
+                    "sources": [],
+                    "is_community": doc.get("is_community", False)
+                }
+            if [doc["version"], doc["url"]] not in record["sources"]:
+                record["sources"].append([doc["version"], doc["url"]])
+        return records
+
+    def _finalize_record(self, record, sources) -> dict:
+        """按 (版本, URL) 列表填写记录的版本和URL，以权重最高的版本作为主版本和主URL"""
+        weights = config.get_version_weights
+        record["versions"] = list(dict.fromkeys(version for version, _ in sources))[:MAX_RECORD_VERSIONS]
+        record["urls"] = list(dict.fromkeys(url for _, url in sources))[:MAX_RECORD_VERSIONS]
+        primary = max(record["versions"], key=lambda version: weights.get(version, 0))
+        record["version"] = primary
+        record["url"] = next(
+            (url for url in record["urls"] if self._parse_version(url) == primary),
+            record["urls"][0]
+        )
+        return record
+
+    def _iter_group_records(self, doc_files: dict, group_sources: dict, owners: dict):
+        """按文档分组流式产出 (分组键, 记录列表)，供入库流水线消费
+
+        跨文档重复的内容只在首次出现时写入，写入它的分组记录在 owners（ID → 分组键）；
+        各分组包含的全部文档块及其 (版本, URL) 记录在 group_sources，
+        入库后据此合并共用记录的版本和URL（见 _merge_shared_records）。
+        """
+        def emit(key, chunks):
+            records = self._merge_chunks(chunks)
+            group_sources[key] = {doc_id: record["sources"] for doc_id, record in records.items()}
+            results = []
+            for doc_id, record in records.items():
+                if doc_id in owners:
+                    logger.debug(f"跨文档重复内容已存在，稍后合并版本: {record['sources'][0][1]}")
+                    continue
+                owners[doc_id] = key
+                results.append(self._finalize_record(record, record.pop("sources")))
+            return results
+
+        group_key, group_chunks = None, []
+        for file_path, chunks in self.iter_file_chunks(doc_files):
+            key = self._doc_group_key(file_path)
+            if group_key is not None and key != group_key:
+                yield group_key, emit(group_key, group_chunks)
+                group_chunks = []
+            group_key = key
+            group_chunks.extend(chunks)
+        if group_key is not None:
+            yield group_key, emit(group_key, group_chunks)
+
+    def _merge_shared_records(self, milvus, collection_name, manifest, ids, batch_size=500):
+        """被多个文档引用的记录按清单改写为所有引用文档的版本和URL并集（分区随版本变化，先删后插）
+
+        集合中找不到的ID（首次写入它的文档失败）会把引用它的文档从清单移除，下次增量处理时重试。
+        """
+        ids = list(ids)
+        rewritten = 0
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            rows = {row["id"]: row for row in milvus.fetch_records(collection_name, batch)}
+            records = []
+            for doc_id in batch:
+                row = rows.get(doc_id)
+                if row is None:
+                    for key in manifest.references(doc_id):
+                        logger.warning(f"共用文档块 {doc_id} 不在集合中，文档 {key} 将在下次增量处理时重试")
+                        manifest.remove(key)
+                    continue
+                record = self._finalize_record(dict(row), manifest.sources(doc_id))
+                if record["versions"] != list(row["versions"]) or record["urls"] != list(row["urls"]):
+                    records.append(record)
+            if records:
+                milvus.delete_by_ids(collection_name, [record["id"] for record in records])
+                rewritten += milvus.batch_insert(collection_name, records)
+        if rewritten:
+            logger.info(f"已合并 {rewritten} 条跨文档共用记录的版本和URL")
+        return rewritten
+
+    def _rebuild_moderation_profile(self, doc_files, milvus, collection_name):
+        """文档变化后重建审核词表和主题中心，失败不影响入库结果"""
         try:
-            logger.info(f"开始插入 {len(records)} 条数据到Milvus")
-            inserted_count = milvus.batch_insert("doris_docs", records)
-            logger.info(f"数据插入完成，成功插入 {inserted_count} 条")
+            sample_size = config.moderation_config.get("centroid_sample_size", 10000)
+            build_domain_profile(list(doc_files), milvus.sample_vectors(collection_name, sample_size))
         except Exception as e:
-            logger.error(f"最终数据插入失败: {str(e)}")
+            logger.error(f"重建审核领域画像失败: {str(e)}")
+
+    def full_process(self, progress_callback=None, incremental=None):
+        """完整的文档处理流程（同步入口）"""
+        return asyncio.run(self.aprocess(progress_callback, incremental=incremental))
+
+    async def aprocess(self, progress_callback=None, incremental=None):
+        """完整的文档处理流程：解析 → 切分 → 向量化 → 写入 以流水线方式执行，内存占用与语料规模无关
+        
+        Args:
+            progress_callback: 进度回调 (已写入, 已切分)
+            incremental: 是否增量处理，None 时读取配置 ingest.incremental。
+                增量模式下仅对新增/变更文件重新切分和向量化，并删除已移除文件的文档块
+        """
+        if incremental is None:
+            incremental = config.incremental_ingest
+        collection_name = config.doc_collection_name
+        milvus = MilvusStore()
+        manifest = IndexManifest(config.ingest_manifest_path)
+        manifest_meta = {
+            "collection": collection_name,
+            "embedding_model": config.embedding_model,
+            # 向量是否归一化变化时，已入库的向量与新查询向量不可比，需要全量重建
+            "normalize": config.normalize_embeddings,
+            "chunking": config.chunking_config,
+            "layout": MANIFEST_LAYOUT,
+            "partition_by_version": config.partition_by_version,
+            # 索引参数变化（如 tune_index 选定了新索引）时需要全量重建
+            "vector_index": MilvusStore.index_params(collection_name),
+            "doc_store": milvus.doc_store(collection_name) is not None
+        }
+        
+        # 清单以文档分组为单位：同一文档各版本的文件一起切分、合并和删除
+        doc_files = self._collect_doc_files()
+        groups = {}
+        for file_path, targets in doc_files.items():
+            groups.setdefault(self._doc_group_key(file_path), {})[file_path] = targets
+        current_hashes = {key: self._group_hash(files) for key, files in groups.items()}
+        
+        stale_ids = []
+        shared_ids = set()
+        incremental_run = False
+        bulk_import = False
+        target_name = None
+        # 清单需描述别名当前指向的那一代集合（回滚后若没有恢复对应快照则需全量重建）
+        same_generation = manifest.meta.get("physical_collection") == milvus.active_collection(collection_name)
+        if incremental and milvus.has_collection(collection_name) and manifest.is_compatible(**manifest_meta) \
+                and same_generation:
+            added, changed, removed = manifest.diff(current_hashes)
+            logger.info(f"增量索引: 新增 {len(added)}，变更 {len(changed)}，删除 {len(removed)}，"
+                        f"未变化 {len(current_hashes) - len(added) - len(changed)} 个文档")
+            old_ids = set()
+            for key in changed + removed:
+                old_ids.update(manifest.chunk_ids(key))
+                manifest.remove(key)
+            # 共用的文档块只在不再被任何文档引用时删除，其余的需去掉已变更文档的版本和URL
+            stale_ids = [doc_id for doc_id in old_ids if not manifest.references(doc_id)]
+            shared_ids = old_ids.difference(stale_ids)
+            pending = added + changed
+            incremental_run = True
+        else:
+            if incremental:
+                logger.info("索引清单为空、嵌入模型变化、集合已回滚或集合不存在，执行全量重建")
+            # 全量重建写入新一代集合（离线批量导入，或先写数据、写完后再建索引），完成后切换别名，期间线上检索不受影响
+            bulk_import = config.bulk_import_config.get("enabled", False)
+            if not bulk_import:
+                target_name = milvus.next_collection_version(collection_name)
+                milvus.create_collection(collection_name, with_index=False, target_name=target_name)
+            manifest.clear(**manifest_meta)
+            pending = list(current_hashes)
+        
+        lexical_index = milvus.lexical_index(collection_name)
+        if incremental_run and lexical_index is not None and not len(lexical_index):
+            # 已有集合首次启用混合检索：先从集合数据补建BM25索引
+            milvus.rebuild_lexical_index(collection_name)
+        
+        if stale_ids:
+            milvus.delete_by_ids(collection_name, stale_ids)
+        
+        # 全量重建使用批量导入文件或列式批量写入（异步提交，写完后flush一次并建索引），增量处理逐批删除后写入
+        if bulk_import:
+            writer = milvus.bulk_importer(collection_name)
+        else:
+            writer = None if incremental_run else milvus.bulk_writer(collection_name, target_name=target_name)
+        
+        def write_records(records):
+            if writer:
+                return writer.write(records)
+            # 先删除待写入的ID，保证中断后重跑不会产生重复主键
+            milvus.delete_by_ids(collection_name, [record["id"] for record in records])
+            return milvus.batch_insert(collection_name, records)
+        
+        ingest_config = config.ingest_config
+        group_sources, owners = {}, {}
+        pipeline = IngestPipeline(
+            chunk_source=self._iter_group_records(
+                {file_path: targets for key in pending for file_path, targets in groups[key].items()},
+                group_sources, owners
+            ),
+            embed_fn=self.rag_engine.aembed_documents,
+            write_fn=write_records,
+            batch_size=ingest_config.get("batch_size", 50),
+            queue_depth=ingest_config.get("queue_depth", 4),
+            embed_concurrency=ingest_config.get("embed_concurrency", 4)
+        )
+        try:
+            stats = await pipeline.run(progress_callback)
+        except BaseException:
+            if writer:
+                await asyncio.to_thread(writer.abort)
             raise
+        if bulk_import:
+            # 导入失败时抛出异常，线上集合和清单保持不变
+            write_stats = await asyncio.to_thread(writer.finish)
+            logger.info(f"批量导入速度: {write_stats['rows_per_sec']} 条/秒")
+        elif writer:
+            try:
+                write_stats = await asyncio.to_thread(writer.close)
+            except BaseException:
+                await asyncio.to_thread(writer.abort)
+                raise
+            if writer.failed_ids:
+                pipeline.discard_ids(writer.failed_ids)
+            logger.info(f"全量写入速度: {write_stats['rows_per_sec']} 条/秒")
+            await asyncio.to_thread(milvus.activate, collection_name, target_name)
+        
+        for key in pipeline.file_chunk_ids:
+            # 共用文档块由首个包含它的分组写入，该分组失败时引用它的分组也不记入清单，下次增量处理时一并重试
+            failed_owners = {owners[doc_id] for doc_id in group_sources[key]
+                             if owners.get(doc_id, key) not in pipeline.file_chunk_ids}
+            if failed_owners:
+                logger.warning(f"文档 {key} 共用的文档块随 {sorted(failed_owners)} 写入失败，下次增量处理时重试")
+                pipeline.failed_files.add(key)
+                continue
+            manifest.update(key, current_hashes[key], group_sources[key])
+            shared_ids.update(doc_id for doc_id in group_sources[key] if len(manifest.references(doc_id)) > 1)
+        if shared_ids:
+            await asyncio.to_thread(self._merge_shared_records, milvus, collection_name, manifest, shared_ids)
+        physical_name = milvus.active_collection(collection_name)
+        manifest.meta["physical_collection"] = physical_name
+        manifest.save(snapshot=physical_name)
+        manifest.prune_snapshots(milvus.collection_versions(collection_name))
+        doc_store = milvus.doc_store(collection_name)
+        if doc_store:
+            doc_store.compact(config.doc_store_config.get("compact_garbage_ratio", 0.5))
+        if stale_ids or shared_ids or stats["inserted"] or not incremental_run:
+            # 集合内容已变化，依赖旧数据的回答缓存随之失效
+            bump_generation(collection_name)
+            self._rebuild_moderation_profile(doc_files, milvus, collection_name)
         
-        return total 
\ No newline at end of file
+        if self.rag_engine.embedding_cache:
+            logger.info(f"嵌入缓存统计: {self.rag_engine.embedding_cache.stats()}")
+        if pipeline.failed_files:
+            logger.error(f"{len(pipeline.failed_files)} 个文档入库失败，下次增量处理时将重试")
+        return stats["chunks"]
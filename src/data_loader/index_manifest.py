@@ -0,0 +1,151 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(file_path) -> str:
+    """计算文件内容的sha256摘要"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IndexManifest:
+    """增量索引清单：文档键 → 内容哈希 → 文档块ID及其在该文档中的 (版本, URL)
+
+    内容相同的文档块在多个文档中共用一条记录，清单按文档块ID维护引用它的文档，
+    只有不再被任何文档引用的ID才能删除，记录的版本和URL为所有引用文档的并集。
+    """
+
+    def __init__(self, manifest_path: Path):
+        self.manifest_path = Path(manifest_path)
+        self.meta = {}
+        self.files = {}
+        self._refs = {}  # 文档块ID → 引用它的文档键集合
+        self._load()
+
+    def _load(self):
+        """从磁盘加载清单，文件不存在或损坏时视为空清单"""
+        if not self.manifest_path.exists():
+            logger.info(f"索引清单不存在，将进行全量索引: {self.manifest_path}")
+            return
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.meta = data.get("meta", {})
+            self.files = data.get("files", {})
+            for key, entry in self.files.items():
+                for doc_id in entry.get("chunks", {}):
+                    self._refs.setdefault(doc_id, set()).add(key)
+            logger.info(f"加载索引清单完成，共 {len(self.files)} 个文档")
+        except Exception as e:
+            logger.error(f"索引清单读取失败，将进行全量索引: {str(e)}")
+            self.meta = {}
+            self.files = {}
+            self._refs = {}
+
+    def save(self, snapshot: str = None):
+        """原子写入清单，避免中途失败留下半截文件
+
+        Args:
+            snapshot: 清单描述的物理集合名（蓝绿重建的某一代），同时保存一份该代的快照，回滚时恢复
+        """
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(self.manifest_path.suffix + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"meta": self.meta, "files": self.files}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+        if snapshot:
+            shutil.copyfile(self.manifest_path, self._snapshot_path(snapshot))
+        logger.info(f"索引清单已保存: {self.manifest_path}（{len(self.files)} 个文档）")
+
+    def _snapshot_path(self, snapshot: str) -> Path:
+        return self.manifest_path.with_name(f"{self.manifest_path.stem}.{snapshot}{self.manifest_path.suffix}")
+
+    def restore(self, snapshot: str) -> bool:
+        """用某一代集合的快照替换当前清单（集合回滚后调用），没有快照时返回False"""
+        snapshot_path = self._snapshot_path(snapshot)
+        if not snapshot_path.exists():
+            return False
+        tmp_path = self.manifest_path.with_suffix(self.manifest_path.suffix + ".tmp")
+        shutil.copyfile(snapshot_path, tmp_path)
+        os.replace(tmp_path, self.manifest_path)
+        self.meta, self.files, self._refs = {}, {}, {}
+        self._load()
+        logger.info(f"索引清单已恢复为 {snapshot} 的快照")
+        return True
+
+    def prune_snapshots(self, keep):
+        """删除已不存在的各代集合的快照"""
+        keep = set(keep)
+        prefix, suffix = self.manifest_path.stem + ".", self.manifest_path.suffix
+        for path in self.manifest_path.parent.glob(f"{prefix}*{suffix}"):
+            if path.name[len(prefix):-len(suffix)] not in keep:
+                path.unlink(missing_ok=True)
+
+    def clear(self, **meta):
+        """清空清单（全量重建时使用）"""
+        self.meta = dict(meta)
+        self.files = {}
+        self._refs = {}
+
+    def is_compatible(self, **meta) -> bool:
+        """清单为空或元数据（如嵌入模型）变化时不能做增量"""
+        if not self.files:
+            return False
+        return all(self.meta.get(key) == value for key, value in meta.items())
+
+    def diff(self, current_hashes: dict):
+        """对比当前内容哈希，返回 (新增, 变更, 删除) 的文档键列表"""
+        added = [key for key in current_hashes if key not in self.files]
+        changed = [
+            key for key, content_hash in current_hashes.items()
+            if key in self.files and self.files[key]["hash"] != content_hash
+        ]
+        removed = [key for key in self.files if key not in current_hashes]
+        return added, changed, removed
+
+    def chunk_ids(self, key: str) -> list:
+        entry = self.files.get(key)
+        return list(entry["chunks"]) if entry else []
+
+    def references(self, doc_id: str) -> set:
+        """引用该文档块ID的文档键"""
+        return set(self._refs.get(doc_id, ()))
+
+    def sources(self, doc_id: str) -> list:
+        """该文档块在所有引用文档中的 (版本, URL)，按文档键排序、去重"""
+        pairs = []
+        for key in sorted(self._refs.get(doc_id, ())):
+            for version, url in self.files[key]["chunks"][doc_id]:
+                if [version, url] not in pairs:
+                    pairs.append([version, url])
+        return pairs
+
+    def update(self, key: str, content_hash: str, chunks: dict):
+        """记录文档的内容哈希和文档块，chunks 为 {文档块ID: [(版本, URL), ...]}"""
+        self.remove(key)
+        self.files[key] = {
+            "hash": content_hash,
+            "chunks": {doc_id: [list(pair) for pair in pairs] for doc_id, pairs in chunks.items()}
+        }
+        for doc_id in chunks:
+            self._refs.setdefault(doc_id, set()).add(key)
+
+    def remove(self, key: str):
+        entry = self.files.pop(key, None)
+        if not entry:
+            return
+        for doc_id in entry["chunks"]:
+            keys = self._refs.get(doc_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._refs[doc_id]
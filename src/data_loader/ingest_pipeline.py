@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()  # 队列结束标记
+
+
+class IngestPipeline:
+    """流式文档入库流水线
+
+    解析/切分 → 向量化 → 写入 三个阶段通过有界队列连接，下游变慢时上游自动阻塞（背压），
+    同一时刻驻留内存的文档块数量只与 queue_depth * batch_size 有关，与语料规模无关。
+    """
+
+    def __init__(self, chunk_source, embed_fn, write_fn, batch_size=50, queue_depth=4, embed_concurrency=4):
+        """
+        Args:
+            chunk_source: 同步迭代器，产出 (文件键, 记录列表)，记录需包含 id 和 text
+            embed_fn: 异步函数，输入文本列表，按顺序返回向量列表
+            write_fn: 同步函数，输入带向量的记录列表，返回成功写入条数
+            batch_size: 每批向量化/写入的记录数
+            queue_depth: 阶段间队列可缓冲的批次数
+            embed_concurrency: 同时进行的向量化批次数
+        """
+        self.chunk_source = chunk_source
+        self.embed_fn = embed_fn
+        self.write_fn = write_fn
+        self.batch_size = max(1, batch_size)
+        self.queue_depth = max(1, queue_depth)
+        self.embed_concurrency = max(1, embed_concurrency)
+        self.stats = {"files": 0, "chunks": 0, "embedded": 0, "inserted": 0, "failed": 0}
+        self.file_chunk_ids = {}
+        self.failed_files = set()
+
+    async def run(self, progress_callback=None) -> dict:
+        """运行流水线，返回统计信息；成功写入的文件及其文档块ID记录在 file_chunk_ids"""
+        chunk_queue = asyncio.Queue(maxsize=self.queue_depth)
+        write_queue = asyncio.Queue(maxsize=self.queue_depth)
+        self._progress_callback = progress_callback
+        start = time.perf_counter()
+
+        embedders = [asyncio.create_task(self._embed_stage(chunk_queue, write_queue))
+                     for _ in range(self.embed_concurrency)]
+        writer = asyncio.create_task(self._write_stage(write_queue))
+        try:
+            await self._parse_stage(chunk_queue)
+            for _ in embedders:
+                await chunk_queue.put(_STOP)
+            await asyncio.gather(*embedders)
+            await write_queue.put(_STOP)
+            await writer
+        except BaseException:
+            for task in embedders + [writer]:
+                task.cancel()
+            await asyncio.gather(*embedders, writer, return_exceptions=True)
+            raise
+
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        logger.info(
+            f"入库流水线完成: {self.stats['files']} 个文件，{self.stats['chunks']} 个文档块，"
+            f"写入 {self.stats['inserted']} 条，失败 {self.stats['failed']} 条，耗时 {elapsed:.1f}s "
+            f"({self.stats['inserted'] / elapsed:.1f} 条/秒)"
+        )
+        return self.stats
+
+    async def _parse_stage(self, chunk_queue):
+        """逐文件拉取切分结果并按批次放入队列"""
+        loop = asyncio.get_running_loop()
+        source = iter(self.chunk_source)
+        batch = []
+        try:
+            while True:
+                # 切分迭代器是同步阻塞的，放到线程中取下一项，避免阻塞事件循环
+                item = await loop.run_in_executor(None, next, source, _STOP)
+                if item is _STOP:
+                    break
+                key, records = item
+                self.stats["files"] += 1
+                self.stats["chunks"] += len(records)
+                self.file_chunk_ids[key] = [record["id"] for record in records]
+                for record in records:
+                    record["_file_key"] = key
+                    batch.append(record)
+                    if len(batch) >= self.batch_size:
+                        await chunk_queue.put(batch)
+                        batch = []
+            if batch:
+                await chunk_queue.put(batch)
+        finally:
+            with contextlib.suppress(ValueError):
+                if hasattr(source, "close"):
+                    source.close()
+
+    async def _embed_stage(self, chunk_queue, write_queue):
+        while True:
+            batch = await chunk_queue.get()
+            if batch is _STOP:
+                return
+            try:
+                vectors = await self.embed_fn([record["text"] for record in batch])
+                for record, vector in zip(batch, vectors):
+                    record["vector"] = vector
+                self.stats["embedded"] += len(batch)
+                await write_queue.put(batch)
+            except Exception as e:
+                logger.error(f"批次向量化失败，跳过 {len(batch)} 条: {str(e)}")
+                self._mark_failed(batch)
+
+    async def _write_stage(self, write_queue):
+        while True:
+            batch = await write_queue.get()
+            if batch is _STOP:
+                return
+            try:
+                rows = [{k: v for k, v in record.items() if k != "_file_key"} for record in batch]
+                inserted = await asyncio.to_thread(self.write_fn, rows)
+                if inserted < len(batch):
+                    raise RuntimeError(f"部分数据写入失败: {inserted}/{len(batch)}")
+                self.stats["inserted"] += inserted
+            except Exception as e:
+                logger.error(f"批次写入失败: {str(e)}")
+                self._mark_failed(batch)
+            if self._progress_callback:
+                self._progress_callback(self.stats["inserted"], self.stats["chunks"])
+
+    def discard_ids(self, ids):
+        """写入方事后报告失败的文档块（如异步批量写入），将其所属文件标记为失败"""
+        ids = set(ids)
+        failed_keys = [key for key, chunk_ids in self.file_chunk_ids.items() if ids.intersection(chunk_ids)]
+        for key in failed_keys:
+            self.failed_files.add(key)
+            del self.file_chunk_ids[key]
+        self.stats["inserted"] -= len(ids)
+        self.stats["failed"] += len(ids)
+
+    def _mark_failed(self, batch):
+        self.stats["failed"] += len(batch)
+        for record in batch:
+            key = record["_file_key"]
+            self.failed_files.add(key)
+            self.file_chunk_ids.pop(key, None)
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from typing import List
 from .base_loader import BaseLoader
@@ -10,6 +11,8 @@ from ..exceptions.jira_exceptions import JiraGatewayError, JiraConnectionError
 
 logger = logging.getLogger(__name__)
 
+_STOP = object()  # 迭代结束标记
+
 class JiraLoader(BaseLoader):
     def __init__(self, config: dict):
         self.client = JiraClient(
@@ -45,6 +48,69 @@ class JiraLoader(BaseLoader):
             logger.error(f"未知错误: {str(e)}")
             raise
 
+    async def _aiter_records(self, milvus, embed_fn, full_refresh: bool, batch_size: int):
+        """逐批向量化Jira文档，产出映射为 jira_issues 字段的记录列表
+
+        Jira接口是同步分页请求，在线程中逐条拉取，不阻塞事件循环上的其他请求。
+        """
+        loop = asyncio.get_running_loop()
+        source = iter(self.load_documents(full_refresh=full_refresh))
+        batch = []
+        try:
+            while True:
+                doc = await loop.run_in_executor(None, next, source, _STOP)
+                if doc is _STOP:
+                    break
+                if doc:
+                    batch.append(doc)
+                if len(batch) >= batch_size:
+                    vectors = await embed_fn([doc["text"] for doc in batch])
+                    yield [milvus.jira_record(doc, vector) for doc, vector in zip(batch, vectors)]
+                    batch = []
+            if batch:
+                vectors = await embed_fn([doc["text"] for doc in batch])
+                yield [milvus.jira_record(doc, vector) for doc, vector in zip(batch, vectors)]
+        finally:
+            source.close()
+
+    async def aupsert(self, milvus, embed_fn, full_refresh: bool = False, batch_size: int = 50) -> dict:
+        """同步到 jira_issues：按批向量化后批量upsert；全量刷新时删除Jira中已不存在的问题
+
+        Milvus调用（建集合、写入、遍历主键、加载和compact）都在线程中执行，不阻塞事件循环。
+
+        Args:
+            milvus: MilvusStore
+            embed_fn: 异步函数，输入文本列表，按顺序返回向量列表
+        Returns:
+            {"upserted": 条数, "deleted": 条数}
+        """
+        await asyncio.to_thread(milvus.ensure_jira_collection)
+        upserter = await asyncio.to_thread(milvus.upserter, "jira_issues")
+        seen_ids = set()
+        try:
+            async for records in self._aiter_records(milvus, embed_fn, full_refresh, batch_size):
+                await asyncio.to_thread(upserter.add, records)
+                seen_ids.update(record["id"] for record in records)
+            if full_refresh:
+                existing = await asyncio.to_thread(lambda: list(milvus.collection_ids("jira_issues")))
+                await asyncio.to_thread(upserter.delete, [doc_id for doc_id in existing if doc_id not in seen_ids])
+        except BaseException as e:
+            # 与 with 语句相同：出错时仍写出已累积的数据
+            await asyncio.to_thread(upserter.__exit__, type(e), e, e.__traceback__)
+            raise
+        return await asyncio.to_thread(upserter.close)
+
+    async def abulk_import(self, milvus, embed_fn, batch_size: int = 50) -> int:
+        """全量刷新：逐批向量化后写入批量导入文件，导入新一代集合后切换 jira_issues 别名，返回导入条数"""
+        importer = await asyncio.to_thread(milvus.bulk_importer, "jira_issues")
+        try:
+            async for records in self._aiter_records(milvus, embed_fn, True, batch_size):
+                await asyncio.to_thread(importer.write, records)
+        except BaseException:
+            await asyncio.to_thread(importer.abort)
+            raise
+        return (await asyncio.to_thread(importer.finish))["rows"]
+
     def _process_issue(self, issue) -> dict:
         """处理单个Jira问题"""
         try:
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+import numpy as np
+from settings import config
+from .keyword_automaton import KeywordAutomaton
+
+logger = logging.getLogger(__name__)
+
+HEADING_PATTERN = re.compile(r'^#{1,6}\s+(.+?)\s*#*\s*$')
+# SQL函数/语句文档以函数名或语句名命名（如 array-contains.md、CREATE-TABLE.md）
+SQL_DOC_DIRS = ("sql-functions", "sql-statements")
+IGNORED_STEMS = {"index", "overview", "readme", "_category_"}
+
+
+def _clean_heading(heading: str) -> str:
+    heading = re.sub(r'\{#[^}]*\}', '', heading)            # 锚点
+    heading = re.sub(r'\[([^\]]*)\]\([^)]*\)', r'\1', heading)  # 链接
+    heading = re.sub(r'[`*_~]+(?=\S)|(?<=\S)[`*_~]+', '', heading)
+    return re.sub(r'\s+', ' ', heading).strip().lower()
+
+
+def _is_term(term: str) -> bool:
+    """过滤过短的词：纯ASCII至少3个字符，含中文至少2个字符，纯数字/版本号不要"""
+    if not term or re.fullmatch(r'[\d.\s\-v]+', term):
+        return False
+    return len(term) >= (3 if term.isascii() else 2)
+
+
+def _iter_headings(content: str):
+    in_code = False
+    for line in content.splitlines():
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+            continue
+        if not in_code:
+            match = HEADING_PATTERN.match(line)
+            if match:
+                yield _clean_heading(match.group(1))
+
+
+def build_vocabulary(doc_paths, max_df_ratio: float = 0.01, min_max_df: int = 5) -> list:
+    """从文档标题和SQL函数/语句文件名中提取领域词表
+
+    同名文档（不同版本的副本）只计一次；出现在过多文档中的标题（如"示例"、"语法"）是结构性标题，予以剔除。
+    """
+    heading_docs = {}
+    sql_terms = set()
+    for path in map(Path, doc_paths):
+        stem = path.stem.lower()
+        if stem in IGNORED_STEMS:
+            continue
+        if any(part in SQL_DOC_DIRS for part in path.parts):
+            sql_terms.update({stem.replace("-", "_"), stem.replace("-", " ")})
+        try:
+            content = path.read_text(encoding='utf-8', errors='ignore')
+        except OSError as e:
+            logger.warning(f"读取文档失败 {path}: {e}")
+            continue
+        for heading in set(_iter_headings(content)):
+            heading_docs.setdefault(heading, set()).add(stem)
+
+    doc_count = len({Path(p).stem.lower() for p in doc_paths})
+    max_df = max(min_max_df, int(doc_count * max_df_ratio))
+    headings = {heading for heading, docs in heading_docs.items() if len(docs) <= max_df and len(heading) <= 40}
+    sql_terms = {term for term in sql_terms if len(term) >= 4}
+    return sorted(term for term in headings | sql_terms if _is_term(term))
+
+
+def build_centroids(vectors, k: int = 16, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """球面k-means：返回 k 个归一化的文档主题中心"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    k = min(k, len(vectors))
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for index in range(k):
+            members = vectors[assignment == index]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[index] = centroid / max(np.linalg.norm(centroid), 1e-12)
+    return centroids
+
+
+def save_profile(vocabulary: list, centroids: np.ndarray = None):
+    """写入词表和主题中心（原子替换，运行中的服务在下次审核时自动加载）"""
+    vocabulary_path = config.moderation_vocabulary_path
+    vocabulary_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = vocabulary_path.with_suffix(vocabulary_path.suffix + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(vocabulary, f, ensure_ascii=False)
+    os.replace(tmp_path, vocabulary_path)
+
+    if centroids is not None:
+        centroids_path = config.moderation_centroids_path
+        centroids_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = centroids_path.with_name(centroids_path.stem + ".tmp.npy")
+        np.save(tmp_path, centroids.astype(np.float32))
+        os.replace(tmp_path, centroids_path)
+    logger.info(f"审核词表已更新: {len(vocabulary)} 个词"
+                + (f"，{len(centroids)} 个主题中心" if centroids is not None else ""))
+
+
+def build_domain_profile(doc_paths, sample_vectors=None):
+    """入库完成后调用：重建审核词表和主题中心"""
+    moderation_config = config.moderation_config
+    vocabulary = build_vocabulary(doc_paths, max_df_ratio=moderation_config.get("vocabulary_max_df_ratio", 0.01))
+    centroids = None
+    if sample_vectors is not None and len(sample_vectors):
+        sample_vectors = np.asarray(sample_vectors, dtype=np.float32)
+        centroids = build_centroids(sample_vectors, k=moderation_config.get("centroids", 16))
+        # 文档自身到最近主题中心的相似度分布，供设置 centroid_accept/centroid_reject 参考
+        norms = np.maximum(np.linalg.norm(sample_vectors, axis=1), 1e-12)
+        similarities = np.max(sample_vectors @ centroids.T, axis=1) / norms
+        p5, p50 = np.percentile(similarities, [5, 50])
+        logger.info(f"文档到最近主题中心的相似度: P5={p5:.3f}，P50={p50:.3f}")
+    save_profile(vocabulary, centroids)
+    return vocabulary, centroids
+
+
+class DomainProfile:
+    """审核使用的领域画像：关键词自动机 + 文档主题中心
+
+    文件由入库进程写入，服务进程按 (inode, mtime) 检测变化后重新加载。
+    """
+
+    def __init__(self, keywords=()):
+        self.keywords = list(keywords)
+        self.automaton = KeywordAutomaton(self.keywords)
+        self.centroids = None
+        self._signatures = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(path: Path):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def refresh(self):
+        """词表或主题中心文件变化时重新加载"""
+        vocabulary_path = config.moderation_vocabulary_path
+        centroids_path = config.moderation_centroids_path
+        signatures = (self._signature(vocabulary_path), self._signature(centroids_path))
+        if signatures == self._signatures:
+            return
+        with self._lock:
+            if signatures == self._signatures:
+                return
+            vocabulary = []
+            if signatures[0]:
+                try:
+                    with open(vocabulary_path, 'r', encoding='utf-8') as f:
+                        vocabulary = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    logger.error(f"加载审核词表失败: {e}")
+            self.automaton = KeywordAutomaton(self.keywords + vocabulary)
+            self.centroids = None
+            if signatures[1]:
+                try:
+                    self.centroids = np.load(centroids_path).astype(np.float32)
+                except (OSError, ValueError) as e:
+                    logger.error(f"加载主题中心失败: {e}")
+            self._signatures = signatures
+            logger.info(f"审核领域画像已加载: {len(self.automaton)} 个词，"
+                        f"{0 if self.centroids is None else len(self.centroids)} 个主题中心")
+
+    def match_keyword(self, query: str):
+        self.refresh()
+        return self.automaton.find(query)
+
+    def similarity(self, query_vector) -> float:
+        """问题向量与最近文档主题中心的余弦相似度，没有主题中心时返回None"""
+        self.refresh()
+        if self.centroids is None:
+            return None
+        vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm or vector.shape[0] != self.centroids.shape[1]:
+            return None
+        return float(np.max(self.centroids @ (vector / norm)))
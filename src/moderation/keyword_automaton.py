@@ -0,0 +1,91 @@
+from collections import deque
+
+
+def _char_class(char: str):
+    """ASCII字母（含下划线）与数字分属不同类别，其余字符不构成单词"""
+    if not char.isascii():
+        return None
+    if char.isalpha() or char == "_":
+        return "alpha"
+    if char.isdigit():
+        return "digit"
+    return None
+
+
+def _joined(a: str, b: str) -> bool:
+    """相邻两个字符属于同一单词：同为字母或同为数字（doris3.0 中的 doris 可以命中，summer 中的 sum 不能）"""
+    cls = _char_class(a)
+    return cls is not None and cls == _char_class(b)
+
+
+class KeywordAutomaton:
+    """Aho-Corasick 多模式匹配自动机
+
+    一次扫描即可判断文本是否包含词表中的任意词，耗时与词表大小无关。
+    词表和文本统一转小写；ASCII字母/数字开头或结尾的词要求在单词边界上命中，避免 sum 匹配到 summer；
+    字母与数字之间视为边界，doris3.0、doris2.1 这类带版本号的写法中 doris 仍可命中。
+    """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]  # 状态 → 以该状态结尾的最长模式
+        self.size = 0
+        for pattern in patterns:
+            self._add(pattern.strip().lower())
+        self._build()
+
+    def _add(self, pattern: str):
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+            state = next_state
+        if self._output[state] is None:
+            self.size += 1
+        self._output[state] = [pattern]
+
+    def _build(self):
+        """按广度优先计算失败指针，并把失败链上的输出合并到当前状态"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                inherited = self._output[self._fail[next_state]]
+                if inherited:
+                    self._output[next_state] = (self._output[next_state] or []) + inherited
+
+    def iter_matches(self, text: str):
+        """按出现顺序产出命中的词"""
+        text = text.lower()
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern in self._output[state] or ():
+                start = end - len(pattern) + 1
+                if start > 0 and _joined(pattern[0], text[start - 1]):
+                    continue
+                if end + 1 < len(text) and _joined(pattern[-1], text[end + 1]):
+                    continue
+                yield pattern
+
+    def find(self, text: str):
+        """返回第一个命中的词，未命中返回None"""
+        return next(self.iter_matches(text), None)
+
+    def __len__(self):
+        return self.size
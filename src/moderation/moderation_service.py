@@ -1,55 +1,159 @@
+import inspect
 import logging
+import threading
 import settings
 from settings import config
 from openai import OpenAI  # 直接导入OpenAI客户端
+from src.clients.rate_limiter import get_rate_limiter
+from src.clients.llm_client import async_clients
+from .domain_profile import DomainProfile
+from .verdict_cache import VerdictCache
 
 logger = logging.getLogger(__name__)
 
 class ModerationService:
+    """分级审核：结论缓存 → 领域词自动机 → 问题向量与文档主题中心的相似度 → 大模型
+
+    前三级均在本地完成，只有相似度落在 centroid_reject 与 centroid_accept 之间的模糊问题才调用大模型。
+    """
+
     def __init__(self):
         self.client = self._init_client()
         self.keywords = config.moderation_keywords
         self.model_name = config.moderation_model
         self.temperature = config.moderation_temperature
         self.max_tokens = config.moderation_max_tokens
+        self.provider = config.moderation_provider
+        self.rate_limiter = get_rate_limiter(self.provider)
+        moderation_config = config.moderation_config
+        self.profile = DomainProfile(self.keywords)
+        self.centroid_accept = moderation_config.get("centroid_accept", 0.6)
+        self.centroid_reject = moderation_config.get("centroid_reject", 0.3)
+        cache_config = moderation_config.get("verdict_cache", {})
+        self.verdict_cache = VerdictCache(
+            max_entries=cache_config.get("max_entries", 10000),
+            ttl_seconds=cache_config.get("ttl_seconds", 3600)
+        ) if cache_config.get("enabled", True) else None
+        self.tier_counts = {"cache": 0, "keyword": 0, "centroid": 0, "model": 0, "fallback": 0}
+        self._stats_lock = threading.Lock()
 
     def _init_client(self):
         from openai import OpenAI
         provider = config.moderation_provider
         return OpenAI(
             api_key=config.llm_api_key(provider=provider),
-            base_url=config.llm_endpoint(provider=provider)
+            base_url=config.llm_endpoint(provider=provider),
+            max_retries=0  # 重试由限流器统一处理
         )
 
-    def check_relevance(self, query: str) -> bool:
-        """审核查询相关性"""
+    def check_relevance(self, query: str, query_vector=None) -> bool:
+        """审核查询相关性
+
+        Args:
+            query_vector: 问题向量，或返回问题向量的函数（推测执行时向量在其他线程中生成，仅在需要时等待）
+        """
         logger.info(f"开始审核问题: {query}")
+        verdict = self._local_check(query, query_vector)
+        if verdict is None:
+            if config.get_enable_model_check:
+                verdict = self._record("model", query, self._model_check(query))
+            else:
+                verdict = self._record("fallback", query, config.get_fallback_strategy == "allow")
+        return verdict
+
+    async def acheck_relevance(self, query: str, query_vector=None) -> bool:
+        """异步审核查询相关性，query_vector 可以是向量、协程或返回向量/可等待对象的函数"""
+        logger.info(f"开始审核问题: {query}")
+        verdict = self._local_check(query, None)
+        if verdict is None and query_vector is not None:
+            try:
+                vector = query_vector() if callable(query_vector) else query_vector
+                if inspect.isawaitable(vector):
+                    vector = await vector
+            except Exception as e:
+                logger.warning(f"获取问题向量失败，跳过主题相似度审核: {e}")
+            else:
+                verdict = self._centroid_check(query, vector)
+        if verdict is None:
+            if config.get_enable_model_check:
+                verdict = self._record("model", query, await self._amodel_check(query))
+            else:
+                verdict = self._record("fallback", query, config.get_fallback_strategy == "allow")
+        return verdict
+
+    def _local_check(self, query: str, query_vector):
+        """本地审核（缓存、关键词、主题相似度），无法判断时返回None"""
+        if self.verdict_cache:
+            verdict = self.verdict_cache.get(query)
+            if verdict is not None:
+                logger.info(f"审核结论缓存命中: {'通过' if verdict else '拒绝'}")
+                return self._record("cache", query, verdict)
         
         if config.get_enable_keyword and self._keyword_check(query):
-            return True
+            return self._record("keyword", query, True)
         
-        if config.get_enable_model_check:
-            return self._model_check(query)
-        
-        return config.get_fallback_strategy == "allow"
+        if query_vector is None or inspect.iscoroutinefunction(query_vector):
+            return None
+        try:
+            vector = query_vector() if callable(query_vector) else query_vector
+        except Exception as e:
+            logger.warning(f"获取问题向量失败，跳过主题相似度审核: {e}")
+            return None
+        return self._centroid_check(query, vector)
 
     def _keyword_check(self, query: str) -> bool:
-        """关键词匹配审核"""
-        query_lower = query.lower()
-        if any(kw in query_lower for kw in self.keywords):
-            logger.info(f"关键词匹配通过: {query}")
+        """领域词匹配审核（配置关键词 + 入库时从文档标题和SQL函数名构建的词表）"""
+        term = self.profile.match_keyword(query)
+        if term:
+            logger.info(f"关键词匹配通过: {term}")
             return True
         return False
 
-    def _model_check(self, query: str) -> bool:
-        """大模型审核"""
-        messages = [
+    def _centroid_check(self, query: str, query_vector):
+        """问题向量与文档主题中心足够接近时通过、明显偏离时拒绝，其余返回None"""
+        similarity = self.profile.similarity(query_vector)
+        if similarity is None:
+            return None
+        if similarity >= self.centroid_accept:
+            logger.info(f"主题相似度审核通过: {similarity:.3f}")
+            return self._record("centroid", query, True)
+        if similarity < self.centroid_reject:
+            logger.info(f"主题相似度审核拒绝: {similarity:.3f}")
+            return self._record("centroid", query, False)
+        logger.info(f"主题相似度 {similarity:.3f} 无法判断，交由模型审核")
+        return None
+
+    def _record(self, tier: str, query: str, verdict):
+        """统计各级审核的判定次数并缓存结论；模型调用失败（verdict为None）时按通过处理且不缓存"""
+        with self._stats_lock:
+            self.tier_counts[tier] += 1
+        if verdict is None:
+            return True  # 失败时默认通过
+        if self.verdict_cache and tier != "cache":
+            self.verdict_cache.put(query, verdict)
+        return verdict
+
+    def stats(self) -> dict:
+        return {
+            "tiers": dict(self.tier_counts),
+            "verdict_cache": self.verdict_cache.stats() if self.verdict_cache else None
+        }
+
+    def _build_messages(self, query: str) -> list:
+        return [
             {"role": "system", "content": "判断用户问题是否与Apache Doris数据库相关，仅回答Y/N"},
             {"role": "user", "content": f"问题：{query}"}
         ]
+
+    def _model_check(self, query: str) -> bool:
+        """大模型审核，调用失败时返回None"""
+        messages = self._build_messages(query)
         
         try:
-            response = self.client.chat.completions.create(
+            # 审核在请求路径上，少量重试后按失败处理
+            response = self.rate_limiter.call(
+                self.client.chat.completions.create,
+                max_retries=2,
                 model=self.model_name,
                 messages=messages,
                 temperature=self.temperature,
@@ -60,4 +164,22 @@ class ModerationService:
             return result
         except Exception as e:
             logger.error(f"审核查询失败: {str(e)}")
-            return True  # 失败时默认通过 
\ No newline at end of file
+            return None
+
+    async def _amodel_check(self, query: str) -> bool:
+        """异步大模型审核，调用失败时返回None"""
+        try:
+            response = await self.rate_limiter.acall(
+                async_clients.get(self.provider).chat.completions.create,
+                max_retries=2,
+                model=self.model_name,
+                messages=self._build_messages(query),
+                temperature=self.temperature,
+                max_tokens=1
+            )
+            result = response.choices[0].message.content.strip().upper() == "Y"
+            logger.info(f"模型审核结果: {'通过' if result else '拒绝'}")
+            return result
+        except Exception as e:
+            logger.error(f"审核查询失败: {str(e)}")
+            return None
@@ -0,0 +1,54 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+class VerdictCache:
+    """审核结论缓存：按归一化问题文本保存通过/拒绝结论，LRU淘汰，超过TTL失效"""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # 问题 → (结论, 写入时间)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query: str) -> str:
+        query = unicodedata.normalize("NFKC", query)
+        return re.sub(r'\s+', ' ', query.strip()).casefold()
+
+    def get(self, query: str):
+        """返回缓存的结论，未命中或已过期返回None"""
+        key = self._key(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, query: str, verdict: bool):
+        key = self._key(query)
+        with self._lock:
+            self._entries[key] = (verdict, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
@@ -0,0 +1,264 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+from src.vectorstore.collection_generation import get_generation
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryAnswerBackend:
+    """进程内存储：按最近访问顺序淘汰"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # id → (集合, 代数, 版本范围, 向量, 回答, 写入时间)
+        self._index = {}  # (集合, 代数, 版本范围) → (id列表, 向量矩阵)，写入后失效
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def candidates(self, collection: str, generation: int, scope: str):
+        """返回 (id列表, 向量矩阵)"""
+        with self._lock:
+            key = (collection, generation, scope)
+            if key not in self._index:
+                ids = [entry_id for entry_id, entry in self._entries.items() if entry[:3] == key]
+                matrix = np.stack([self._entries[i][3] for i in ids]) if ids else None
+                self._index[key] = (ids, matrix)
+            return self._index[key]
+
+    def get(self, entry_id):
+        """返回 (回答, 写入时间)，条目不存在时返回None"""
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(entry_id)
+            return entry[4], entry[5]
+
+    def put(self, collection: str, generation: int, scope: str, question: str, vector: np.ndarray, answer: str):
+        with self._lock:
+            # 新一代数据写入时清掉旧代条目
+            stale = [i for i, entry in self._entries.items() if entry[0] == collection and entry[1] != generation]
+            for entry_id in stale:
+                del self._entries[entry_id]
+            self._entries[self._next_id] = (collection, generation, scope, vector, answer, time.time())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._index.clear()
+
+    def delete(self, entry_id):
+        with self._lock:
+            if self._entries.pop(entry_id, None) is not None:
+                self._index.clear()
+
+
+class SQLiteAnswerBackend:
+    """磁盘存储（SQLite WAL），同一台机器上的多个worker共享
+
+    向量在进程内保留一份镜像，每次查询只增量读取新写入的行；
+    表中该范围的行数少于镜像时（容量淘汰、TTL过期或其他进程删除），按表中现有id收缩镜像，
+    镜像大小因此不超过 max_entries。命中后按id回表确认。
+    """
+
+    def __init__(self, path: Path, max_entries: int = 10000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._mirror = {}  # (集合, 代数, 版本范围) → {"last_id": int, "ids": list, "vectors": list, "matrix": ndarray}
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                collection TEXT NOT NULL,
+                generation INTEGER NOT NULL,
+                scope TEXT NOT NULL DEFAULT '',
+                question TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        columns = {row[1] for row in self._connect().execute("PRAGMA table_info(answers)")}
+        if "scope" not in columns:
+            # 旧版本创建的表没有版本范围列，原有条目视为未指定版本的问题
+            self._connect().execute("ALTER TABLE answers ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        self._connect().execute("DROP INDEX IF EXISTS idx_answers_gen")
+        self._connect().execute(
+            "CREATE INDEX IF NOT EXISTS idx_answers_scope ON answers (collection, generation, scope, id)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def candidates(self, collection: str, generation: int, scope: str):
+        key = (collection, generation, scope)
+        conn = self._connect()
+        with self._lock:
+            mirror = self._mirror.get(key)
+            if mirror is None:
+                # 代数变化后旧镜像不再有用
+                for old_key in [k for k in self._mirror if k[0] == collection and k[1] != generation]:
+                    del self._mirror[old_key]
+                mirror = self._mirror[key] = {"last_id": 0, "ids": [], "matrix": None}
+            rows = conn.execute(
+                "SELECT id, vector FROM answers WHERE collection = ? AND generation = ? AND scope = ? AND id > ? "
+                "ORDER BY id",
+                (collection, generation, scope, mirror["last_id"])
+            ).fetchall()
+            if rows:
+                mirror["ids"] = mirror["ids"] + [entry_id for entry_id, _ in rows]
+                vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+                mirror["matrix"] = vectors if mirror["matrix"] is None else np.concatenate([mirror["matrix"], vectors])
+                mirror["last_id"] = rows[-1][0]
+            if mirror["ids"]:
+                # 镜像包含表中该范围的全部条目，行数变少说明有条目被淘汰或删除，按表中现有id收缩镜像
+                count = conn.execute(
+                    "SELECT COUNT(*) FROM answers WHERE collection = ? AND generation = ? AND scope = ? AND id <= ?",
+                    (collection, generation, scope, mirror["last_id"])
+                ).fetchone()[0]
+                if count < len(mirror["ids"]):
+                    live = {row[0] for row in conn.execute(
+                        "SELECT id FROM answers WHERE collection = ? AND generation = ? AND scope = ? AND id <= ?",
+                        (collection, generation, scope, mirror["last_id"])
+                    )}
+                    keep = [index for index, entry_id in enumerate(mirror["ids"]) if entry_id in live]
+                    mirror["ids"] = [mirror["ids"][index] for index in keep]
+                    mirror["matrix"] = mirror["matrix"][keep] if keep else None
+            return mirror["ids"], mirror["matrix"]
+
+    def get(self, entry_id):
+        conn = self._connect()
+        row = conn.execute("SELECT answer, created FROM answers WHERE id = ?", (entry_id,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE answers SET last_access = ? WHERE id = ?", (time.time(), entry_id))
+        return row
+
+    def put(self, collection: str, generation: int, scope: str, question: str, vector: np.ndarray, answer: str):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM answers WHERE collection = ? AND generation != ?", (collection, generation))
+            conn.execute(
+                "INSERT INTO answers (collection, generation, scope, question, vector, answer, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (collection, generation, scope, question, vector.astype(np.float32).tobytes(), answer, now, now)
+            )
+            count = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, entry_id):
+        self._connect().execute("DELETE FROM answers WHERE id = ?", (entry_id,))
+
+
+class AnswerCache:
+    """语义回答缓存
+
+    以问题嵌入的余弦相似度查找历史问题，超过阈值即直接返回缓存的回答。
+    条目按集合数据代数隔离，集合重建或重新入库后旧回答自动失效；超过TTL的条目在命中时删除。
+    条目还按问题指定的文档版本隔离：检索按版本路由，"2.0 …"与"3.0 …"即使向量相近也不共用回答。
+    """
+
+    def __init__(self, backend, similarity_threshold: float = 0.95, ttl_seconds: float = 86400):
+        self.backend = backend
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cache_config: dict):
+        """按配置创建缓存，backend 为 memory（进程内）或 sqlite（多worker共享）"""
+        max_entries = cache_config.get("max_entries", 10000)
+        backend_name = cache_config.get("backend", "memory")
+        if backend_name == "sqlite":
+            backend = SQLiteAnswerBackend(cache_config.get("path", "data/answer_cache.sqlite"), max_entries)
+        elif backend_name == "memory":
+            backend = MemoryAnswerBackend(max_entries)
+        else:
+            raise ValueError(f"不支持的回答缓存后端: {backend_name}")
+        logger.info(f"回答缓存已启用: {backend_name}（相似度阈值 {cache_config.get('similarity_threshold', 0.95)}）")
+        return cls(
+            backend,
+            similarity_threshold=cache_config.get("similarity_threshold", 0.95),
+            ttl_seconds=cache_config.get("ttl_seconds", 86400)
+        )
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def generation(collection: str) -> int:
+        """查询开始时取当前代数，回答写入时沿用，避免入库期间生成的回答被记到新一代"""
+        return get_generation(collection)
+
+    @staticmethod
+    def _scope(versions) -> str:
+        """问题指定的版本集合，未指定时为空串"""
+        return ",".join(sorted(set(versions or ())))
+
+    def lookup(self, collection: str, generation: int, query_vector, versions=None):
+        """查找版本范围相同的相似问题的回答，未命中返回None"""
+        ids, matrix = self.backend.candidates(collection, generation, self._scope(versions))
+        answer = None
+        if ids:
+            scores = matrix @ self._normalize(query_vector)
+            for index in np.argsort(-scores):
+                if scores[index] < self.similarity_threshold:
+                    break
+                entry = self.backend.get(ids[index])
+                if entry is None:
+                    continue
+                cached_answer, created = entry
+                if time.time() - created > self.ttl_seconds:
+                    self.backend.delete(ids[index])
+                    continue
+                logger.info(f"回答缓存命中（相似度 {scores[index]:.4f}）")
+                answer = cached_answer
+                break
+        with self._stats_lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def store(self, collection: str, generation: int, question: str, query_vector, answer: str, versions=None):
+        if generation != get_generation(collection):
+            return  # 生成回答期间集合已更新
+        self.backend.put(collection, generation, self._scope(versions), question, self._normalize(query_vector), answer)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
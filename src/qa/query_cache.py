@@ -0,0 +1,93 @@
+import copy
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """线程安全的LRU缓存，记录命中率"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+def normalize_query(query: str) -> str:
+    """问题文本归一化：全角转半角、统一大小写、合并空白"""
+    query = unicodedata.normalize("NFKC", query)
+    return re.sub(r'\s+', ' ', query.strip()).casefold()
+
+
+class QueryCache:
+    """查询两级精确匹配缓存
+
+    - 向量层：归一化问题文本 → 查询向量
+    - 检索层：(集合, 集合代数, 查询向量哈希, 检索条件) → 检索结果
+
+    检索层键中包含集合代数，每次入库后代数加一，旧结果不会再被命中。
+    """
+
+    def __init__(self, vector_max_entries: int = 10000, search_max_entries: int = 10000):
+        self.vectors = LRUCache(vector_max_entries)
+        self.searches = LRUCache(search_max_entries)
+
+    def get_vector(self, query: str):
+        return self.vectors.get(normalize_query(query))
+
+    def put_vector(self, query: str, vector):
+        self.vectors.put(normalize_query(query), vector)
+
+    @staticmethod
+    def _search_key(collection: str, generation: int, vector, filters) -> tuple:
+        digest = hashlib.sha1(np.asarray(vector, dtype=np.float32).tobytes()).hexdigest()
+        return collection, generation, digest, repr(filters)
+
+    def get_search(self, collection: str, generation: int, vector, filters):
+        hits = self.searches.get(self._search_key(collection, generation, vector, filters))
+        # 调用方会修改结果（如写入综合评分），返回副本
+        return copy.deepcopy(hits) if hits is not None else None
+
+    def put_search(self, collection: str, generation: int, vector, filters, hits: list):
+        self.searches.put(self._search_key(collection, generation, vector, filters), copy.deepcopy(hits))
+
+    def stats(self) -> dict:
+        return {"vector": self.vectors.stats(), "search": self.searches.stats()}
@@ -3,16 +3,29 @@ from ..vectorstore.milvus_store import MilvusStore
 import re
 from settings import config
 from src.moderation.moderation_service import ModerationService
-from src.clients.llm_client import LLMClients
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from src.clients.llm_client import LLMClients, async_clients
+from src.clients.embedding_client import create_embedding_client, decode_embedding, normalize_rows, LOCAL_PROVIDER
+from src.clients.embedding_cache import EmbeddingCache
+from src.clients.rate_limiter import get_rate_limiter
+from src.qa.answer_cache import AnswerCache
+from src.qa.query_cache import QueryCache, normalize_query
+from src.vectorstore.collection_generation import get_generation
+from src.utils.markdown_chunker import TokenCounter, parse_headings
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
 import time
 import asyncio
 import openai
-import hashlib
+import weakref
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# 问题中提到的版本号，如 "2.0"、"v3.0"、"2.1.5"（取主次版本）
+VERSION_PATTERN = re.compile(r'(?<![\d.])v?(\d+\.\d+)(?:\.\d+)*')
+
 class RAGEngine:
+    REJECT_MESSAGE = "本服务仅支持Apache Doris相关咨询"
+
     def __init__(self):
         # 使用配置示例
         self.min_similarity = config.get_min_similarity
@@ -24,71 +37,93 @@ class RAGEngine:
         self.milvus_store = MilvusStore()
         self.moderation_service = ModerationService()
         self.chat_model = config.get_chat_model
-        self.max_retries = 100  # 最大重试次数
-        self.retry_delay = 1.0  # 初始重试延迟(秒)
+        self.embedding_limiter = get_rate_limiter(config.embedding_provider)
+        self.chat_limiter = get_rate_limiter(config.chat_provider)
+        self.token_counter = TokenCounter(config.chunking_config.get("tokenizer"))
+        self.embedding_client = create_embedding_client(token_counter=self.token_counter)
+        cache_config = config.embedding_cache_config
+        self.embedding_cache = EmbeddingCache(
+            cache_config.get("path", "data/embedding_cache.sqlite"),
+            max_entries=cache_config.get("max_entries", 500000)
+        ) if cache_config.get("enabled", False) else None
+        # 缓存键包含是否归一化：切换 normalize 配置后不会读到另一种形式的向量
+        self.embedding_cache_model = (f"{config.embedding_model}:normalized" if self.embedding_client.normalize
+                                      else config.embedding_model)
+        answer_cache_config = config.answer_cache_config
+        self.answer_cache = AnswerCache.from_config(answer_cache_config) if answer_cache_config.get("enabled", False) else None
+        query_cache_config = config.query_cache_config
+        self.query_cache = QueryCache(
+            vector_max_entries=query_cache_config.get("vector_max_entries", 10000),
+            search_max_entries=query_cache_config.get("search_max_entries", 10000)
+        ) if query_cache_config.get("enabled", False) else None
+        # 同步查询路径共享的线程池；异步路径按事件循环使用信号量限流
+        self._query_executor = ThreadPoolExecutor(max_workers=config.query_config.get("max_threads", 16))
+        self._query_semaphores = weakref.WeakKeyDictionary()
+        # 推测执行：审核与向量化/检索同时进行（同步路径的审核使用独立线程池，避免与查询线程池互相等待）
+        self.speculative_moderation = config.moderation_config.get("speculative", True)
+        # 两阶段检索：先取ID和分数，正文只为最终入选的文档块读取
+        self.two_phase_retrieval = config.search_config.get("two_phase", True)
+        self._speculative_executor = ThreadPoolExecutor(max_workers=config.query_config.get("max_threads", 16))
         logger.info("RAG引擎初始化成功")
 
     def _get_truncated_embedding(self, text):
-        """处理文本截断并生成嵌入"""
-        retry_count = 0
-        while True:
-            try:
-                # 添加详细日志
-                logger.debug(f"生成嵌入的文本长度: {len(text)}")
-                logger.debug(f"使用模型: {self.config.embedding_model}")
-                
-                # 预处理文本，移除多余空白
-                text = re.sub(r'\s+', ' ', text.strip())
-                
-                # 截断文本至8000字符（约对应8192 tokens）
-                max_length = 8000
-                if len(text) > max_length:
-                    logger.warning(f"文本长度超过限制，将截断至前{max_length}字符")
-                    text = text[:max_length]
-                
-                # 生成嵌入
-                response = self.clients.embedding.embeddings.create(
+        """处理文本截断并生成嵌入（远程服务的限流与重试由提供商共享的限流器处理）"""
+        try:
+            # 添加详细日志
+            logger.debug(f"生成嵌入的文本长度: {len(text)}")
+            logger.debug(f"使用模型: {self.config.embedding_model}")
+            
+            text = self._normalize_embedding_input(text)
+            
+            if self.embedding_cache:
+                cached = self.embedding_cache.get(self.embedding_cache_model, text)
+                if cached is not None:
+                    return cached
+            
+            # 生成嵌入
+            if self.config.embedding_provider == LOCAL_PROVIDER:
+                embedding = self.embedding_client.encode([text])[0]
+            else:
+                response = self.embedding_limiter.call(
+                    self.clients.embedding.embeddings.create,
                     model=self.config.embedding_model,
                     input=text,
-                    timeout=60.0  # 添加超时控制
+                    encoding_format=self.embedding_client.encoding_format,
+                    timeout=60.0,  # 添加超时控制
+                    cost=self.token_counter.count(text)
                 )
-                return response.data[0].embedding
-            
-            except openai.InternalServerError as e:
-                retry_count += 1
-                if retry_count >= self.max_retries:
-                    logger.error(f"达到最大重试次数 {self.max_retries}，放弃处理")
-                    raise
-                
-                delay = self.retry_delay * (2 ** (retry_count - 1))  # 指数退避
-                logger.warning(f"服务过载，第 {retry_count}/{self.max_retries} 次重试，{delay:.1f}秒后重试...")
-                time.sleep(delay)
-            except Exception as e:
-                logger.error(f"嵌入生成失败: {str(e)}")
-                logger.error(f"请求模型: {self.config.embedding_model}")
+                embedding = decode_embedding(response.data[0].embedding).copy()
+                if self.embedding_client.normalize:
+                    normalize_rows(embedding)
+            if self.embedding_cache:
+                self.embedding_cache.put(self.embedding_cache_model, text, embedding)
+            return embedding
+        
+        except Exception as e:
+            logger.error(f"嵌入生成失败: {str(e)}")
+            logger.error(f"请求模型: {self.config.embedding_model}")
+            if self.clients.embedding:
                 logger.error(f"服务端点: {self.clients.embedding.base_url}")
-                raise
+            raise
+
+    def _normalize_embedding_input(self, text):
+        """移除多余空白，并按嵌入模型的输入上限截断（文档块已按token预算切分，正常不会触发）"""
+        text = re.sub(r'\s+', ' ', text.strip())
+        max_tokens = self.config.chunking_config.get("model_max_tokens", 8192)
+        truncated = self.token_counter.truncate(text, max_tokens)
+        if len(truncated) < len(text):
+            logger.warning(f"文本超过嵌入模型输入上限 {max_tokens} tokens，截断 {len(text) - len(truncated)} 字符")
+        return truncated
+
+    def _build_key_text(self, text):
+        """提取标题结构（忽略代码块中的#注释），构建用于嵌入的关键文本"""
+        headings, content_lines = parse_headings(text)
+        return f"文档结构：{' → '.join(headings)}\n核心内容：" + '\n'.join(content_lines)
 
     def get_embedding(self, text):
         """生成嵌入"""
         try:
-            # 提取标题结构
-            headings = []
-            content_lines = []
-            current_heading_level = 0
-            
-            for line in text.split('\n'):
-                if line.startswith('#'):
-                    level = line.count('#', 0, line.find(' '))
-                    if level <= current_heading_level:  # 只保留最相关标题
-                        headings = headings[:level-1]
-                    headings.append(line.strip('#').strip())
-                    current_heading_level = level
-                else:
-                    content_lines.append(line)
-            
-            # 构建关键文本
-            key_text = f"文档结构：{' → '.join(headings)}\n核心内容：" + '\n'.join(content_lines[-300:])
+            key_text = self._build_key_text(text)
             
             # 截断处理（保持与之前相同的逻辑）
             return self._get_truncated_embedding(key_text)
@@ -97,249 +132,480 @@ class RAGEngine:
             logger.error(f"嵌入生成失败: {str(e)}")
             raise
     
+    async def aembed_documents(self, texts: list, concurrency: int = None) -> np.ndarray:
+        """异步批量生成文档嵌入（多条输入打包请求、并发在途），按输入顺序返回 float32 矩阵（每行一个向量）"""
+        inputs = [self._normalize_embedding_input(self._build_key_text(text)) for text in texts]
+        if not self.embedding_cache or not inputs:
+            return await self.embedding_client.embed(inputs, concurrency=concurrency)
+        
+        # 只对缓存未命中的输入请求嵌入服务
+        model = self.embedding_cache_model
+        embeddings = await asyncio.to_thread(self.embedding_cache.get_many, model, inputs)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_inputs = [inputs[i] for i in missing]
+            vectors = await self.embedding_client.embed(missing_inputs, concurrency=concurrency)
+            await asyncio.to_thread(self.embedding_cache.put_many, model, missing_inputs, vectors)
+            for i, vector in zip(missing, vectors):
+                embeddings[i] = vector
+        return np.stack(embeddings)
+
     def process_query(self, query: str, collection_name: str) -> str:
-        """处理用户查询（带线程级超时控制）"""
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(self._process_query, query, collection_name)
-            try:
-                return future.result(timeout=60)
-            except TimeoutError:
-                logger.error("查询处理超时")
-                raise TimeoutError("请求超时")
+        """处理用户查询（带线程级超时控制，线程池在请求间共享）"""
+        future = self._query_executor.submit(self._process_query, query, collection_name)
+        try:
+            return future.result(timeout=self.config.query_timeout)
+        except TimeoutError:
+            logger.error("查询处理超时")
+            raise TimeoutError("请求超时")
 
     def _process_query(self, query: str, collection_name: str) -> str:
         """处理用户查询"""
         try:
-            if not self.moderation_service.check_relevance(query):
-                return "本服务仅支持Apache Doris相关咨询"
-            
-            # 原有处理逻辑保持不变
-            logger.info("开始生成查询向量")
-            query_vector = self.get_embedding(query)
-            
-            logger.info("开始检索相关文档")
-            results = self.milvus_store.search(collection_name, query_vector, limit=3)
-            
-            # 打印搜索结果
-            logger.info("搜索结果详情:")
-            for i, res in enumerate(results):
-                logger.info(f"\n文档 {i+1}:")
-                logger.info(f"相关度分数: {res.get('score', 'N/A')}")
-                logger.info(f"版本: {res.get('version', 'N/A')}")
-                logger.info(f"URL: {res.get('url', 'N/A')}")
-                logger.info(f"文本内容:\n{res.get('text', 'N/A')[:500]}...")
-                logger.info("-" * 80)
-            
-            # 改进版结果处理
-            def diversify_results(results):
-                """多样性排序算法"""
-                diversified = []
-                seen_hashes = set()
-                
-                # 按版本优先级和内容相似度综合排序
-                version_weights = {'3.0': 1.5, '2.1': 1.3, '2.0': 1.0, 'dev': 0.8}
-                
-                for res in results:
-                    # 计算内容相似性哈希（取前500字符）
-                    content_hash = hash(res['text'][:500])
-                    
-                    # 如果内容相似度超过80%，视为重复
-                    if content_hash in seen_hashes:
-                        continue
-                    seen_hashes.add(content_hash)
-                    
-                    # 综合评分 = 相关度 * 版本权重
-                    res['combined_score'] = res['score'] * version_weights.get(res.get('version', '2.0'), 1.0)
-                    diversified.append(res)
-                
-                # 按综合评分排序
-                return sorted(diversified, key=lambda x: x['combined_score'], reverse=True)[:3]
-            
-            # 应用多样性处理
-            final_results = diversify_results(results)
+            early_answer, final_results, generation, query_vector = self._prepare(query, collection_name)
+            if early_answer:
+                return early_answer
             
-            # 从最终结果中提取参考文档信息
-            reference_docs = []
-            for res in final_results:
-                url = res.get('url', '')
-                # 清理URL中的version-前缀
-                clean_url = url.replace('version-', '')  # 兼容新旧格式
-                # 从清理后的URL解析版本
-                version = self._parse_version_from_url(clean_url)
-                
-                # 从URL锚点提取标题
-                doc_title = "未命名文档"
-                if '#' in url:
-                    anchor = url.split('#')[-1]
-                    doc_title = ' '.join(anchor.split('-')).title()  # 将短横线分隔转为空格
-                
-                reference_docs.append({
-                    "version": version,
-                    "title": doc_title,
-                    "url": clean_url  # 使用清理后的URL
-                })
-            
-            # 从搜索结果中提取文本作为上下文
-            context = "\n".join([res["text"] for res in final_results])
-            
-            # 使用 DeepSeek 生成回答
-            messages = [
-                {"role": "system", "content": """你是一个专业的Apache Doris助手，你负责帮助用户解决技术问题。你可以访问产品文档，
-                 其中包含有关 Doris 产品和服务的详细信息。你可以访问包含操作方法文章的内部知识库。你还可以访问用户经常寻求帮助的社区论坛。
-                 你可以使用来自这些来源的信息来帮助用户解决他们的问题。除非你确定自己对用户的问题有准确的答案，
-                 否则请提示用户将问题通过 https://ask.selectdb.com 论坛上报给社区人工支持同学，并告知用户你无法帮助他们。
-                 如果你不确定，请不要编造答案。
-                 我帮你查询到的参考文档和用户的输入如下。你的目标是尽最大努力帮助用户实现他们的目标。"""},
-                {"role": "user", "content": f"""
-                 参考文档:
-                {context}
-                用户问题: 
-                {query}
-                """}
-            ]
-            
-            response = self.clients.chat.chat.completions.create(
+            response = self.chat_limiter.call(
+                self.clients.chat.chat.completions.create,
                 model=self.chat_model,
-                messages=messages,
+                messages=self._build_messages(query, final_results),
                 temperature=config.get_chat_temperature,
                 max_tokens=800
             )
-            
-            # 生成带参考文档的回答
-            response_content = response.choices[0].message.content
-            formatted_response = f"{response_content}\n\n参考文档："
-            for i, doc in enumerate(reference_docs, 1):
-                formatted_response += f"\n{i}. 文档版本：{doc['version']} | {doc['title']} | {doc['url']}"
-            
-            return formatted_response
+            answer = self._format_response(response.choices[0].message.content, self._build_references(final_results))
+            self._store_answer(collection_name, generation, query, query_vector, answer)
+            return answer
             
         except Exception as e:
             logger.error(f"查询处理失败: {str(e)}")
             raise
 
-    def _parse_version_from_url(self, url):
-        """更精确的版本解析"""
-        if '/zh-CN/docs/' in url:
-            path_parts = url.split('/zh-CN/docs/')[1].split('/')
-            version_part = path_parts[0].replace('version-', '')
-            if version_part == 'sql-manual':
-                return '2.1' if '2.1' in url else 'unknown'
-            return version_part if version_part in ['2.0','2.1','3.0','dev'] else 'unknown'
-        return 'unknown'
+    def _prepare(self, query: str, collection_name: str):
+        """审核、查询向量化、回答缓存查找和检索
 
-    def _check_query_relevance(self, query):
-        logger.info(f"开始审核问题: {query}")
-        # 原始关键词审核逻辑
-        keywords = ["doris", "数据库", "apache", "查询", "表", "分区", "分桶", "物化视图"]
-        if any(kw in query.lower() for kw in keywords):
-            logger.info(f"审核结果: 通过")
-            return True
-        
-        # 原始深度审核逻辑
-        try:
-            messages = [
-                {"role": "system", "content": "判断用户问题是否与Apache Doris数据库相关，仅回答Y/N"},
-                {"role": "user", "content": f"问题：{query}"}
-            ]
-            response = self.clients.chat.chat.completions.create(
-                model=self.config.get_generation_model,
-                messages=messages,
-                temperature=0.1,
-                max_tokens=1
+        返回 (提前结束的回答, 检索结果, 集合代数, 查询向量)；命中回答缓存或审核拒绝时第一项非空。
+        推测执行模式下审核在独立线程中与向量化/检索同时进行，拒绝时丢弃检索结果；
+        审核需要问题向量（主题相似度）时等待本线程生成的向量。
+        """
+        moderation = None
+        if self.speculative_moderation:
+            vector_future = Future()
+            moderation = self._speculative_executor.submit(
+                self.moderation_service.check_relevance, query, vector_future.result
             )
-            result = response.choices[0].message.content.strip().upper() == "Y"
-            logger.info(f"审核结果: {'通过' if result else '拒绝'}")
-            return result
+        logger.info("开始生成查询向量")
+        try:
+            query_vector = self._query_embedding(query)
         except Exception as e:
-            logger.error(f"审核查询失败: {str(e)}")
-            return True 
+            if moderation:
+                vector_future.set_exception(e)
+            raise
+        if moderation:
+            vector_future.set_result(query_vector)
+        generation, cached = self._lookup_answer(collection_name, query_vector, query)
+        if cached:
+            if moderation:
+                moderation.cancel()
+            return cached, [], generation, query_vector
+        
+        if moderation is None:
+            if not self.moderation_service.check_relevance(query, query_vector):
+                return self.REJECT_MESSAGE, [], generation, query_vector
+            return None, self._retrieve(collection_name, query_vector, query), generation, query_vector
+        
+        final_results = self._retrieve(collection_name, query_vector, query)
+        if not moderation.result():
+            logger.info("审核未通过，丢弃推测执行的检索结果")
+            return self.REJECT_MESSAGE, [], generation, query_vector
+        return None, final_results, generation, query_vector
+
+    def _lookup_answer(self, collection_name: str, query_vector, query: str):
+        """查询语义回答缓存（只匹配指定了相同版本的问题），返回 (集合代数, 缓存的回答或None)"""
+        if not self.answer_cache:
+            return None, None
+        generation = self.answer_cache.generation(collection_name)
+        versions = self._query_versions(query)
+        return generation, self.answer_cache.lookup(collection_name, generation, query_vector, versions=versions)
+
+    def _store_answer(self, collection_name: str, generation, query: str, query_vector, answer: str):
+        if self.answer_cache:
+            self.answer_cache.store(collection_name, generation, query, query_vector, answer,
+                                    versions=self._query_versions(query))
+
+    def _query_embedding(self, query: str):
+        """生成查询向量，相同问题（归一化后）直接复用进程内缓存"""
+        vector = self.query_cache.get_vector(query) if self.query_cache else None
+        if vector is None:
+            vector = self.get_embedding(query)
+            if self.query_cache:
+                self.query_cache.put_vector(query, vector)
+        return vector
+
+    def _query_versions(self, query: str):
+        """从问题中识别提到的文档版本，只检索这些版本；未提到已知版本时返回None（检索默认版本）"""
+        if not query:
+            return None
+        versions = [version for version in dict.fromkeys(VERSION_PATTERN.findall(query))
+                    if version in self.version_weights]
+        if versions:
+            logger.info(f"问题指定版本: {versions}")
+        return versions or None
+
+    def _search_filters(self, limit: int, collection_name: str, query: str, versions) -> tuple:
+        """检索条件，作为检索结果缓存键的一部分；混合检索的BM25结果取决于问题文本，一并计入"""
+        lexical_query = normalize_query(query) if self.milvus_store.lexical_index(collection_name) else None
+        return limit, self.milvus_store.search_expr(versions), lexical_query
+
+    def _retrieve(self, collection_name: str, query_vector, query: str = None, limit: int = 3) -> list:
+        """检索并返回多样性处理后的结果（同一集合代数下相同向量和条件的最终结果直接复用）
+
+        两阶段模式下向量检索只返回ID、分数和小字段，排序去重后只为最终入选的文档块按主键批量取正文。
+        """
+        logger.info("开始检索相关文档")
+        versions = self._query_versions(query)
+        cache_key = self._search_cache_key(collection_name, query_vector, query, limit, versions)
+        if cache_key:
+            cached = self.query_cache.get_search(*cache_key)
+            if cached is not None:
+                return cached
+        results = self.milvus_store.search(
+            collection_name, query_vector, limit=limit, query_text=query, versions=versions,
+            with_text=not self.two_phase_retrieval
+        )
+        ranked = self._rank_results(results)
+        final_results, seen_hashes, position = [], set(), 0
+        while len(final_results) < limit and position < len(ranked):
+            batch = ranked[position:position + limit - len(final_results)]
+            position += len(batch)
+            if self.two_phase_retrieval:
+                self._attach_texts(batch, self.milvus_store.fetch_texts(collection_name, [res["id"] for res in batch]))
+            self._take_distinct(batch, final_results, seen_hashes)
+        self._log_results(final_results)
+        if cache_key:
+            self.query_cache.put_search(*cache_key, final_results)
+        return final_results
+
+    def _search_cache_key(self, collection_name, query_vector, query, limit, versions):
+        """检索结果缓存键 (集合, 集合代数, 查询向量, 检索条件)，未启用缓存时返回None"""
+        if not self.query_cache:
+            return None
+        filters = self._search_filters(limit, collection_name, query, versions)
+        return collection_name, get_generation(collection_name), query_vector, filters
 
-    async def batch_get_embeddings(self, texts: list, documents: list, collection_name: str, batch_size=50, concurrency=10):
-        """批量获取嵌入并存储到Milvus"""
+    def stream_query(self, query: str, collection_name: str):
+        """流式处理用户查询（同步生成器）
+
+        检索完成后先产出参考文档，再逐段产出模型生成的内容，依次产出 (事件, 数据)：
+        ("references", 参考文档列表) → ("delta", 文本片段)... → ("done", 带参考文档的完整回答)
+        命中回答缓存或被审核拒绝时只产出 delta 和 done。
+        """
+        # 与 process_query 相同，检索阶段在共享线程池中执行并受 query_timeout 限制
+        future = self._query_executor.submit(self._prepare, query, collection_name)
         try:
-            logger.info(f"开始批量处理 {len(texts)} 个文本块")
-            
-            # 分批处理
-            for i in range(0, len(texts), batch_size):
-                try:
-                    batch_texts = texts[i:i+batch_size]
-                    batch_docs = documents[i:i+batch_size]
-                    
-                    # 获取嵌入
-                    embeddings = await self._async_get_embeddings(batch_texts)
-                    
-                    # 准备存储数据
-                    records = []
-                    for doc, emb in zip(batch_docs, embeddings):
-                        doc_id = hashlib.md5(doc["url"].encode()).hexdigest()  # 生成唯一ID
-                        records.append({
-                            "id": doc_id,
-                            "vector": emb,
-                            "text": doc["content"],
-                            "version": doc["version"],
-                            "url": doc["url"],
-                            "is_community": doc.get("is_community", False)
-                        })
-                    
-                    # 批量插入
-                    self.milvus_store.batch_insert(collection_name, records)
-                    
-                    logger.info(f"已处理 {i + len(batch_texts)}/{len(texts)} 个文档块")
-                except Exception as e:
-                    logger.error(f"跳过无法处理的批次 {i}-{i+batch_size}")
-                    continue  # 继续处理后续批次
+            early_answer, final_results, generation, query_vector = future.result(timeout=self.config.query_timeout)
+        except TimeoutError:
+            logger.error("查询处理超时")
+            raise TimeoutError("请求超时")
+        if early_answer:
+            yield "delta", early_answer
+            yield "done", early_answer
+            return
+        
+        reference_docs = self._build_references(final_results)
+        yield "references", reference_docs
+        
+        stream = self.chat_limiter.call(
+            self.clients.chat.chat.completions.create,
+            model=self.chat_model,
+            messages=self._build_messages(query, final_results),
+            temperature=config.get_chat_temperature,
+            max_tokens=800,
+            stream=True
+        )
+        parts = []
+        # 调用方中途停止读取时关闭流，释放限流器的并发名额
+        with stream:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield "delta", delta
+        answer = self._format_response("".join(parts), reference_docs)
+        self._store_answer(collection_name, generation, query, query_vector, answer)
+        yield "done", answer
+
+    def _query_semaphore(self) -> asyncio.Semaphore:
+        """每个事件循环一个信号量，限制进程内同时处理的问题数"""
+        loop = asyncio.get_running_loop()
+        semaphore = self._query_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._query_semaphores[loop] = asyncio.Semaphore(self.config.query_config.get("max_concurrency", 256))
+        return semaphore
+
+    async def aprocess_query(self, query: str, collection_name: str) -> str:
+        """异步处理用户查询：审核、嵌入、检索、生成全程不占用线程，并发数由配置 query.max_concurrency 限制"""
+        async def run():
+            async with self._query_semaphore():
+                return await self._aprocess_query(query, collection_name)
+        try:
+            return await asyncio.wait_for(run(), timeout=self.config.query_timeout)
+        except asyncio.TimeoutError:
+            logger.error("查询处理超时")
+            raise TimeoutError("请求超时")
+
+    async def _aprocess_query(self, query: str, collection_name: str) -> str:
+        try:
+            early_answer, final_results, generation, query_vector = await self._aprepare(query, collection_name)
+            if early_answer:
+                return early_answer
             
-            logger.info("批量嵌入处理完成")
+            response = await self.chat_limiter.acall(
+                async_clients.get(self.config.chat_provider).chat.completions.create,
+                model=self.chat_model,
+                messages=self._build_messages(query, final_results),
+                temperature=config.get_chat_temperature,
+                max_tokens=800
+            )
+            answer = self._format_response(response.choices[0].message.content, self._build_references(final_results))
+            await asyncio.to_thread(self._store_answer, collection_name, generation, query, query_vector, answer)
+            return answer
             
         except Exception as e:
-            logger.error(f"批量处理失败: {str(e)}")
+            logger.error(f"查询处理失败: {str(e)}")
             raise
 
-    async def _async_get_embeddings(self, texts: list) -> list:
-        """异步获取嵌入"""
-        embeddings = []
-        for text in texts:
-            retry_count = 0
-            while True:
-                try:
-                    emb = self.get_embedding(text)
-                    embeddings.append(emb)
-                    break
-                except openai.InternalServerError:
-                    retry_count += 1
-                    if retry_count >= self.max_retries:
-                        logger.error(f"文本处理达到最大重试次数: {text[:50]}...")
-                        raise
-                    await asyncio.sleep(self.retry_delay * (2 ** (retry_count - 1)))
-        return embeddings
-
-    async def batch_process_documents(self, documents: list):
-        """批量处理文档嵌入"""
+    async def _aprepare(self, query: str, collection_name: str):
+        """_prepare 的异步版本：推测执行模式下审核与向量化/检索并发，审核拒绝时取消检索，命中回答缓存时取消审核"""
+        pending = []
+        
+        def spawn(coro):
+            task = asyncio.create_task(coro)
+            # 被丢弃的任务出错时不再报 "exception was never retrieved"
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            pending.append(task)
+            return task
+        
         try:
-            texts = [doc["content"] for doc in documents]
-            embeddings = []
+            logger.info("开始生成查询向量")
+            embedding = spawn(self._aquery_embedding(query))
+            # 审核只在需要主题相似度时才等待向量；shield 保证审核被取消时不会连带取消向量化
+            moderation = spawn(self.moderation_service.acheck_relevance(query, lambda: asyncio.shield(embedding))) \
+                if self.speculative_moderation else None
+            query_vector = await embedding
+            generation, cached = await asyncio.to_thread(self._lookup_answer, collection_name, query_vector, query)
+            if cached:
+                return cached, [], generation, query_vector
             
-            # 分批处理
-            batch_size = 50
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i+batch_size]
-                embeddings.extend(self.clients.embedding.embeddings.create(
-                    model=self.config.embedding_model,
-                    input=batch
-                ).data)
-                
-            # 存储到Milvus
-            records = []
-            for doc, emb in zip(documents, embeddings):
-                records.append({
-                    "vector": emb.embedding,
-                    "text": doc["content"],
-                    "url": doc["url"],
-                    "version": doc["version"]
-                })
+            if moderation is None:
+                if not await self.moderation_service.acheck_relevance(query, query_vector):
+                    return self.REJECT_MESSAGE, [], generation, query_vector
+                return None, await self._aretrieve(collection_name, query_vector, query), generation, query_vector
+            
+            retrieval = spawn(self._aretrieve(collection_name, query_vector, query))
+            if not await moderation:
+                logger.info("审核未通过，取消推测执行的检索")
+                return self.REJECT_MESSAGE, [], generation, query_vector
+            return None, await retrieval, generation, query_vector
+        finally:
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+
+    async def _aquery_embedding(self, query: str):
+        vector = self.query_cache.get_vector(query) if self.query_cache else None
+        if vector is None:
+            vector = await self.aget_embedding(query)
+            if self.query_cache:
+                self.query_cache.put_vector(query, vector)
+        return vector
+
+    async def _aretrieve(self, collection_name: str, query_vector, query: str = None, limit: int = 3) -> list:
+        logger.info("开始检索相关文档")
+        versions = self._query_versions(query)
+        cache_key = self._search_cache_key(collection_name, query_vector, query, limit, versions)
+        if cache_key:
+            cached = self.query_cache.get_search(*cache_key)
+            if cached is not None:
+                return cached
+        results = await self.milvus_store.asearch(
+            collection_name, query_vector, limit=limit, query_text=query, versions=versions,
+            with_text=not self.two_phase_retrieval
+        )
+        ranked = self._rank_results(results)
+        final_results, seen_hashes, position = [], set(), 0
+        while len(final_results) < limit and position < len(ranked):
+            batch = ranked[position:position + limit - len(final_results)]
+            position += len(batch)
+            if self.two_phase_retrieval:
+                texts = await self.milvus_store.afetch_texts(collection_name, [res["id"] for res in batch])
+                self._attach_texts(batch, texts)
+            self._take_distinct(batch, final_results, seen_hashes)
+        self._log_results(final_results)
+        if cache_key:
+            self.query_cache.put_search(*cache_key, final_results)
+        return final_results
+
+    async def astream_query(self, query: str, collection_name: str):
+        """流式处理用户查询（异步生成器），产出的事件与 stream_query 相同
+
+        审核和检索受 timeout 限制，检索完成即产出参考文档，之后模型生成多少转发多少。
+        """
+        async with self._query_semaphore():
+            try:
+                async with asyncio.timeout(self.config.query_timeout):
+                    early_answer, final_results, generation, query_vector = await self._aprepare(query, collection_name)
+            except TimeoutError:
+                logger.error("查询处理超时")
+                raise TimeoutError("请求超时")
             
-            self.milvus_store.batch_insert("doris_docs", records)
+            if early_answer:
+                yield "delta", early_answer
+                yield "done", early_answer
+                return
             
-        except Exception as e:
-            logger.error(f"批量处理失败: {str(e)}")
-            raise 
\ No newline at end of file
+            reference_docs = self._build_references(final_results)
+            yield "references", reference_docs
+            
+            stream = await self.chat_limiter.acall(
+                async_clients.get(self.config.chat_provider).chat.completions.create,
+                model=self.chat_model,
+                messages=self._build_messages(query, final_results),
+                temperature=config.get_chat_temperature,
+                max_tokens=800,
+                stream=True
+            )
+            parts = []
+            async with stream:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield "delta", delta
+            answer = self._format_response("".join(parts), reference_docs)
+            await asyncio.to_thread(self._store_answer, collection_name, generation, query, query_vector, answer)
+            yield "done", answer
+
+    async def aget_embedding(self, text):
+        """异步生成查询嵌入（与 get_embedding 结果一致，共享嵌入缓存）"""
+        if self.config.embedding_provider == LOCAL_PROVIDER:
+            return await asyncio.to_thread(self.get_embedding, text)
+        return (await self.aembed_documents([text]))[0]
+
+    async def aclose(self):
+        """释放当前事件循环上的异步连接"""
+        await async_clients.aclose()
+        await self.milvus_store.aclose()
+
+    def cache_stats(self) -> dict:
+        """各级缓存的命中情况"""
+        return {
+            "query": self.query_cache.stats() if self.query_cache else None,
+            "answer": self.answer_cache.stats() if self.answer_cache else None,
+            "embedding": self.embedding_cache.stats() if self.embedding_cache else None,
+            "moderation": self.moderation_service.stats()
+        }
+
+    def _log_results(self, results):
+        """打印最终入选的检索结果"""
+        logger.info("搜索结果详情:")
+        for i, res in enumerate(results):
+            logger.info(f"\n文档 {i+1}:")
+            logger.info(f"相关度分数: {res.get('score', 'N/A')}")
+            logger.info(f"版本: {res.get('version', 'N/A')}")
+            logger.info(f"URL: {res.get('url', 'N/A')}")
+            logger.info(f"文本内容:\n{res.get('text', 'N/A')[:500]}...")
+            logger.info("-" * 80)
+
+    def _rank_results(self, results):
+        """按综合评分排序：综合评分 = 相关度 * 版本权重（检索时已按问题涉及的版本计算）
+
+        只依赖分数和版本等小字段，两阶段检索时在取正文之前完成。
+        """
+        ranked, seen_ids = [], set()
+        for res in results:
+            if res.get('id') and res['id'] in seen_ids:
+                continue
+            seen_ids.add(res.get('id'))
+            weight = res.get('version_weight') or self.version_weights.get(res.get('version', '2.0'), 1.0)
+            res['combined_score'] = res['score'] * weight
+            ranked.append(res)
+        return sorted(ranked, key=lambda x: x['combined_score'], reverse=True)
+
+    @staticmethod
+    def _attach_texts(batch, texts: dict):
+        for res in batch:
+            res['text'] = texts.get(res['id'], "")
+
+    @staticmethod
+    def _take_distinct(batch, final_results, seen_hashes):
+        """多样性处理：内容相似（前500字符相同）的文档块只保留评分最高的一个"""
+        for res in batch:
+            content_hash = hash(res['text'][:500])
+            if content_hash in seen_hashes:
+                continue
+            seen_hashes.add(content_hash)
+            final_results.append(res)
+
+    def _build_references(self, final_results):
+        """从最终结果中提取参考文档信息"""
+        reference_docs = []
+        for res in final_results:
+            url = res.get('url', '')
+            # 清理URL中的version-前缀
+            clean_url = url.replace('version-', '')  # 兼容新旧格式
+            # 从清理后的URL解析版本
+            version = self._parse_version_from_url(clean_url)
+            
+            # 从URL锚点提取标题
+            doc_title = "未命名文档"
+            if '#' in url:
+                anchor = url.split('#')[-1]
+                doc_title = ' '.join(anchor.split('-')).title()  # 将短横线分隔转为空格
+            
+            reference_docs.append({
+                "version": version,
+                "title": doc_title,
+                "url": clean_url  # 使用清理后的URL
+            })
+        return reference_docs
+
+    def _build_messages(self, query, final_results):
+        """以检索结果为上下文构建对话消息"""
+        # 从搜索结果中提取文本作为上下文
+        context = "\n".join([res["text"] for res in final_results])
+        return [
+            {"role": "system", "content": """你是一个专业的Apache Doris助手，你负责帮助用户解决技术问题。你可以访问产品文档，
+             其中包含有关 Doris 产品和服务的详细信息。你可以访问包含操作方法文章的内部知识库。你还可以访问用户经常寻求帮助的社区论坛。
+             你可以使用来自这些来源的信息来帮助用户解决他们的问题。除非你确定自己对用户的问题有准确的答案，
+             否则请提示用户将问题通过 https://ask.selectdb.com 论坛上报给社区人工支持同学，并告知用户你无法帮助他们。
+             如果你不确定，请不要编造答案。
+             我帮你查询到的参考文档和用户的输入如下。你的目标是尽最大努力帮助用户实现他们的目标。"""},
+            {"role": "user", "content": f"""
+             参考文档:
+            {context}
+            用户问题: 
+            {query}
+            """}
+        ]
+
+    @staticmethod
+    def format_references(reference_docs):
+        formatted = "\n\n参考文档："
+        for i, doc in enumerate(reference_docs, 1):
+            formatted += f"\n{i}. 文档版本：{doc['version']} | {doc['title']} | {doc['url']}"
+        return formatted
+
+    def _format_response(self, response_content, reference_docs):
+        """生成带参考文档的回答"""
+        return f"{response_content}{self.format_references(reference_docs)}"
+
+    def _parse_version_from_url(self, url):
+        """更精确的版本解析"""
+        if '/zh-CN/docs/' in url:
+            path_parts = url.split('/zh-CN/docs/')[1].split('/')
+            version_part = path_parts[0].replace('version-', '')
+            if version_part == 'sql-manual':
+                return '2.1' if '2.1' in url else 'unknown'
+            return version_part if version_part in ['2.0','2.1','3.0','dev'] else 'unknown'
+        return 'unknown'
@@ -1,37 +1,42 @@
+import asyncio
 import schedule
 import logging
 import time
 from data_loader import JiraLoader
 from settings import config
-from src.api.jira_router import RefreshRequest, incremental_refresh, refresh_jira_data
-from src.vectorstore.milvus_store import MilvusStore
+from src.vectorstore.collection_generation import bump_generation
+from src.qa.rag_engine import RAGEngine
 
 def start_sync_job():
-    def job():
+    # 整个定时任务进程共用一个RAG引擎（Milvus连接、审核客户端和线程池只创建一次）
+    rag_engine = RAGEngine()
+
+    async def sync(full_refresh):
+        try:
+            return await JiraLoader(config).aupsert(
+                rag_engine.milvus_store, rag_engine.aembed_documents, full_refresh=full_refresh,
+                batch_size=config.jira_sync_config.get("embed_batch_size", 50)
+            )
+        finally:
+            # 每次同步在新的事件循环中运行，结束时释放绑定在该循环上的异步连接
+            await rag_engine.aclose()
+
+    def job(full_refresh=False):
         try:
-            loader = JiraLoader(config)
-            milvus = MilvusStore()
-            
-            logging.info("开始增量同步Jira数据")
-            count = 0
-            for doc in loader.load_documents(full_refresh=False):
-                milvus.insert("jira_issues", doc)
-                count += 1
-            logging.info(f"增量同步完成，更新{count}条数据")
-            
+            logging.info("开始全量同步Jira数据" if full_refresh else "开始增量同步Jira数据")
+            stats = asyncio.run(sync(full_refresh))
+            bump_generation("jira_issues")
+            logging.info(f"同步完成，更新{stats['upserted']}条数据，删除{stats['deleted']}条")
+
         except Exception as e:
             logging.error(f"定时任务执行失败: {str(e)}")
-    
+
     # 每小时执行增量同步
-    schedule.every(config.jira.poll_interval).seconds.do(
-        lambda: incremental_refresh()
-    )
-    
+    schedule.every(config.jira.poll_interval).seconds.do(job)
+
     # 每周日凌晨执行全量同步
-    schedule.every().sunday.at("02:00").do(
-        lambda: refresh_jira_data(RefreshRequest(full_refresh=True))
-    )
-    
+    schedule.every().sunday.at("02:00").do(job, full_refresh=True)
+
     while True:
         schedule.run_pending()
-        time.sleep(1) 
\ No newline at end of file
+        time.sleep(1)
@@ -0,0 +1,336 @@
+import logging
+import re
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # 可选依赖，缺失时按字符估算token数
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+FRONT_MATTER_PATTERN = re.compile(r'\A---\s*\n.*?\n---\s*(?:\n|\Z)', re.DOTALL)
+HTML_COMMENT_PATTERN = re.compile(r'<!--[\s\S]*?-->')
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+FENCE_PATTERN = re.compile(r'^\s{0,3}(`{3,}|~{3,})')
+SENTENCE_END_PATTERN = re.compile(r'(?<=[。！？!?；;])|(?<=\.)\s')
+CJK_RANGES = '\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef'
+CJK_PATTERN = re.compile(f'[{CJK_RANGES}]')
+WORD_PATTERN = re.compile(f'[A-Za-z0-9_]+|[^\\sA-Za-z0-9_{CJK_RANGES}]')
+
+
+class TokenCounter:
+    """按嵌入模型分词器统计token数，分词器不可用时退化为字符估算"""
+
+    def __init__(self, tokenizer_name: str = None):
+        self.tokenizer = None
+        if tokenizer_name and Tokenizer is not None:
+            try:
+                self.tokenizer = Tokenizer.from_pretrained(tokenizer_name)
+            except Exception as e:
+                logger.warning(f"加载分词器 {tokenizer_name} 失败，使用估算token数: {str(e)}")
+        elif tokenizer_name:
+            logger.warning("未安装tokenizers，使用估算token数")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        # 估算：中日韩字符约1 token/字，英文单词和符号约1.3 token/个
+        return len(CJK_PATTERN.findall(text)) + int(len(WORD_PATTERN.findall(text)) * 1.3 + 0.5)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截断文本至 max_tokens 以内"""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.tokenizer is not None:
+            encoding = self.tokenizer.encode(text, add_special_tokens=False)
+            end = encoding.offsets[max_tokens - 1][1] if max_tokens > 0 else 0
+            return text[:end]
+        # 二分查找满足预算的最长前缀
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count(text[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return text[:low]
+
+
+def strip_boilerplate(content: str) -> str:
+    """移除YAML front matter以及代码块之外的HTML注释（含license头）"""
+    content = FRONT_MATTER_PATTERN.sub('', content.lstrip('\ufeff'), count=1)
+    parts = []
+    in_fence = None
+    buffer = []
+    for line in content.split('\n'):
+        fence = _match_fence(line, in_fence)
+        if in_fence is None and fence:
+            parts.append(HTML_COMMENT_PATTERN.sub('', '\n'.join(buffer)))
+            buffer = [line]
+            in_fence = fence
+        elif in_fence is not None and fence:
+            buffer.append(line)
+            parts.append('\n'.join(buffer))
+            buffer = []
+            in_fence = None
+        else:
+            buffer.append(line)
+    tail = '\n'.join(buffer)
+    parts.append(tail if in_fence is not None else HTML_COMMENT_PATTERN.sub('', tail))
+    return '\n'.join(part for part in parts if part)
+
+
+def _match_fence(line: str, open_fence: str = None):
+    """识别代码块围栏；在代码块内时只有同类且不短于开启围栏的行才算关闭"""
+    match = FENCE_PATTERN.match(line)
+    if not match:
+        return None
+    fence = match.group(1)
+    if open_fence is None:
+        return fence
+    if fence[0] == open_fence[0] and len(fence) >= len(open_fence) and not line.strip()[len(fence):].strip():
+        return fence
+    return None
+
+
+def parse_headings(content: str):
+    """识别代码块之外的标题，返回 (标题路径, 正文行列表)"""
+    headings = []
+    body = []
+    in_fence = None
+    for line in content.split('\n'):
+        fence = _match_fence(line, in_fence)
+        if fence:
+            in_fence = None if in_fence else fence
+            body.append(line)
+            continue
+        match = HEADING_PATTERN.match(line) if in_fence is None else None
+        if match:
+            level = len(match.group(1))
+            headings = headings[:level - 1] + [match.group(2)]
+        else:
+            body.append(line)
+    return headings, body
+
+
+class _Block:
+    __slots__ = ("text", "tokens", "is_code")
+
+    def __init__(self, text, tokens, is_code=False):
+        self.text = text
+        self.tokens = tokens
+        self.is_code = is_code
+
+
+class _Section:
+    def __init__(self, level, headings, heading_line):
+        self.level = level
+        self.headings = headings
+        self.heading_line = heading_line
+        self.blocks = []
+
+    def tokens(self, counter):
+        heading_tokens = counter.count(self.heading_line) if self.heading_line else 0
+        return heading_tokens + sum(block.tokens for block in self.blocks)
+
+
+class MarkdownChunker:
+    """代码块感知、按token预算切分的Markdown切分器
+
+    - 只把代码块之外的 `#` 行识别为标题，代码块内的SQL/Shell注释保持原样
+    - 移除front matter和license注释，保留段落之间的空行
+    - 小的子章节并入父章节，超出预算的章节按段落/行拆分，相邻片段保留少量重叠
+    """
+
+    def __init__(self, max_tokens=512, overlap_tokens=64, min_chars=50, token_counter: TokenCounter = None):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 4)
+        self.min_chars = min_chars
+        self.counter = token_counter or TokenCounter()
+
+    def split(self, content: str) -> list:
+        """切分文档，返回 [{"content", "headings", "level"}]"""
+        sections = self._parse_sections(strip_boilerplate(content))
+        chunks = []
+        current = None
+        current_tokens = 0
+        for section in sections:
+            section_tokens = section.tokens(self.counter)
+            # 子章节在预算内时并入当前块
+            if (current is not None and section.level > current["level"]
+                    and current_tokens + section_tokens <= self.max_tokens):
+                current["parts"].append(self._render(section.heading_line, section.blocks))
+                current_tokens += section_tokens
+                if not current["headings"]:
+                    current["headings"] = section.headings
+                continue
+            if current is not None:
+                chunks.append(current)
+                current = None
+            if section_tokens <= self.max_tokens:
+                current = {
+                    "parts": [self._render(section.heading_line, section.blocks)],
+                    "headings": section.headings,
+                    "level": section.level
+                }
+                current_tokens = section_tokens
+            else:
+                chunks.extend(self._split_section(section))
+        if current is not None:
+            chunks.append(current)
+
+        results = []
+        for chunk in chunks:
+            text = '\n\n'.join(part for part in chunk["parts"] if part).strip()
+            if len(text) > self.min_chars:
+                results.append({"content": text, "headings": chunk["headings"], "level": chunk["level"]})
+        return results
+
+    def _parse_sections(self, content: str) -> list:
+        """按标题拆分章节，章节内按空行拆分段落，代码块作为整体"""
+        sections = [_Section(0, [], "")]
+        headings = []
+        paragraph = []
+        code = []
+        in_fence = None
+
+        def flush_paragraph():
+            if paragraph:
+                text = '\n'.join(paragraph).strip('\n')
+                if text.strip():
+                    sections[-1].blocks.append(_Block(text, self.counter.count(text)))
+                paragraph.clear()
+
+        for line in content.split('\n'):
+            if in_fence is not None:
+                code.append(line)
+                if _match_fence(line, in_fence):
+                    text = '\n'.join(code)
+                    sections[-1].blocks.append(_Block(text, self.counter.count(text), is_code=True))
+                    code.clear()
+                    in_fence = None
+                continue
+            fence = _match_fence(line)
+            if fence:
+                flush_paragraph()
+                in_fence = fence
+                code.append(line)
+                continue
+            match = HEADING_PATTERN.match(line)
+            if match:
+                flush_paragraph()
+                level = len(match.group(1))
+                headings = headings[:level - 1] + [match.group(2)]
+                sections.append(_Section(level, headings.copy(), line.strip()))
+            elif line.strip():
+                paragraph.append(line.rstrip())
+            else:
+                flush_paragraph()
+        flush_paragraph()
+        if code:
+            # 未闭合的代码块按普通代码处理
+            text = '\n'.join(code)
+            sections[-1].blocks.append(_Block(text, self.counter.count(text), is_code=True))
+        return [section for section in sections if section.blocks or section.heading_line]
+
+    def _render(self, heading_line, blocks) -> str:
+        parts = [heading_line] if heading_line else []
+        parts.extend(block.text for block in blocks)
+        return '\n\n'.join(parts)
+
+    def _split_section(self, section) -> list:
+        """超出预算的章节按块打包，每个片段都带上章节标题，并与前一片段少量重叠"""
+        heading_tokens = self.counter.count(section.heading_line) if section.heading_line else 0
+        budget = max(self.max_tokens - heading_tokens, self.max_tokens // 2)
+        blocks = []
+        for block in section.blocks:
+            blocks.extend(self._split_block(block, budget) if block.tokens > budget else [block])
+
+        pieces = []
+        current = []
+        current_tokens = 0
+        for block in blocks:
+            if current and current_tokens + block.tokens > budget:
+                pieces.append(current)
+                current = self._overlap(current, budget - block.tokens)
+                current_tokens = sum(b.tokens for b in current)
+            current.append(block)
+            current_tokens += block.tokens
+        if current:
+            pieces.append(current)
+        return [{
+            "parts": [self._render(section.heading_line, piece)],
+            "headings": section.headings,
+            "level": section.level
+        } for piece in pieces]
+
+    def _overlap(self, blocks, room) -> list:
+        """取上一片段末尾的普通段落作为重叠，不跨越代码块"""
+        limit = min(self.overlap_tokens, room)
+        if limit <= 0 or not blocks or blocks[-1].is_code:
+            return []
+        last = blocks[-1]
+        if last.tokens <= limit:
+            return [last]
+        sentences = [s for s in SENTENCE_END_PATTERN.split(last.text) if s and s.strip()]
+        tail = []
+        tokens = 0
+        for sentence in reversed(sentences):
+            sentence_tokens = self.counter.count(sentence)
+            if tokens + sentence_tokens > limit:
+                break
+            tail.insert(0, sentence)
+            tokens += sentence_tokens
+        if not tail:
+            return []
+        text = ''.join(tail).strip()
+        return [_Block(text, self.counter.count(text))]
+
+    def _split_block(self, block, budget) -> list:
+        """单个超长段落/代码块按行拆分，代码块的每个片段补齐围栏"""
+        lines = block.text.split('\n')
+        fence_open, fence_close = "", ""
+        if block.is_code:
+            fence_open = lines[0]
+            opening = _match_fence(fence_open)
+            if len(lines) >= 2 and _match_fence(lines[-1], opening):
+                fence_close, lines = lines[-1], lines[1:-1]
+            else:
+                fence_close, lines = opening, lines[1:]
+        wrapper_tokens = self.counter.count(fence_open + fence_close)
+        line_budget = max(budget - wrapper_tokens, 1)
+
+        pieces = []
+        current = []
+        current_tokens = 0
+        for line in lines:
+            line_tokens = self.counter.count(line)
+            if line_tokens > line_budget:
+                # 单行超长（如压缩的JSON），强制按token截断；先输出之前累积的行，保持原文顺序
+                if current:
+                    pieces.append(current)
+                    current = []
+                    current_tokens = 0
+                while line:
+                    head = self.counter.truncate(line, line_budget) or line[:1]
+                    pieces.append([head])
+                    line = line[len(head):]
+                continue
+            if current and current_tokens + line_tokens > line_budget:
+                pieces.append(current)
+                current = []
+                current_tokens = 0
+            current.append(line)
+            current_tokens += line_tokens
+        if current:
+            pieces.append(current)
+
+        blocks = []
+        for piece in pieces:
+            text = '\n'.join(piece)
+            if block.is_code:
+                text = f"{fence_open}\n{text}\n{fence_close}"
+            blocks.append(_Block(text, self.counter.count(text), is_code=block.is_code))
+        return blocks
@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from pymilvus import BulkInsertState, utility
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class BulkImporter:
+    """离线批量导入：全量重建时把文档块和向量写成Parquet文件，由Milvus服务端批量导入新一代集合，完成后切换别名
+
+    - storage 为 "minio" 时文件上传到Milvus使用的MinIO/S3桶；为 "local" 时写入 local.path，
+      该目录需是Milvus本地存储根目录（或其挂载点），提交导入时使用相对路径
+    - 每个分区单独写文件、单独提交导入任务，轮询任务状态直到全部完成
+    - 导入完成后建索引、加载，再由 MilvusStore.activate 预热并切换别名；任一任务失败时删除新一代集合，线上集合不受影响
+
+    文档存储和BM25索引按集合名维护：导入期间相应记录先暂存在本地临时文件，导入成功后才写入（失败或放弃时不留下记录），
+    切换后清理已不存在的ID。
+    """
+
+    def __init__(self, store, collection_name: str, create_fn):
+        """
+        Args:
+            store: MilvusStore
+            collection_name: 集合名（检索使用的别名）
+            create_fn: 创建空集合的函数，参数为新一代集合名，返回 Collection（不建索引）
+        """
+        self.store = store
+        self.collection_name = collection_name
+        self.staging_name = store.next_collection_version(collection_name)
+        self.import_config = config.bulk_import_config
+        self.storage = self.import_config.get("storage", "minio")
+        if utility.has_collection(self.staging_name):
+            utility.drop_collection(self.staging_name)
+        self.collection = create_fn(self.staging_name)
+        self.schema = self.collection.schema
+        self.field_names = [field.name for field in self.schema.fields if not (field.is_primary and field.auto_id)]
+        self.doc_store = store.doc_store(collection_name)
+        self.lexical_index = store.lexical_index(collection_name)
+        self._writers = {}  # 分区名 → pymilvus BulkWriter
+        self._side_file = None  # 待写入文档存储/BM25索引的记录（JSON Lines），导入成功后回放
+        self._side_path = None
+
+    def _open_writer(self):
+        try:
+            from pymilvus.bulk_writer import BulkFileType, LocalBulkWriter, RemoteBulkWriter
+        except ImportError as e:
+            raise RuntimeError("批量导入需要安装 pymilvus[bulk_writer]") from e
+        chunk_size = self.import_config.get("file_size_mb", 512) * MB
+        if self.storage == "local":
+            return LocalBulkWriter(
+                schema=self.schema,
+                local_path=self.import_config.get("local", {}).get("path", "data/bulk_import"),
+                chunk_size=chunk_size,
+                file_type=BulkFileType.PARQUET
+            )
+        minio_config = self.import_config.get("minio", {})
+        return RemoteBulkWriter(
+            schema=self.schema,
+            remote_path=minio_config.get("remote_path", "bulk_import"),
+            connect_param=RemoteBulkWriter.S3ConnectParam(
+                endpoint=minio_config.get("endpoint", f"{config.milvus_host}:9000"),
+                access_key=minio_config.get("access_key", "minioadmin"),
+                secret_key=minio_config.get("secret_key", "minioadmin"),
+                bucket_name=minio_config.get("bucket", "a-bucket"),
+                secure=minio_config.get("secure", False)
+            ),
+            chunk_size=chunk_size,
+            file_type=BulkFileType.PARQUET
+        )
+
+    def write(self, records: list) -> int:
+        """把一批记录写入导入文件（达到 file_size_mb 时自动落盘/上传），返回写入条数"""
+        if self.doc_store or self.lexical_index:
+            if self._side_file is None:
+                fd, self._side_path = tempfile.mkstemp(prefix=f"{self.staging_name}_", suffix=".jsonl")
+                self._side_file = os.fdopen(fd, "w", encoding="utf-8")
+            for record in records:
+                self._side_file.write(json.dumps({
+                    "id": record["id"], "text": record["text"],
+                    "versions": record.get("versions") or [record.get("version", "")]
+                }, ensure_ascii=False) + "\n")
+        for partition_name, group in self.store._split_by_partition(records).items():
+            writer = self._writers.get(partition_name)
+            if writer is None:
+                writer = self._writers[partition_name] = self._open_writer()
+            for record in group:
+                writer.append_row({name: record[name] for name in self.field_names})
+        return len(records)
+
+    def _import_files(self) -> list:
+        """提交导入任务，返回 [(任务ID, 文件列表)]"""
+        local_root = Path(self.import_config.get("local", {}).get("path", "data/bulk_import")).resolve()
+        tasks = []
+        for partition_name, writer in self._writers.items():
+            writer.commit()
+            if partition_name:
+                self.store._ensure_partition(self.collection, partition_name)
+            for files in writer.batch_files:
+                if self.storage == "local":
+                    files = [str(Path(file).resolve().relative_to(local_root)) for file in files]
+                task_id = utility.do_bulk_insert(self.staging_name, files=files, partition_name=partition_name)
+                tasks.append((task_id, files))
+        logger.info(f"已提交 {len(tasks)} 个导入任务到 {self.staging_name}")
+        return tasks
+
+    def _wait(self, tasks: list) -> int:
+        """轮询导入任务直到全部完成，返回导入总行数；任一任务失败或超时时抛出异常"""
+        poll_interval = self.import_config.get("poll_interval", 5)
+        deadline = time.monotonic() + self.import_config.get("timeout", 3600)
+        pending = dict(tasks)
+        rows = 0
+        while pending:
+            for task_id in list(pending):
+                state = utility.get_bulk_insert_state(task_id)
+                if state.state in (BulkInsertState.ImportFailed, BulkInsertState.ImportFailedAndCleaned):
+                    raise RuntimeError(f"导入任务 {task_id} 失败 {pending[task_id]}: {state.failed_reason}")
+                if state.state == BulkInsertState.ImportCompleted:
+                    rows += state.row_count
+                    del pending[task_id]
+            if not pending:
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"导入任务超时，未完成: {list(pending)}")
+            logger.info(f"导入进行中：剩余 {len(pending)}/{len(tasks)} 个任务")
+            time.sleep(poll_interval)
+        return rows
+
+    def finish(self) -> dict:
+        """提交导入、等待完成、建索引并加载，最后切换别名，返回统计"""
+        started = time.perf_counter()
+        try:
+            rows = self._wait(self._import_files())
+            import_seconds = time.perf_counter() - started
+            self.collection.create_index(field_name="vector",
+                                         index_params=self.store.index_params(self.collection_name))
+            utility.wait_for_index_building_complete(self.staging_name)
+            self.collection.load()
+            self._write_side_stores()
+        except Exception:
+            utility.drop_collection(self.staging_name)
+            raise
+        finally:
+            self._cleanup()
+        self.store.activate(self.collection_name, self.staging_name)
+
+        stats = {
+            "rows": rows,
+            "import_seconds": round(import_seconds, 1),
+            "total_seconds": round(time.perf_counter() - started, 1),
+            "rows_per_sec": round(rows / max(import_seconds, 1e-6), 1)
+        }
+        logger.info(f"批量导入 {self.collection_name} 完成: {rows} 条，导入耗时 {stats['import_seconds']}s"
+                    f"（{stats['rows_per_sec']} 条/秒），含建索引共 {stats['total_seconds']}s")
+        return stats
+
+    def _write_side_stores(self, batch_size: int = 1000):
+        """导入成功后把暂存的记录写入文档存储和BM25索引（切换别名前完成）"""
+        if self._side_file is None:
+            return
+        self._side_file.close()
+        with open(self._side_path, encoding="utf-8") as f:
+            batch = []
+            for line in f:
+                batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    self._flush_side_batch(batch)
+                    batch = []
+            self._flush_side_batch(batch)
+
+    def _flush_side_batch(self, batch: list):
+        if not batch:
+            return
+        if self.doc_store:
+            self.doc_store.put_many((record["id"], record["text"]) for record in batch)
+        if self.lexical_index:
+            self.lexical_index.add(batch)
+
+    def abort(self):
+        self._cleanup()
+        if utility.has_collection(self.staging_name):
+            utility.drop_collection(self.staging_name)
+
+    def _cleanup(self):
+        """local 模式删除导入文件；minio 模式的本地临时文件上传后已删除，桶内文件由生命周期规则清理"""
+        if self.storage == "local":
+            for writer in self._writers.values():
+                shutil.rmtree(writer.data_path, ignore_errors=True)
+        self._writers = {}
+        if self._side_file is not None:
+            self._side_file.close()
+            Path(self._side_path).unlink(missing_ok=True)
+            self._side_file = self._side_path = None
@@ -0,0 +1,59 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_cached = {"signature": None, "generations": {}}
+
+
+def _path() -> Path:
+    return config.collection_generation_path
+
+
+def _read(path: Path) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def get_generation(collection_name: str) -> int:
+    """返回集合当前的数据代数；文件未变化时直接使用进程内缓存（只需一次stat）"""
+    path = _path()
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return 0
+    # 文件以原子替换方式更新，inode 变化即说明内容已更新
+    signature = (stat.st_ino, stat.st_mtime_ns)
+    with _lock:
+        if _cached["signature"] != signature:
+            _cached["generations"] = _read(path)
+            _cached["signature"] = signature
+        return _cached["generations"].get(collection_name, 0)
+
+
+def bump_generation(collection_name: str) -> int:
+    """集合数据发生变化（重建或写入）后调用，使依赖旧数据的缓存全部失效
+
+    计数保存在文件中，多个worker进程共享；读改写过程持有文件锁。
+    """
+    path = _path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix(path.suffix + ".lock"), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        generations = _read(path)
+        generations[collection_name] = generations.get(collection_name, 0) + 1
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(generations, f)
+        os.replace(tmp_path, path)
+    logger.info(f"集合 {collection_name} 数据代数更新为 {generations[collection_name]}")
+    return generations[collection_name]
@@ -0,0 +1,231 @@
+import fcntl
+import logging
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+
+class DocStore:
+    """文档块正文的本地存储：zstd压缩、只追加、内存映射读取
+
+    - 数据文件 texts.<代>.zst：每个文档块单独压缩为一个zstd帧，依次追加
+    - 索引文件 index.<代>.log：每行 "ID\\t偏移\\t长度"，长度为-1表示删除；后写入的行覆盖先写入的
+    - CURRENT 文件记录当前代号；清空和压缩时写入新一代文件后原子切换，读取方检测到代号变化自动重新打开
+
+    写入方（入库进程）通过文件锁互斥；读取方按需增量读取索引、扩大映射范围，按偏移直接切片解压。
+    """
+
+    def __init__(self, directory: Path, compression_level: int = 3):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = None
+        self._offsets = {}  # ID → (偏移, 长度)
+        self._index_size = 0
+        self._mmap = None
+        self._data_file = None
+
+    # ---- 文件布局 ----
+
+    def _data_path(self, generation: int) -> Path:
+        return self.directory / f"texts.{generation}.zst"
+
+    def _index_path(self, generation: int) -> Path:
+        return self.directory / f"index.{generation}.log"
+
+    def _read_current(self) -> int:
+        try:
+            return int((self.directory / "CURRENT").read_text().strip())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_current(self, generation: int):
+        tmp_path = self.directory / "CURRENT.tmp"
+        tmp_path.write_text(str(generation))
+        os.replace(tmp_path, self.directory / "CURRENT")
+
+    @contextmanager
+    def _writer_lock(self):
+        with open(self.directory / ".lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _decompressor(self):
+        """zstd解压器不是线程安全的，每个线程一个"""
+        decompressor = getattr(self._local, "decompressor", None)
+        if decompressor is None:
+            decompressor = self._local.decompressor = zstandard.ZstdDecompressor()
+        return decompressor
+
+    # ---- 读取 ----
+
+    def _close_map(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._data_file is not None:
+            self._data_file.close()
+            self._data_file = None
+
+    def _refresh(self):
+        """在锁内调用：切换到最新一代，增量读取新写入的索引行，数据文件变大时重新映射"""
+        generation = self._read_current()
+        if generation != self._generation:
+            self._close_map()
+            self._offsets = {}
+            self._index_size = 0
+            self._generation = generation
+
+        index_path = self._index_path(generation)
+        try:
+            index_size = index_path.stat().st_size
+        except FileNotFoundError:
+            index_size = 0
+        if index_size > self._index_size:
+            with open(index_path, 'rb') as f:
+                f.seek(self._index_size)
+                chunk = f.read(index_size - self._index_size)
+            # 只处理完整的行，写了一半的行留到下次
+            complete = chunk[:chunk.rfind(b"\n") + 1]
+            for line in complete.decode('utf-8').splitlines():
+                doc_id, offset, length = line.split("\t")
+                if int(length) < 0:
+                    self._offsets.pop(doc_id, None)
+                else:
+                    self._offsets[doc_id] = (int(offset), int(length))
+            self._index_size += len(complete)
+
+        data_path = self._data_path(generation)
+        try:
+            data_size = data_path.stat().st_size
+        except FileNotFoundError:
+            data_size = 0
+        if data_size and (self._mmap is None or len(self._mmap) < data_size):
+            self._close_map()
+            self._data_file = open(data_path, 'rb')
+            self._mmap = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get_many(self, ids) -> dict:
+        """按ID批量读取正文，返回 {ID: 正文}，不存在的ID不出现在结果中"""
+        results = {}
+        with self._lock:
+            self._refresh()
+            if self._mmap is None:
+                return results
+            decompressor = self._decompressor()
+            with memoryview(self._mmap) as view:
+                for doc_id in ids:
+                    entry = self._offsets.get(doc_id)
+                    if entry is None:
+                        continue
+                    offset, length = entry
+                    # 直接在映射上切片，不复制压缩数据
+                    results[doc_id] = decompressor.decompress(view[offset:offset + length]).decode('utf-8')
+        return results
+
+    def get(self, doc_id: str):
+        return self.get_many([doc_id]).get(doc_id)
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._offsets)
+
+    # ---- 写入 ----
+
+    def _append_index(self, generation: int, lines: list):
+        with open(self._index_path(generation), 'a', encoding='utf-8') as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def put_many(self, records):
+        """写入 (ID, 正文) 列表；同一ID再次写入时覆盖旧内容"""
+        records = list(records)
+        if not records:
+            return
+        compressor = zstandard.ZstdCompressor(level=self.compression_level)
+        with self._writer_lock():
+            generation = self._read_current()
+            lines = []
+            # 先写数据并落盘，再写索引，保证索引指向的数据总是完整的
+            with open(self._data_path(generation), 'ab') as f:
+                offset = f.tell()
+                for doc_id, text in records:
+                    frame = compressor.compress(text.encode('utf-8'))
+                    f.write(frame)
+                    lines.append(f"{doc_id}\t{offset}\t{len(frame)}\n")
+                    offset += len(frame)
+                f.flush()
+                os.fsync(f.fileno())
+            self._append_index(generation, lines)
+
+    def delete(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        with self._writer_lock():
+            self._append_index(self._read_current(), [f"{doc_id}\t-1\t-1\n" for doc_id in ids])
+
+    def retain(self, ids):
+        """删除不在 ids 中的文档（批量导入替换集合后清理旧数据）"""
+        keep = set(ids)
+        with self._lock:
+            self._refresh()
+            stale = [doc_id for doc_id in self._offsets if doc_id not in keep]
+        self.delete(stale)
+        return len(stale)
+
+    def _switch_generation(self, old_generation: int, new_generation: int):
+        self._write_current(new_generation)
+        for path in (self._data_path(old_generation), self._index_path(old_generation)):
+            # 读取方已打开的映射在文件删除后仍然有效
+            path.unlink(missing_ok=True)
+
+    def clear(self):
+        """清空（集合全量重建时调用）"""
+        with self._writer_lock():
+            generation = self._read_current()
+            self._data_path(generation + 1).touch()
+            self._index_path(generation + 1).touch()
+            self._switch_generation(generation, generation + 1)
+
+    def compact(self, min_garbage_ratio: float = 0.5) -> bool:
+        """已删除/被覆盖的数据占比超过阈值时，只拷贝仍有效的帧（不重新压缩）到新一代文件"""
+        with self._writer_lock():
+            with self._lock:
+                self._refresh()
+                live = dict(self._offsets)
+                data_size = len(self._mmap) if self._mmap is not None else 0
+                live_size = sum(length for _, length in live.values())
+                if not data_size or (data_size - live_size) / data_size < min_garbage_ratio:
+                    return False
+                generation = self._generation
+                lines = []
+                with open(self._data_path(generation + 1), 'wb') as f, memoryview(self._mmap) as view:
+                    for doc_id, (offset, length) in live.items():
+                        lines.append(f"{doc_id}\t{f.tell()}\t{length}\n")
+                        f.write(view[offset:offset + length])
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._index_path(generation + 1).unlink(missing_ok=True)
+                self._append_index(generation + 1, lines)
+            self._switch_generation(generation, generation + 1)
+        logger.info(f"文档存储压缩完成: {data_size} → {live_size} 字节，{len(live)} 条")
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            return {
+                "documents": len(self._offsets),
+                "data_bytes": len(self._mmap) if self._mmap is not None else 0,
+                "live_bytes": sum(length for _, length in self._offsets.values())
+            }
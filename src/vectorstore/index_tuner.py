@@ -0,0 +1,183 @@
+import logging
+import math
+import time
+import numpy as np
+from pymilvus import Collection, CollectionSchema, FieldSchema, DataType, utility
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+# 各索引类型的检索参数名及候选值
+SEARCH_KNOBS = {
+    "HNSW": ("ef", [16, 32, 64, 128, 256]),
+    "IVF_FLAT": ("nprobe", [4, 8, 16, 32, 64, 128]),
+    "IVF_SQ8": ("nprobe", [4, 8, 16, 32, 64, 128]),
+    "IVF_PQ": ("nprobe", [4, 8, 16, 32, 64, 128]),
+    "DISKANN": ("search_list", [16, 32, 64, 128, 256]),
+}
+DEFAULT_INDEX_TYPES = list(SEARCH_KNOBS)
+
+
+def build_candidates(index_types, row_count: int, dim: int) -> list:
+    """按数据规模生成候选索引的构建参数"""
+    nlist = int(min(65536, max(16, 4 * math.sqrt(row_count))))
+    # IVF_PQ 的子向量数需整除维度，每个子向量取8~16维
+    pq_m = next((m for m in (dim // 8, dim // 16, dim // 4) if m and dim % m == 0), dim)
+    candidates = {
+        "HNSW": [{"M": 16, "efConstruction": 200}, {"M": 32, "efConstruction": 400}],
+        "IVF_FLAT": [{"nlist": nlist}],
+        "IVF_SQ8": [{"nlist": nlist}],
+        "IVF_PQ": [{"nlist": nlist, "m": pq_m, "nbits": 8}],
+        "DISKANN": [{}],
+    }
+    return [(index_type, params) for index_type in index_types for params in candidates[index_type]]
+
+
+def brute_force_topk(base: np.ndarray, queries: np.ndarray, k: int, metric_type: str) -> np.ndarray:
+    """暴力检索得到真实近邻（返回 base 中的行号）"""
+    if metric_type == "L2":
+        scores = -(np.sum(queries ** 2, axis=1, keepdims=True) - 2 * queries @ base.T + np.sum(base ** 2, axis=1))
+    else:
+        scores = queries @ base.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def recall_at_k(truth: np.ndarray, found: list) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(row) & set(hits[:k])) / k for row, hits in zip(truth.tolist(), found)]))
+
+
+class IndexTuner:
+    """向量索引调优：在真实嵌入上构建候选索引，对比召回率与延迟，选出满足目标召回率且P99延迟最低的方案
+
+    测试数据写入临时集合，不影响线上集合；查询向量从样本中留出，不参与建索引。
+    """
+
+    def __init__(self, collection_name: str, sample_size: int = 50000, query_count: int = 200,
+                 top_k: int = 10, target_recall: float = 0.95, index_types=None):
+        self.collection_name = collection_name
+        self.sample_size = sample_size
+        self.query_count = query_count
+        self.top_k = top_k
+        self.target_recall = target_recall
+        self.index_types = index_types or DEFAULT_INDEX_TYPES
+        self.metric_type = config.vector_index(collection_name)["metric_type"]
+        self.tuning_collection = f"{collection_name}_tuning"
+
+    def _load_vectors(self, batch_size: int = 1000) -> np.ndarray:
+        collection = Collection(self.collection_name)
+        collection.load()
+        iterator = collection.query_iterator(batch_size=batch_size, expr="", output_fields=["vector"])
+        vectors = []
+        try:
+            while len(vectors) < self.sample_size:
+                rows = iterator.next()
+                if not rows:
+                    break
+                vectors.extend(row["vector"] for row in rows)
+        finally:
+            iterator.close()
+        return np.asarray(vectors[:self.sample_size], dtype=np.float32)
+
+    def _create_tuning_collection(self, base: np.ndarray) -> Collection:
+        if utility.has_collection(self.tuning_collection):
+            utility.drop_collection(self.tuning_collection)
+        schema = CollectionSchema(fields=[
+            FieldSchema(name="row", dtype=DataType.INT64, is_primary=True),
+            FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=base.shape[1]),
+        ], description="index tuning")
+        collection = Collection(name=self.tuning_collection, schema=schema)
+        for start in range(0, len(base), 5000):
+            batch = base[start:start + 5000]
+            collection.insert([list(range(start, start + len(batch))), batch])
+        collection.flush()
+        return collection
+
+    def _measure(self, collection, queries, truth, search_params) -> dict:
+        """逐条查询测延迟（与线上单问题检索一致），并计算召回率"""
+        latencies, found = [], []
+        for query in queries:
+            started = time.perf_counter()
+            results = collection.search(
+                data=[query.tolist()], anns_field="vector",
+                param={"metric_type": self.metric_type, "params": search_params}, limit=self.top_k
+            )
+            latencies.append((time.perf_counter() - started) * 1000)
+            found.append([hit.id for hit in results[0]])
+        return {
+            "recall": round(recall_at_k(truth, found), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 2)
+        }
+
+    def run(self) -> list:
+        """对所有候选索引和检索参数做基准测试，返回结果列表"""
+        vectors = self._load_vectors()
+        if len(vectors) <= self.query_count:
+            raise ValueError(f"集合 {self.collection_name} 数据不足，无法调优（{len(vectors)} 条）")
+        rng = np.random.default_rng(0)
+        order = rng.permutation(len(vectors))
+        queries, base = vectors[order[:self.query_count]], vectors[order[self.query_count:]]
+        truth = brute_force_topk(base, queries, self.top_k, self.metric_type)
+        logger.info(f"调优样本: {len(base)} 条向量，{len(queries)} 条查询，recall@{self.top_k} 目标 {self.target_recall}")
+
+        collection = self._create_tuning_collection(base)
+        report = []
+        try:
+            for index_type, params in build_candidates(self.index_types, len(base), base.shape[1]):
+                knob, values = SEARCH_KNOBS[index_type]
+                try:
+                    collection.release()
+                    collection.drop_index()
+                    started = time.perf_counter()
+                    collection.create_index(field_name="vector", index_params={
+                        "metric_type": self.metric_type, "index_type": index_type, "params": params
+                    })
+                    utility.wait_for_index_building_complete(self.tuning_collection)
+                    build_seconds = round(time.perf_counter() - started, 1)
+                    collection.load()
+                except Exception as e:
+                    logger.warning(f"跳过 {index_type} {params}: {e}")
+                    continue
+                for value in values:
+                    if knob in ("ef", "search_list") and value < self.top_k:
+                        continue  # ef / search_list 不能小于 topk（nprobe 无此限制）
+                    result = {
+                        "index_type": index_type,
+                        "params": params,
+                        "search_params": {knob: value},
+                        "build_seconds": build_seconds,
+                        **self._measure(collection, queries, truth, {knob: value})
+                    }
+                    logger.info(f"{index_type} {params} {knob}={value}: recall={result['recall']} "
+                                f"p50={result['p50_ms']}ms p99={result['p99_ms']}ms")
+                    report.append(result)
+        finally:
+            utility.drop_collection(self.tuning_collection)
+        return report
+
+    def choose(self, report: list) -> dict:
+        """达到目标召回率的方案中取P99延迟最低者；都达不到时取召回率最高者"""
+        qualified = [result for result in report if result["recall"] >= self.target_recall]
+        if qualified:
+            return min(qualified, key=lambda result: (result["p99_ms"], result["p50_ms"]))
+        logger.warning(f"没有方案达到目标召回率 {self.target_recall}，选择召回率最高的方案")
+        return max(report, key=lambda result: (result["recall"], -result["p99_ms"]))
+
+    def save(self, best: dict):
+        """写入 config.json 的 vector_index.<集合>，保留原检索参数中与调优无关的项（如 radius）"""
+        current = config.vector_index(self.collection_name)
+        knobs = {knob for knob, _ in SEARCH_KNOBS.values()}
+        search_params = {key: value for key, value in current.get("search_params", {}).items() if key not in knobs}
+        search_params.update(best["search_params"])
+        indexes = dict(config._config.get("vector_index", {}))
+        indexes[self.collection_name] = {
+            "index_type": best["index_type"],
+            "metric_type": self.metric_type,
+            "params": best["params"],
+            "search_params": search_params
+        }
+        config.save_section("vector_index", indexes)
+        logger.info(f"已写入 {self.collection_name} 的索引配置: {indexes[self.collection_name]}，重建集合后生效")
@@ -0,0 +1,170 @@
+import logging
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+import jieba
+
+logger = logging.getLogger(__name__)
+
+# SQL函数名、配置项、错误码等标识符整体保留（如 array_contains、enable_profile、E-230）
+IDENTIFIER_PATTERN = re.compile(r'[a-z0-9_][a-z0-9_.\-]*[a-z0-9_]|[a-z0-9_]')
+WORD_PATTERN = re.compile(r'\w')
+
+
+def tokenize(text: str) -> list:
+    """分词：标识符保留原形并补充拆分后的子词，其余部分使用jieba搜索引擎模式切分"""
+    text = text.lower()
+    tokens = []
+    for match in IDENTIFIER_PATTERN.finditer(text):
+        token = match.group()
+        tokens.append(token)
+        parts = [part for part in re.split(r'[_.\-]', token) if part]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    rest = IDENTIFIER_PATTERN.sub(' ', text)
+    tokens.extend(word for word in jieba.cut_for_search(rest) if WORD_PATTERN.match(word))
+    return tokens
+
+
+class LexicalIndex:
+    """基于SQLite的BM25倒排索引，与向量集合一一对应，入库时同步维护"""
+
+    def __init__(self, path: Path, k1: float = 1.2, b: float = 0.75):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.k1 = k1
+        self.b = b
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id TEXT PRIMARY KEY,
+                length INTEGER NOT NULL,
+                versions TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id);
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _encode_versions(versions) -> str:
+        # 前后加分隔符，便于按 LIKE '%,3.0,%' 过滤
+        return "," + ",".join(versions) + ","
+
+    def add(self, records: list):
+        """写入（或覆盖）文档，records 中需包含 id、text，以及 versions 或 version"""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            self._delete(conn, [record["id"] for record in records])
+            for record in records:
+                terms = Counter(tokenize(record["text"]))
+                versions = record.get("versions") or [record.get("version", "")]
+                conn.execute(
+                    "INSERT INTO docs (id, length, versions) VALUES (?, ?, ?)",
+                    (record["id"], sum(terms.values()), self._encode_versions(versions))
+                )
+                conn.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term, record["id"], tf) for term, tf in terms.items()]
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _delete(conn, ids: list, batch_size: int = 500):
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            conn.execute(f"DELETE FROM postings WHERE doc_id IN ({placeholders})", batch)
+            conn.execute(f"DELETE FROM docs WHERE id IN ({placeholders})", batch)
+
+    def delete(self, ids: list):
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            self._delete(conn, list(ids))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def retain(self, ids) -> int:
+        """删除不在 ids 中的文档（批量导入替换集合后清理旧数据），返回删除条数"""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_ids (id TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM keep_ids")
+            conn.executemany("INSERT OR IGNORE INTO keep_ids (id) VALUES (?)", [(doc_id,) for doc_id in ids])
+            conn.execute("DELETE FROM postings WHERE doc_id NOT IN (SELECT id FROM keep_ids)")
+            removed = conn.execute("DELETE FROM docs WHERE id NOT IN (SELECT id FROM keep_ids)").rowcount
+            conn.execute("DELETE FROM keep_ids")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
+
+    def clear(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM postings")
+        conn.execute("DELETE FROM docs")
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def search(self, query: str, limit: int = 10, versions=None) -> list:
+        """BM25检索，返回 [(文档ID, 分数)]，versions 非空时只返回属于其中任一版本的文档"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        conn = self._connect()
+        doc_count, avg_length = conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+        if not doc_count:
+            return []
+        placeholders = ",".join("?" * len(terms))
+        df = dict(conn.execute(
+            f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", terms
+        ).fetchall())
+        # 出现在一半以上文档中的词（如"的"、"如何"）区分度为负，直接忽略，也避免读取超长倒排表
+        idf = {
+            term: math.log((doc_count - count + 0.5) / (count + 0.5))
+            for term, count in df.items() if count < doc_count / 2
+        }
+        if not idf:
+            return []
+
+        placeholders = ",".join("?" * len(idf))
+        sql = (f"SELECT p.doc_id, p.term, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id "
+               f"WHERE p.term IN ({placeholders})")
+        params = list(idf)
+        if versions:
+            sql += " AND (" + " OR ".join("d.versions LIKE ?" for _ in versions) + ")"
+            params += [f"%,{version},%" for version in versions]
+
+        scores = {}
+        for doc_id, term, tf, length in conn.execute(sql, params):
+            norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf[term] * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
@@ -3,7 +3,24 @@ from pymilvus import connections, Collection, CollectionSchema, FieldSchema, Dat
 from settings import config
 import re
 import jieba
+import numpy as np
 import time
+import asyncio
+import weakref
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from .lexical_index import LexicalIndex
+from .doc_store import DocStore
+from .bulk_writer import BulkWriter
+from .bulk_importer import BulkImporter
+from .upserter import Upserter
+from .collection_generation import get_generation
+
+try:
+    from pymilvus import AsyncMilvusClient
+except ImportError:  # pymilvus < 2.5.3
+    AsyncMilvusClient = None
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +28,12 @@ class MilvusStore:
     def __init__(self):
         try:
             self.col = None
+            self._col_generation = None
+            self._async_clients = weakref.WeakKeyDictionary()
+            self._lexical_indexes = {}
+            self._doc_stores = {}
+            self._partitions = {}  # 集合 → (集合代数, 分区名列表)
+            self._created_partitions = set()
             self.host = config.milvus_host
             self.port = config.milvus_port
             self.vector_dim = config.vector_dimension
@@ -23,31 +46,46 @@ class MilvusStore:
             logger.error(f"连接Milvus服务器失败: {str(e)}")
             raise
 
-    def create_collection(self, collection_name):
+    def create_collection(self, collection_name, with_index=True, target_name=None):
+        """创建（重建）集合
+        
+        Args:
+            collection_name: 集合名，决定索引参数、文档存储等配置
+            with_index: 为False时由 BulkWriter/BulkImporter 在数据写完后再建索引
+            target_name: 实际创建的集合名（如批量导入的影子集合），默认与 collection_name 相同
+        """
+        target_name = target_name or collection_name
         try:
-            logger.info(f"开始创建集合: {collection_name}")
+            logger.info(f"开始创建集合: {target_name}")
             
-            if utility.has_collection(collection_name):
-                logger.info(f"集合 {collection_name} 已存在，正在删除")
-                collection = Collection(collection_name)
+            if utility.has_collection(target_name):
+                logger.info(f"集合 {target_name} 已存在，正在删除")
+                collection = Collection(target_name)
                 collection.drop()
                 # 等待删除操作完成
                 for _ in range(30):
-                    if not utility.has_collection(collection_name):
+                    if not utility.has_collection(target_name):
                         break
                     time.sleep(1)
-                if utility.has_collection(collection_name):
+                if utility.has_collection(target_name):
                     raise Exception("删除集合超时")
                 logger.info("旧集合删除成功")
             
-            # 保持原有字段和schema定义
+            # 保持原有字段和schema定义；启用本地文档存储时正文不存入Milvus
+            doc_store = self.doc_store(collection_name)
+            text_fields = [] if doc_store else [FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=65000)]
             fields = [
                 FieldSchema(name="id", dtype=DataType.VARCHAR, max_length=64, is_primary=True),
-                FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=65000),
+                *text_fields,
                 FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=self.vector_dim),
                 FieldSchema(name="version", dtype=DataType.VARCHAR, max_length=10),
                 FieldSchema(name="url", dtype=DataType.VARCHAR, max_length=1024),
                 FieldSchema(name="is_community", dtype=DataType.BOOL),
+                # 内容相同的文档块只存一份，记录其所属的全部版本和URL
+                FieldSchema(name="versions", dtype=DataType.ARRAY, element_type=DataType.VARCHAR,
+                            max_capacity=16, max_length=10),
+                FieldSchema(name="urls", dtype=DataType.ARRAY, element_type=DataType.VARCHAR,
+                            max_capacity=16, max_length=1024),
             ]
             
             schema = CollectionSchema(
@@ -55,16 +93,20 @@ class MilvusStore:
                 description=f"Collection for {collection_name}",
                 enable_dynamic_field=True
             )
-            collection = Collection(name=collection_name, schema=schema)
+            collection = Collection(name=target_name, schema=schema)
             
-            # 创建索引
-            index_params = {
-                "metric_type": "IP",
-                "index_type": "IVF_FLAT",
-                "params": {"nlist": 1024}
-            }
-            collection.create_index(field_name="vector", index_params=index_params)
-            utility.wait_for_index_building_complete(collection_name)
+            # 创建索引（参数由 tune_index 命令根据实测召回率和延迟选定）
+            if with_index:
+                collection.create_index(field_name="vector", index_params=self.index_params(collection_name))
+                utility.wait_for_index_building_complete(target_name)
+            
+            if target_name == collection_name:
+                # 影子集合与线上集合共用文档存储和BM25索引，替换完成后再清理
+                lexical_index = self.lexical_index(collection_name)
+                if lexical_index:
+                    lexical_index.clear()
+                if doc_store:
+                    doc_store.clear()
             
             return collection
             
@@ -72,6 +114,245 @@ class MilvusStore:
             logger.error(f"创建集合失败: {str(e)}")
             raise
 
+    def _collection(self, collection_name) -> Collection:
+        """检索用的集合句柄：集合代数变化（重建、别名切换）后重新获取并确认已加载"""
+        generation = get_generation(collection_name)
+        if not self.col or self.col.name != collection_name or self._col_generation != generation:
+            self.col = Collection(collection_name)
+            self.col.load()
+            self._col_generation = generation
+        return self.col
+
+    # ---- 蓝绿重建：各代物理集合为 <集合名>_v<代号>，检索使用与集合名相同的别名 ----
+
+    VERSION_SUFFIX = "_v"
+
+    @classmethod
+    def collection_versions(cls, collection_name) -> list:
+        """集合的各代物理集合名，按代号升序"""
+        pattern = re.compile(re.escape(collection_name + cls.VERSION_SUFFIX) + r'(\d+)$')
+        versions = []
+        for name in utility.list_collections():
+            match = pattern.match(name)
+            if match:
+                versions.append((int(match.group(1)), name))
+        return [name for _, name in sorted(versions)]
+
+    def next_collection_version(self, collection_name) -> str:
+        versions = self.collection_versions(collection_name)
+        number = int(versions[-1].rsplit(self.VERSION_SUFFIX, 1)[1]) + 1 if versions else 1
+        return f"{collection_name}{self.VERSION_SUFFIX}{number}"
+
+    def active_collection(self, collection_name):
+        """别名当前指向的物理集合，尚未使用别名时返回None"""
+        for name in self.collection_versions(collection_name):
+            if collection_name in utility.list_aliases(name):
+                return name
+        return None
+
+    def _warm_up(self, physical_name, collection_name, queries: int):
+        """切换前用集合中的向量发几次检索，使索引和段数据进入内存"""
+        if queries <= 0:
+            return
+        collection = Collection(physical_name)
+        rows = collection.query(expr="", output_fields=["vector"], limit=queries)
+        for row in rows:
+            collection.search(data=[row["vector"]], anns_field="vector",
+                              param=self._search_params(collection_name), limit=10)
+        logger.info(f"集合 {physical_name} 预热完成（{len(rows)} 次检索）")
+
+    def activate(self, collection_name, physical_name):
+        """预热新一代集合后把别名原子切换过去，保留最近 keep_previous 代供回滚，更早的删除
+        
+        首次切换时线上集合还是与别名同名的普通集合，Milvus 不允许别名与集合重名，只能先把它改名为第0代再创建别名，
+        两步之间（通常不到1秒）按集合名的查询会失败；此后的切换都是别名的原子切换，没有中断。
+        调用方随后需 bump_generation，使各进程的集合句柄、分区和结果缓存失效。
+        """
+        blue_green = config.blue_green_config
+        self._warm_up(physical_name, collection_name, blue_green.get("warmup_queries", 20))
+        if collection_name in utility.list_collections():
+            previous = f"{collection_name}{self.VERSION_SUFFIX}0"
+            logger.warning(f"首次蓝绿切换：集合 {collection_name} 改名为 {previous} 后创建同名别名，"
+                           f"期间对 {collection_name} 的查询会短暂失败")
+            utility.rename_collection(collection_name, previous)
+            try:
+                utility.create_alias(physical_name, collection_name)
+            except Exception:
+                # 别名创建失败时改回原名，线上集合保持可用
+                utility.rename_collection(previous, collection_name)
+                raise
+        else:
+            previous = self.active_collection(collection_name)
+            if previous:
+                utility.alter_alias(physical_name, collection_name)
+            else:
+                utility.create_alias(physical_name, collection_name)
+        logger.info(f"别名 {collection_name} 已切换到 {physical_name}")
+
+        # 优先保留切换前的线上集合，其次是较新的各代
+        others = [name for name in reversed(self.collection_versions(collection_name)) if name != physical_name]
+        if previous in others:
+            others.remove(previous)
+            others.insert(0, previous)
+        kept = others[:max(blue_green.get("keep_previous", 1), 0)]
+        for name in others:
+            if name not in kept:
+                utility.drop_collection(name)
+                logger.info(f"已删除旧集合 {name}")
+        self._prune_side_stores(collection_name, [physical_name] + kept)
+
+    def rollback(self, collection_name) -> str:
+        """别名切回上一代集合，返回切换到的集合名"""
+        active = self.active_collection(collection_name)
+        versions = self.collection_versions(collection_name)
+        older = versions[:versions.index(active)] if active in versions else []
+        if not older:
+            raise ValueError(f"集合 {collection_name} 没有可回滚的上一代")
+        utility.alter_alias(older[-1], collection_name)
+        logger.info(f"别名 {collection_name} 已回滚到 {older[-1]}")
+        return older[-1]
+
+    def _prune_side_stores(self, collection_name, physical_names, batch_size=5000):
+        """文档存储和BM25索引按集合名维护，只保留仍在各代集合中的ID（回滚后正文仍可读）"""
+        doc_store = self.doc_store(collection_name)
+        lexical_index = self.lexical_index(collection_name)
+        if not doc_store and not lexical_index:
+            return
+        ids = set()
+        for name in physical_names:
+            ids.update(self.collection_ids(name, batch_size))
+        removed = (doc_store.retain(ids) if doc_store else 0, lexical_index.retain(ids) if lexical_index else 0)
+        logger.info(f"已清理文档存储/BM25索引中不再使用的文档块: {removed[0]}/{removed[1]}")
+
+    def lexical_index(self, collection_name):
+        """集合对应的BM25倒排索引，未启用混合检索时返回None"""
+        hybrid_config = config.hybrid_search_config
+        if not hybrid_config.get("enabled", False):
+            return None
+        index = self._lexical_indexes.get(collection_name)
+        if index is None:
+            index_dir = Path(hybrid_config.get("index_dir", "data/lexical_index"))
+            index = self._lexical_indexes[collection_name] = LexicalIndex(
+                index_dir / f"{collection_name}.sqlite",
+                k1=hybrid_config.get("k1", 1.2),
+                b=hybrid_config.get("b", 0.75)
+            )
+        return index
+
+    def doc_store(self, collection_name):
+        """集合对应的本地正文存储，未启用时返回None"""
+        store_config = config.doc_store_config
+        if not store_config.get("enabled", False) or collection_name not in store_config.get("collections", []):
+            return None
+        store = self._doc_stores.get(collection_name)
+        if store is None:
+            store = self._doc_stores[collection_name] = DocStore(
+                Path(store_config.get("dir", "data/doc_store")) / collection_name,
+                compression_level=store_config.get("compression_level", 3)
+            )
+        return store
+
+    def rebuild_lexical_index(self, collection_name, batch_size=1000) -> int:
+        """从集合中已有的数据重建BM25索引（对已有集合启用混合检索时使用）"""
+        lexical_index = self.lexical_index(collection_name)
+        if lexical_index is None:
+            return 0
+        collection = Collection(collection_name)
+        collection.load()
+        lexical_index.clear()
+        doc_store = self.doc_store(collection_name)
+        iterator = collection.query_iterator(
+            batch_size=batch_size, expr='id != ""',
+            output_fields=["version", "versions"] if doc_store else ["text", "version", "versions"]
+        )
+        total = 0
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                if doc_store:
+                    texts = doc_store.get_many([row["id"] for row in rows])
+                    rows = [{**row, "text": texts.get(row["id"], "")} for row in rows]
+                lexical_index.add(rows)
+                total += len(rows)
+        finally:
+            iterator.close()
+        logger.info(f"集合 {collection_name} 的BM25索引重建完成: {total} 条")
+        return total
+
+    def has_collection(self, collection_name) -> bool:
+        """集合是否存在"""
+        return utility.has_collection(collection_name)
+
+    def delete_by_ids(self, collection_name, ids, batch_size=500):
+        """按主键批量删除数据"""
+        try:
+            ids = list(dict.fromkeys(ids))
+            if not ids:
+                return 0
+            collection = Collection(collection_name)
+            for i in range(0, len(ids), batch_size):
+                batch = ids[i:i + batch_size]
+                id_list = ", ".join(f'"{doc_id}"' for doc_id in batch)
+                collection.delete(f"id in [{id_list}]")
+            lexical_index = self.lexical_index(collection_name)
+            doc_store = self.doc_store(collection_name)
+            if lexical_index or doc_store:
+                # 保留的上一代集合仍引用的ID不从共用的文档存储和BM25索引中删除，回滚后仍可读；切换时统一清理
+                kept = self._ids_in_previous_generations(collection_name, ids, batch_size)
+                side_ids = [doc_id for doc_id in ids if doc_id not in kept]
+                if lexical_index:
+                    lexical_index.delete(side_ids)
+                if doc_store:
+                    doc_store.delete(side_ids)
+            logger.info(f"从 {collection_name} 删除 {len(ids)} 条数据")
+            return len(ids)
+        except Exception as e:
+            logger.error(f"批量删除失败: {str(e)}")
+            raise
+
+    def _ids_in_previous_generations(self, collection_name, ids, batch_size=500) -> set:
+        """ids 中仍存在于别名未指向的其他各代集合中的ID；查询失败时保守地视为全部仍在使用"""
+        active = self.active_collection(collection_name)
+        others = [name for name in self.collection_versions(collection_name) if name != active]
+        found = set()
+        for name in others:
+            try:
+                collection = Collection(name)
+                for i in range(0, len(ids), batch_size):
+                    rows = collection.query(expr=self._id_expr(ids[i:i + batch_size]), output_fields=["id"])
+                    found.update(str(row["id"]) for row in rows)
+            except Exception as e:
+                logger.warning(f"查询 {name} 中的文档块失败，暂不清理文档存储/BM25索引: {str(e)}")
+                return set(ids)
+        return found
+
+    def collection_ids(self, collection_name, batch_size=5000):
+        """逐批遍历集合中的全部主键"""
+        iterator = Collection(collection_name).query_iterator(
+            batch_size=batch_size, expr='id != ""', output_fields=["id"]
+        )
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                yield from (str(row["id"]) for row in rows)
+        finally:
+            iterator.close()
+
+    def sample_vectors(self, collection_name, limit=10000) -> list:
+        """取集合中的一批向量（用于构建审核主题中心）"""
+        try:
+            collection = Collection(collection_name)
+            collection.load()
+            rows = collection.query(expr='id != ""', output_fields=["vector"], limit=min(limit, 16384))
+            return [row["vector"] for row in rows]
+        except Exception as e:
+            logger.error(f"读取向量样本失败: {str(e)}")
+            raise
+
     def _find_best_split_point(self, text, max_length):
         """找到最佳分割点，优先考虑段落、句子和词语边界"""
         if len(text) <= max_length:
@@ -191,10 +472,9 @@ class MilvusStore:
         text = '\n'.join(line for line in text.splitlines() if line.strip())
         return text
 
-    def insert_data(self, collection_name, data, batch_size=200):
+    def insert_data(self, collection_name, data, batch_size=None):
         """改进的数据插入方法"""
         logger.info(f"开始向集合 {collection_name} 插入数据，数据量: {len(data)}")
-        collection = Collection(collection_name)
         max_text_length = 63000
         
         processed_data = []
@@ -221,7 +501,7 @@ class MilvusStore:
                 # 创建每个片段的记录
                 for j, (chunk, metadata) in enumerate(zip(text_chunks, chunk_metadata)):
                     processed_item = item.copy()
-                    processed_item["id"] = current_id
+                    processed_item["id"] = str(current_id)
                     processed_item["text"] = chunk
                     processed_item.update(metadata)
                     processed_item["has_more"] = j < len(text_chunks) - 1
@@ -240,174 +520,382 @@ class MilvusStore:
         total_chunks = len(processed_data)
         logger.info(f"处理后的总记录数: {total_chunks}")
         
-        # 分批插入处理后的数据
-        successful_inserts = 0
-        for i in range(0, total_chunks, batch_size):
-            batch = processed_data[i:i + batch_size]
-            logger.info(f"插入第 {i//batch_size + 1} 批数据，范围: {i}-{min(i + batch_size, total_chunks)}")
-            
-            # 逐条插入数据
-            successful_batch = []
-            for idx, item in enumerate(batch):
-                try:
-                    # 检查文本长度
-                    text_len = len(item["text"])
-                    if text_len > 63000:
-                        logger.error(f"发现异常超长文本: {text_len} > 63000")
-                        logger.error(f"文档URL: {item.get('url', 'unknown')}")
-                        logger.error(f"文本内容预览:\n{item['text'][:200]}...\n...{item['text'][-200:]}")
-                        failed_items.append({
-                            "index": idx + i,
-                            "url": item.get("url", "unknown"),
-                            "length": text_len,
-                            "error": "文本超长"
-                        })
-                        continue
-                    
-                    # 插入单条数据
-                    collection.insert([item])
-                    successful_batch.append(item)
-                    successful_inserts += 1
-                    
-                except Exception as e:
-                    logger.error(f"插入第 {idx + i} 条数据时发生错误: {str(e)}")
-                    failed_items.append({
-                        "index": idx + i,
-                        "url": item.get("url", "unknown"),
-                        "error": str(e)
-                    })
-            
-            # 批量持久化成功插入的数据
-            if successful_batch:
-                try:
-                    logger.info("等待数据持久化...")
-                    collection.flush()
-                    res = utility.wait_for_index_building_complete(collection_name)
-                    if not res:
-                        logger.error(f"批次 {i//batch_size + 1} 数据持久化超时")
-                    else:
-                        logger.info(f"成功持久化第 {i//batch_size + 1} 批数据中的 {len(successful_batch)} 条记录")
-                    
-                    # 验证插入
-                    time.sleep(1)
-                    count = collection.num_entities
-                    logger.info(f"当前集合实体数量: {count}")
-                    
-                except Exception as e:
-                    logger.error(f"持久化第 {i//batch_size + 1} 批数据时发生错误: {str(e)}")
+        # 列式批量写入：多个插入请求同时进行，全部写完后只flush一次并等待索引
+        writer = self.bulk_writer(collection_name, batch_size=batch_size)
+        valid_items = []
+        for idx, item in enumerate(processed_data):
+            text_len = len(item["text"])
+            if text_len > 63000:
+                logger.error(f"发现异常超长文本: {text_len} > 63000，文档URL: {item.get('url', 'unknown')}")
+                failed_items.append({"index": idx, "url": item.get("url", "unknown"), "error": "文本超长"})
+                continue
+            valid_items.append(item)
+        writer.write(valid_items)
+        stats = writer.close()
+        failed_ids = set(writer.failed_ids)
+        for idx, item in enumerate(valid_items):
+            if item["id"] in failed_ids:
+                failed_items.append({"index": idx, "url": item.get("url", "unknown"), "error": "插入失败"})
         
         # 汇总处理结果
-        logger.info(f"数据插入完成，成功: {successful_inserts}，失败: {len(failed_items)}")
+        logger.info(f"数据插入完成，成功: {stats['rows']}，失败: {len(failed_items)}，{stats['rows_per_sec']} 条/秒")
         if failed_items:
             logger.error("失败项目详情:")
             for item in failed_items:
                 logger.error(f"索引: {item['index']}, URL: {item['url']}, 错误: {item['error']}")
         
-        return successful_inserts > 0  # 只要有成功插入的数据就返回True
+        return stats["rows"] > 0  # 只要有成功插入的数据就返回True
+
+    def bulk_importer(self, collection_name) -> BulkImporter:
+        """创建离线批量导入器（先创建影子集合），参数见 bulk_import"""
+        if collection_name == "jira_issues":
+            create_fn = partial(self.create_jira_collection, with_index=False)
+        else:
+            create_fn = partial(self.create_collection, collection_name, False)  # 参数为新一代集合名
+        return BulkImporter(self, collection_name, create_fn)
+
+    def bulk_writer(self, collection_name, batch_size=None, target_name=None) -> BulkWriter:
+        """创建列式批量写入器，默认参数见 ingest.bulk_write；target_name 为写入的新一代集合"""
+        bulk_config = config.ingest_config.get("bulk_write", {})
+        return BulkWriter(
+            self, collection_name, target_name=target_name,
+            batch_size=batch_size or bulk_config.get("batch_size", 1000),
+            max_in_flight=bulk_config.get("max_in_flight", 4)
+        )
         
-    def search(self, collection_name, query_vector, limit=5):
-        """改进版搜索，增加多样性"""
+    SEARCH_OUTPUT_FIELDS = ["text", "version", "url", "is_community", "versions", "urls"]
+    SCALAR_OUTPUT_FIELDS = ["version", "url", "is_community", "versions", "urls"]  # 两阶段检索第一阶段不取正文
+    SEARCH_VERSIONS = ["3.0", "2.1"]  # 问题未指定版本时检索的版本，优先最新版本
+    PARTITION_PREFIX = "v_"
+
+    # ---- 版本分区 ----
+
+    @classmethod
+    def partition_name(cls, versions) -> str:
+        """按文档块所属的版本集合命名分区，如 ['3.0', '2.1'] → v_2_1__3_0"""
+        return cls.PARTITION_PREFIX + "__".join(sorted(re.sub(r'\W', '_', version) for version in versions))
+
+    @classmethod
+    def partition_versions(cls, partition_name: str) -> set:
+        if not partition_name.startswith(cls.PARTITION_PREFIX):
+            return set()
+        return {part.replace("_", ".") for part in partition_name[len(cls.PARTITION_PREFIX):].split("__")}
+
+    def _split_by_partition(self, data: list) -> dict:
+        """按分区分组待写入的记录，未启用版本分区或记录没有版本列表时返回 {None: data}"""
+        if not config.partition_by_version or not all(item.get("versions") for item in data):
+            return {None: data}
+        groups = {}
+        for item in data:
+            groups.setdefault(self.partition_name(item["versions"]), []).append(item)
+        return groups
+
+    def _ensure_partition(self, collection, partition_name):
+        # 别名切换到新集合后代数加一，需重新确认分区
+        key = (collection.name, get_generation(collection.name), partition_name)
+        if partition_name is None or key in self._created_partitions:
+            return
+        if not collection.has_partition(partition_name):
+            collection.create_partition(partition_name)
+        self._created_partitions.add(key)
+
+    def _route_partitions(self, partition_names, versions):
+        """选出包含目标版本的分区；集合未按版本分区时返回None（退回标量过滤）"""
+        if not any(name.startswith(self.PARTITION_PREFIX) for name in partition_names):
+            return None
+        wanted = set(versions)
+        return [name for name in partition_names if self.partition_versions(name) & wanted]
+
+    def _cached_partitions(self, collection_name):
+        """集合代数不变时复用分区列表，入库后（代数加一）重新读取"""
+        generation = get_generation(collection_name)
+        cached = self._partitions.get(collection_name)
+        return cached[1] if cached and cached[0] == generation else None
+
+    def _sync_partitions(self, collection_name):
+        partition_names = self._cached_partitions(collection_name)
+        if partition_names is None:
+            partition_names = [partition.name for partition in self._collection(collection_name).partitions]
+            self._partitions[collection_name] = (get_generation(collection_name), partition_names)
+        return partition_names
+
+    async def _async_partitions(self, client, collection_name):
+        partition_names = self._cached_partitions(collection_name)
+        if partition_names is None:
+            partition_names = await client.list_partitions(collection_name)
+            self._partitions[collection_name] = (get_generation(collection_name), partition_names)
+        return partition_names
+
+    @staticmethod
+    def _url_for_version(urls, version: str, default: str) -> str:
+        """在文档块的URL中找出指定版本的那一个（2.1等隐藏版本号的URL中没有版本段）"""
+        unversioned = None
+        for url in urls:
+            match = re.search(r'/(?:docs/|version-)(\d+\.\d+)/', url)
+            if match and match.group(1) == version:
+                return url
+            if not match and unversioned is None:
+                unversioned = url
+        return unversioned or default
+
+    def _apply_version_weights(self, hits, versions):
+        """按问题涉及的版本为结果加权：取文档块所属版本与目标版本交集中权重最高者，并换用该版本的URL"""
+        weights = config.get_version_weights
+        for hit in hits:
+            matched = [version for version in hit["versions"] if version in versions] or [hit["version"]]
+            best = max(matched, key=lambda version: weights.get(version, 1.0))
+            hit["version_weight"] = weights.get(best, 1.0)
+            if best != hit["version"]:
+                hit["version"] = best
+                hit["url"] = self._url_for_version(hit["urls"], best, hit["url"])
+        return hits
+
+    def _fetch_limit(self, limit: int) -> int:
+        """初始结果集大小：多取一些供重排和去重"""
+        return limit * config.search_config.get("overfetch", 3)
+
+    @staticmethod
+    def index_params(collection_name) -> dict:
+        index = config.vector_index(collection_name)
+        return {
+            "metric_type": index["metric_type"],
+            "index_type": index["index_type"],
+            "params": index.get("params", {})
+        }
+
+    @staticmethod
+    def _search_params(collection_name) -> dict:
+        index = config.vector_index(collection_name)
+        return {"metric_type": index["metric_type"], "params": index.get("search_params", {})}
+
+    def search_expr(self, versions=None) -> str:
+        # 版本过滤，文档块可能同时属于多个版本
+        return f"array_contains_any(versions, {list(versions or self.SEARCH_VERSIONS)})"
+
+    @staticmethod
+    def _format_hit(entity: dict, score: float, doc_id=None) -> dict:
+        return {
+            "id": str(doc_id if doc_id is not None else entity.get("id", "")),
+            "text": str(entity.get("text", "")),
+            "version": str(entity.get("version", "")),
+            "url": str(entity.get("url", "")),
+            "is_community": bool(entity.get("is_community", False)),
+            "versions": list(entity.get("versions") or []),
+            "urls": list(entity.get("urls") or []),
+            "score": float(score)
+        }
+
+    @staticmethod
+    def _rrf_fuse(ranked_lists, limit: int, k: int = 60) -> list:
+        """倒数排名融合：score = Σ 1/(k + rank)，返回 [(文档ID, 融合分数)]"""
+        scores = {}
+        for ranked in ranked_lists:
+            for rank, doc_id in enumerate(ranked, start=1):
+                scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def _lexical_candidates(self, collection_name, query_text, limit, versions):
+        """混合检索时返回BM25命中的文档ID列表，未启用或无查询文本时返回None"""
+        lexical_index = self.lexical_index(collection_name) if query_text else None
+        if lexical_index is None:
+            return None
+        return [doc_id for doc_id, _ in lexical_index.search(query_text, limit, versions=versions)]
+
+    def _merge_hybrid(self, dense_hits, lexical_ids, fetched, limit):
+        """按RRF融合向量与BM25结果，score 替换为融合分数，fetched 为仅被BM25命中的文档"""
+        dense_by_id = {hit["id"]: hit for hit in dense_hits}
+        fused = self._rrf_fuse(
+            [[hit["id"] for hit in dense_hits], lexical_ids],
+            limit,
+            k=config.hybrid_search_config.get("rrf_k", 60)
+        )
+        results = []
+        for doc_id, score in fused:
+            hit = dense_by_id.get(doc_id) or fetched.get(doc_id)
+            if hit is not None:
+                results.append({**hit, "score": score})
+        logger.info(f"混合检索：向量 {len(dense_hits)} 条，BM25 {len(lexical_ids)} 条，融合后 {len(results)} 条")
+        return results
+
+    @staticmethod
+    def _id_expr(ids) -> str:
+        return "id in [" + ", ".join(f'"{doc_id}"' for doc_id in ids) + "]"
+
+    def _output_fields(self, collection_name, with_text: bool) -> list:
+        """正文保存在本地文档存储时，Milvus只返回小字段，正文随后从本地读取"""
+        if with_text and not self.doc_store(collection_name):
+            return self.SEARCH_OUTPUT_FIELDS
+        return self.SCALAR_OUTPUT_FIELDS
+
+    def _fill_texts(self, collection_name, hits, with_text: bool):
+        doc_store = self.doc_store(collection_name)
+        if with_text and doc_store:
+            texts = doc_store.get_many([hit["id"] for hit in hits])
+            for hit in hits:
+                hit["text"] = texts.get(hit["id"], "")
+        return hits
+
+    def fetch_texts(self, collection_name, ids) -> dict:
+        """按主键批量读取正文，返回 {ID: 正文}；启用本地文档存储时直接从本地读取"""
+        if not ids:
+            return {}
+        doc_store = self.doc_store(collection_name)
+        if doc_store:
+            return doc_store.get_many(ids)
+        rows = self._collection(collection_name).query(expr=self._id_expr(ids), output_fields=["text"])
+        return {str(row["id"]): row["text"] for row in rows}
+
+    def fetch_records(self, collection_name, ids) -> list:
+        """按主键读取完整记录（含向量和正文），用于改写元数据后重新写入；强一致读取，能读到刚写入的数据"""
+        if not ids:
+            return []
+        collection = Collection(collection_name)
+        fields = [field.name for field in collection.schema.fields]
+        rows = collection.query(expr=self._id_expr(ids), output_fields=fields, consistency_level="Strong")
+        records = [{name: row[name] for name in fields} for row in rows]
+        doc_store = self.doc_store(collection_name)
+        if doc_store:
+            texts = doc_store.get_many([record["id"] for record in records])
+            for record in records:
+                record["text"] = texts.get(record["id"], "")
+        for record in records:
+            record["id"] = str(record["id"])
+            record["vector"] = np.asarray(record["vector"], dtype=np.float32)
+        return records
+
+    async def afetch_texts(self, collection_name, ids) -> dict:
+        if not ids:
+            return {}
+        doc_store = self.doc_store(collection_name)
+        if doc_store:
+            return doc_store.get_many(ids)  # 本地内存映射读取，无需放入线程
+        client = await self._async_client(collection_name)
+        if client is None:
+            return await asyncio.to_thread(self.fetch_texts, collection_name, ids)
+        rows = await client.query(collection_name=collection_name, filter=self._id_expr(ids), output_fields=["text"])
+        return {str(row["id"]): row["text"] for row in rows}
+
+    def search(self, collection_name, query_vector, limit=5, query_text=None, versions=None, with_text=True):
+        """改进版搜索，增加多样性
+
+        Args:
+            query_text: 问题文本，启用混合检索时用于BM25检索并按RRF融合
+            versions: 检索的文档版本，默认 SEARCH_VERSIONS；集合按版本分区时只检索相关分区
+            with_text: 为False时不返回正文（两阶段检索，正文之后用 fetch_texts 按需读取）
+        """
+        versions = list(versions or self.SEARCH_VERSIONS)
+        output_fields = self._output_fields(collection_name, with_text)
+        fetch_limit = self._fetch_limit(limit)
         try:
-            if not self.col or self.col.name != collection_name:
-                self.col = Collection(collection_name)
-                self.col.load()
-            
-            # 使用混合搜索参数
-            search_params = {
-                "metric_type": "IP",
-                "params": {
-                    "nprobe": 32,  # 增加搜索范围
-                    "radius": 0.7   # 控制结果多样性
-                }
-            }
+            collection = self._collection(collection_name)
+            partition_names = self._route_partitions(self._sync_partitions(collection_name), versions)
+            if partition_names == []:
+                logger.info(f"集合 {collection_name} 中没有版本 {versions} 的文档")
+                return []
             
-            # 添加版本过滤（优先3.0和2.1）
-            expr = "version in ['3.0', '2.1']"  # 优先最新版本
-            
-            results = self.col.search(
+            results = collection.search(
                 data=[query_vector],
                 anns_field="vector",
-                param=search_params,
-                limit=limit*3,  # 扩大初始结果集
-                expr=expr,
-                output_fields=["text", "version", "url", "is_community"]
+                param=self._search_params(collection_name),
+                limit=fetch_limit,  # 扩大初始结果集
+                expr=None if partition_names else self.search_expr(versions),
+                partition_names=partition_names,
+                output_fields=output_fields
             )
             
-            logger.info(f"搜索完成，找到 {len(results[0])} 条结果")
+            logger.info(f"搜索完成，找到 {len(results[0])} 条结果（分区: {partition_names or '全部'}）")
             
             # 处理搜索结果
             results_with_context = []
             for hits in results:  # results[0] 是第一个查询的结果
                 for hit in hits:  # 遍历每个匹配项
                     entity = hit.entity
-                    doc_data = {
-                        "text": str(entity.text) if hasattr(entity, 'text') else "",
-                        "version": str(entity.version) if hasattr(entity, 'version') else "",
-                        "url": str(entity.url) if hasattr(entity, 'url') else "",
-                        "is_community": bool(entity.is_community) if hasattr(entity, 'is_community') else False,
-                        "score": float(hit.score)
-                    }
-                    results_with_context.append(doc_data)
+                    fields = {name: getattr(entity, name) for name in output_fields if hasattr(entity, name)}
+                    results_with_context.append(self._format_hit(fields, hit.score, hit.id))
+            
+            lexical_ids = self._lexical_candidates(collection_name, query_text, fetch_limit, versions)
+            if lexical_ids is not None:
+                dense_ids = {hit["id"] for hit in results_with_context}
+                missing = [doc_id for doc_id in lexical_ids if doc_id not in dense_ids]
+                rows = collection.query(expr=self._id_expr(missing), output_fields=output_fields) if missing else []
+                fetched = {str(row["id"]): self._format_hit(row, 0.0) for row in rows}
+                results_with_context = self._merge_hybrid(results_with_context, lexical_ids, fetched, fetch_limit)
             
-            return results_with_context
+            self._fill_texts(collection_name, results_with_context, with_text)
+            return self._apply_version_weights(results_with_context, versions)
             
         except Exception as e:
             logger.error(f"搜索失败: {str(e)}")
             raise
 
-    def insert(self, collection_name, data):
-        """插入数据到集合，支持批量或单条插入"""
+    async def _async_client(self, collection_name):
+        """获取当前事件循环上的异步客户端（复用连接），并确保集合已加载；pymilvus不支持时返回None"""
+        if AsyncMilvusClient is None:
+            return None
+        loop = asyncio.get_running_loop()
+        state = self._async_clients.get(loop)
+        if state is None:
+            client = AsyncMilvusClient(uri=f"http://{self.host}:{self.port}")
+            state = self._async_clients[loop] = {"client": client, "loaded": set()}
+        # 按集合代数记录：别名切换到新集合后重新确认已加载
+        key = (collection_name, get_generation(collection_name))
+        if key not in state["loaded"]:
+            await state["client"].load_collection(collection_name)
+            state["loaded"].add(key)
+        return state["client"]
+
+    async def asearch(self, collection_name, query_vector, limit=5, query_text=None, versions=None, with_text=True):
+        """异步搜索，参数和返回格式与 search 相同"""
+        client = await self._async_client(collection_name)
+        if client is None:
+            return await asyncio.to_thread(self.search, collection_name, query_vector, limit, query_text, versions, with_text)
+        versions = list(versions or self.SEARCH_VERSIONS)
+        output_fields = self._output_fields(collection_name, with_text)
+        fetch_limit = self._fetch_limit(limit)
         try:
-            if not data:
-                return 0
-            
-            # 统一处理为列表格式
-            if not isinstance(data, list):
-                data = [data]
-            
-            # 转换数据格式
-            entities = []
-            for item in data:
-                try:
-                    entities.append({
-                        "id": str(item["id"]),
-                        "text": str(item["text"])[:65000],  # 强制类型转换和长度限制
-                        "vector": [float(x) for x in item["vector"]],
-                        "version": str(item["version"]),
-                        "url": str(item["url"]),
-                        "is_community": bool(item["is_community"])
-                    })
-                except Exception as e:
-                    logger.error(f"数据转换失败: {str(e)} | 原始数据: {item}")
-                    continue
-            
-            if not entities:
-                logger.warning("无有效数据可插入")
-                return 0
-            
-            # 转换为列格式
-            columns = [
-                [entity["id"] for entity in entities],
-                [entity["text"] for entity in entities],
-                [entity["vector"] for entity in entities],
-                [entity["version"] for entity in entities],
-                [entity["url"] for entity in entities],
-                [entity["is_community"] for entity in entities]
-            ]
-            
-            # 获取集合对象
-            collection = Collection(name=collection_name)
-            # 执行插入
-            result = collection.insert(columns)
-            logger.info(f"成功插入 {len(entities)} 条数据到 {collection_name}")
-            return len(entities)
+            partition_names = self._route_partitions(await self._async_partitions(client, collection_name), versions)
+            if partition_names == []:
+                logger.info(f"集合 {collection_name} 中没有版本 {versions} 的文档")
+                return []
             
+            results = await client.search(
+                collection_name=collection_name,
+                data=[query_vector],
+                anns_field="vector",
+                search_params=self._search_params(collection_name),
+                limit=fetch_limit,  # 扩大初始结果集
+                filter="" if partition_names else self.search_expr(versions),
+                partition_names=partition_names,
+                output_fields=output_fields
+            )
+            logger.info(f"搜索完成，找到 {len(results[0])} 条结果（分区: {partition_names or '全部'}）")
+            hits = [self._format_hit(hit.get("entity", {}), hit["distance"], hit.get("id")) for hits in results for hit in hits]
+            
+            lexical_ids = await asyncio.to_thread(self._lexical_candidates, collection_name, query_text, fetch_limit, versions)
+            if lexical_ids is not None:
+                dense_ids = {hit["id"] for hit in hits}
+                missing = [doc_id for doc_id in lexical_ids if doc_id not in dense_ids]
+                rows = await client.query(
+                    collection_name=collection_name,
+                    filter=self._id_expr(missing),
+                    output_fields=output_fields
+                ) if missing else []
+                fetched = {str(row["id"]): self._format_hit(row, 0.0) for row in rows}
+                hits = self._merge_hybrid(hits, lexical_ids, fetched, fetch_limit)
+            self._fill_texts(collection_name, hits, with_text)
+            return self._apply_version_weights(hits, versions)
         except Exception as e:
-            logger.error(f"数据插入失败: {str(e)}")
+            logger.error(f"搜索失败: {str(e)}")
             raise
 
-    def create_jira_collection(self):
-        """创建专用的Jira集合（带自定义schema）"""
+    async def aclose(self):
+        """关闭当前事件循环上的异步客户端"""
+        state = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if state:
+            await state["client"].close()
+
+    def create_jira_collection(self, target_name="jira_issues", with_index=True):
+        """创建专用的Jira集合（带自定义schema），target_name 为批量导入的影子集合名时不建索引"""
         fields = [
             FieldSchema(name="id", dtype=DataType.VARCHAR, max_length=64, is_primary=True),
             FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=65000),
@@ -419,38 +907,57 @@ class MilvusStore:
         ]
         
         schema = CollectionSchema(fields=fields, description="Jira Issues Collection")
-        collection = Collection(name="jira_issues", schema=schema)
+        collection = Collection(name=target_name, schema=schema)
         
-        # 创建优化索引
-        index_params = {
-            "metric_type": "L2",
-            "index_type": "HNSW",
-            "params": {"M": 16, "efConstruction": 200}
-        }
-        collection.create_index(field_name="vector", index_params=index_params)
+        # 创建优化索引（与检索使用同一度量）
+        if with_index:
+            collection.create_index(field_name="vector", index_params=self.index_params("jira_issues"))
         return collection
 
+    def ensure_jira_collection(self):
+        """Jira集合（或别名）不存在时创建"""
+        if not self.has_collection("jira_issues"):
+            self.create_jira_collection()
+
+    @staticmethod
+    def jira_record(doc: dict, vector) -> dict:
+        """JiraLoader 产出的文档映射为 jira_issues 集合的字段"""
+        metadata = doc.get("metadata", {})
+        created = metadata.get("created")
+        return {
+            "id": str(doc["id"]),
+            "text": str(doc["text"])[:65000],
+            "vector": vector,
+            "status": str(metadata.get("status", ""))[:20],
+            "priority": str(metadata.get("priority", ""))[:20],
+            "version": ",".join(metadata.get("versions", []))[:20],
+            "created": int(datetime.fromisoformat(created).timestamp()) if created else 0,
+        }
+
     def search_jira(self, query_vector, limit=5):
         """Jira专用搜索"""
         return self.search("jira_issues", query_vector, limit)
 
-    def upsert(self, collection_name: str, data: dict):
-        """更新或插入数据"""
+    def upsert(self, collection_name: str, data):
+        """按主键更新或插入（Milvus原生upsert，一次请求）；大量数据请使用 upserter() 按批写入"""
         try:
-            # 构建查询表达式
-            expr = f"id == '{data['id']}'"
-            
-            # 先尝试删除已存在记录
-            self.col = Collection(collection_name)
-            self.col.delete(expr)
-            
-            # 插入新数据
-            return self.insert(collection_name, data)
-            
+            records = data if isinstance(data, list) else [data]
+            if not records:
+                return 0
+            return Collection(collection_name).upsert(records).upsert_count
         except Exception as e:
             logger.error(f"数据更新失败: {str(e)}")
             raise
 
+    def upserter(self, collection_name: str) -> Upserter:
+        """创建批量upsert写入器，批大小见 jira_sync"""
+        sync_config = config.jira_sync_config
+        return Upserter(
+            self, collection_name,
+            batch_size=sync_config.get("upsert_batch_size", 200),
+            delete_batch_size=sync_config.get("delete_batch_size", 500)
+        )
+
     def batch_insert(self, collection_name: str, data: list):
         """批量插入数据"""
         try:
@@ -470,19 +977,34 @@ class MilvusStore:
             batch_size = 50
             inserted_count = 0
             
-            for i in range(0, total, batch_size):
-                batch = data[i:i+batch_size]
+            # 按版本集合写入对应分区（未启用时写入默认分区）
+            batches = []
+            for partition_name, records in self._split_by_partition(data).items():
+                batches.extend((partition_name, records[i:i+batch_size]) for i in range(0, len(records), batch_size))
+            
+            doc_store = self.doc_store(collection_name)
+            processed = 0
+            for number, (partition_name, batch) in enumerate(batches, start=1):
+                processed += len(batch)
                 try:
-                    result = collection.insert(batch)
+                    self._ensure_partition(collection, partition_name)
+                    rows = batch
+                    if doc_store:
+                        # 先写正文再写向量，检索到的ID总能读到正文
+                        doc_store.put_many((item["id"], item["text"]) for item in batch)
+                        rows = [{key: value for key, value in item.items() if key != "text"} for item in batch]
+                    result = collection.insert(rows, partition_name=partition_name)
                     inserted_count += len(result.primary_keys)
-                    logger.info(f"✅ 成功插入批次 {i//batch_size+1} (文档数: {len(batch)})")
+                    lexical_index = self.lexical_index(collection_name)
+                    if lexical_index:
+                        lexical_index.add(batch)
+                    logger.info(f"✅ 成功插入批次 {number} (文档数: {len(batch)}，分区: {partition_name or '默认'})")
                     logger.debug(f"插入批次示例ID: {batch[0]['id']}")
                 except Exception as e:
-                    logger.error(f"❌ 插入批次 {i//batch_size+1} 失败: {str(e)}")
+                    logger.error(f"❌ 插入批次 {number} 失败: {str(e)}")
                     logger.debug(f"失败批次数据示例: {batch[:1]}")
                     continue
                 
-                processed = min(i + batch_size, total)
                 logger.info(f"文档处理进度: {processed}/{total} ({processed/total:.1%})")
             
             logger.info(f"插入完成 成功/总数: {inserted_count}/{total} (成功率: {inserted_count/total:.1%})")
@@ -0,0 +1,90 @@
+import logging
+from pymilvus import Collection
+
+logger = logging.getLogger(__name__)
+
+
+class Upserter:
+    """批量upsert：累积记录后按批调用Milvus原生upsert，删除同样按批合并提交
+
+    - 记录需包含集合schema中的全部字段（向量已计算好）
+    - close() 时写出剩余批次，然后加载集合、触发一次compaction，整个同步只做一次
+    - 只用于不按版本分区的集合（如 jira_issues）：upsert 按主键覆盖，不会跨分区去重
+
+    用法：
+        with milvus.upserter("jira_issues") as upserter:
+            upserter.add(records)
+            upserter.delete(stale_ids)
+    """
+
+    def __init__(self, store, collection_name: str, batch_size: int = 200, delete_batch_size: int = 500):
+        self.store = store
+        self.collection_name = collection_name
+        self.batch_size = max(1, batch_size)
+        self.delete_batch_size = max(1, delete_batch_size)
+        self.collection = Collection(collection_name)
+        self.lexical_index = store.lexical_index(collection_name)
+        self.doc_store = store.doc_store(collection_name)
+        self.upserted = 0
+        self.deleted = 0
+        self._pending = {}  # ID → 记录，同一批内重复的ID只保留最后一次
+        self._pending_deletes = set()
+
+    def add(self, records: list):
+        for record in records:
+            self._pending_deletes.discard(record["id"])
+            self._pending[record["id"]] = record
+        if len(self._pending) >= self.batch_size:
+            self._flush_upserts()
+
+    def delete(self, ids):
+        for doc_id in ids:
+            self._pending.pop(doc_id, None)
+            self._pending_deletes.add(doc_id)
+        if len(self._pending_deletes) >= self.delete_batch_size:
+            self._flush_deletes()
+
+    def _flush_upserts(self):
+        records = list(self._pending.values())
+        self._pending = {}
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            if self.doc_store:
+                self.doc_store.put_many((record["id"], record["text"]) for record in batch)
+            result = self.collection.upsert(batch)
+            if self.lexical_index:
+                self.lexical_index.add(batch)
+            self.upserted += result.upsert_count
+            logger.info(f"{self.collection_name} upsert {len(batch)} 条（累计 {self.upserted}）")
+
+    def _flush_deletes(self):
+        ids = list(self._pending_deletes)
+        self._pending_deletes = set()
+        if ids:
+            # delete_by_ids 按批构造 id in [...] 表达式，并同步删除BM25索引和文档存储
+            self.store.delete_by_ids(self.collection_name, ids, batch_size=self.delete_batch_size)
+            self.deleted += len(ids)
+
+    def close(self) -> dict:
+        """写出剩余批次，加载集合并触发一次compaction，返回统计"""
+        self._flush_upserts()
+        self._flush_deletes()
+        if self.upserted or self.deleted:
+            self.collection.load()
+            # upsert 和删除都会留下删除标记，同步结束后统一合并一次
+            self.collection.compact()
+        stats = {"upserted": self.upserted, "deleted": self.deleted}
+        logger.info(f"{self.collection_name} 同步完成: upsert {self.upserted} 条，删除 {self.deleted} 条")
+        return stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # 出错时仍写出已累积的数据，避免已向量化的记录丢失
+            self._flush_upserts()
+            self._flush_deletes()
+        return False
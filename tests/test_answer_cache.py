@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from settings import config
+from src.qa.answer_cache import AnswerCache, MemoryAnswerBackend, SQLiteAnswerBackend
+from src.vectorstore.collection_generation import bump_generation
+
+@pytest.fixture(autouse=True)
+def generation_file(tmp_path, monkeypatch):
+    monkeypatch.setitem(config._config.setdefault("ingest", {}), "generation_path", str(tmp_path / "generations.json"))
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        backend = MemoryAnswerBackend(max_entries=2)
+    else:
+        backend = SQLiteAnswerBackend(tmp_path / "answers.sqlite", max_entries=2)
+    return AnswerCache(backend, similarity_threshold=0.9, ttl_seconds=3600)
+
+def _vector(*values):
+    vector = np.zeros(8, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector
+
+def test_similar_question_hits(cache):
+    generation = cache.generation("docs")
+    cache.store("docs", generation, "如何优化Doris的查询性能", _vector(1, 0.1), "答案")
+    assert cache.lookup("docs", generation, _vector(1, 0.12)) == "答案"
+    assert cache.lookup("docs", generation, _vector(0, 1)) is None
+    assert cache.stats()["hits"] == 1
+
+def test_generation_bump_invalidates(cache):
+    generation = cache.generation("docs")
+    cache.store("docs", generation, "问题", _vector(1), "旧答案")
+    new_generation = bump_generation("docs")
+    assert cache.lookup("docs", new_generation, _vector(1)) is None
+    # 生成期间集合已更新的回答不写入
+    cache.store("docs", generation, "问题", _vector(1), "旧答案")
+    assert cache.lookup("docs", new_generation, _vector(1)) is None
+
+def test_size_bound_evicts_least_recent(cache):
+    generation = cache.generation("docs")
+    for i in range(3):
+        cache.store("docs", generation, f"问题{i}", _vector(*([0] * i), 1), f"答案{i}")
+    assert cache.lookup("docs", generation, _vector(1)) is None
+    assert cache.lookup("docs", generation, _vector(0, 0, 1)) == "答案2"
+
+def test_answers_are_scoped_by_question_versions(cache):
+    generation = cache.generation("docs")
+    cache.store("docs", generation, "2.0 如何建表", _vector(1), "2.0的答案", versions=["2.0"])
+    assert cache.lookup("docs", generation, _vector(1), versions=["3.0"]) is None
+    assert cache.lookup("docs", generation, _vector(1)) is None
+    assert cache.lookup("docs", generation, _vector(1), versions=["2.0"]) == "2.0的答案"
+
+def test_sqlite_table_without_scope_is_migrated(tmp_path):
+    import sqlite3
+    path = tmp_path / "answers.sqlite"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE answers (id INTEGER PRIMARY KEY AUTOINCREMENT, collection TEXT NOT NULL, "
+                 "generation INTEGER NOT NULL, question TEXT NOT NULL, vector BLOB NOT NULL, answer TEXT NOT NULL, "
+                 "created REAL NOT NULL, last_access REAL NOT NULL)")
+    conn.close()
+    cache = AnswerCache(SQLiteAnswerBackend(path), similarity_threshold=0.9)
+    generation = cache.generation("docs")
+    cache.store("docs", generation, "问题", _vector(1), "答案")
+    assert cache.lookup("docs", generation, _vector(1)) == "答案"
+
+def test_sqlite_mirror_drops_entries_evicted_by_other_workers(tmp_path):
+    path = tmp_path / "answers.sqlite"
+    reader, writer = SQLiteAnswerBackend(path, max_entries=2), SQLiteAnswerBackend(path, max_entries=2)
+    cache = AnswerCache(writer, similarity_threshold=0.9)
+    generation = cache.generation("docs")
+    cache.store("docs", generation, "问题0", _vector(1), "答案0")
+    assert len(reader.candidates("docs", generation, "")[0]) == 1
+    for i in range(1, 4):
+        cache.store("docs", generation, f"问题{i}", _vector(*([0] * i), 1), f"答案{i}")
+    ids, matrix = reader.candidates("docs", generation, "")
+    assert len(ids) == 2 and matrix.shape == (2, 8)
+    assert AnswerCache(reader, similarity_threshold=0.9).lookup("docs", generation, _vector(0, 0, 0, 1)) == "答案3"
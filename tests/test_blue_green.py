@@ -0,0 +1,84 @@
+from src.vectorstore import milvus_store
+from src.vectorstore.milvus_store import MilvusStore
+
+class FakeUtility:
+    def __init__(self, collections, aliases):
+        self.collections = list(collections)
+        self.aliases = dict(aliases)  # 别名 → 集合
+        self.dropped = []
+
+    def list_collections(self):
+        return list(self.collections)
+
+    def list_aliases(self, name):
+        return [alias for alias, target in self.aliases.items() if target == name]
+
+    def alter_alias(self, name, alias):
+        self.aliases[alias] = name
+
+    def drop_collection(self, name):
+        self.collections.remove(name)
+        self.dropped.append(name)
+
+def make_store(monkeypatch, collections, aliases):
+    fake = FakeUtility(collections, aliases)
+    monkeypatch.setattr(milvus_store, "utility", fake)
+    monkeypatch.setattr(MilvusStore, "_warm_up", lambda *args: None)
+    monkeypatch.setattr(MilvusStore, "_prune_side_stores", lambda *args: None)
+    store = MilvusStore.__new__(MilvusStore)
+    return store, fake
+
+def test_activate_keeps_previous_generation_and_rollback(monkeypatch):
+    store, fake = make_store(monkeypatch, ["doris_docs_v2", "doris_docs_v10", "doris_docs_v3", "jira_issues"],
+                             {"doris_docs": "doris_docs_v3"})
+    assert store.collection_versions("doris_docs") == ["doris_docs_v2", "doris_docs_v3", "doris_docs_v10"]
+    assert store.next_collection_version("doris_docs") == "doris_docs_v11"
+    fake.collections.append("doris_docs_v11")
+    store.activate("doris_docs", "doris_docs_v11")
+    assert fake.aliases["doris_docs"] == "doris_docs_v11"
+    assert sorted(fake.dropped) == ["doris_docs_v10", "doris_docs_v2"]
+    assert store.rollback("doris_docs") == "doris_docs_v3"
+    assert fake.aliases["doris_docs"] == "doris_docs_v3"
+
+def test_delete_keeps_side_store_entries_of_previous_generation(monkeypatch):
+    store, fake = make_store(monkeypatch, ["doris_docs_v1", "doris_docs_v2"], {"doris_docs": "doris_docs_v2"})
+    previous_ids = {"a", "b"}
+
+    class FakeCollection:
+        def __init__(self, name):
+            self.name = name
+
+        def delete(self, expr):
+            pass
+
+        def query(self, expr, output_fields):
+            assert self.name == "doris_docs_v1"
+            return [{"id": doc_id} for doc_id in sorted(previous_ids) if f'"{doc_id}"' in expr]
+
+    class FakeSideStore:
+        deleted = []
+
+        def delete(self, ids):
+            self.deleted.extend(ids)
+
+    side_store = FakeSideStore()
+    monkeypatch.setattr(milvus_store, "Collection", FakeCollection)
+    monkeypatch.setattr(MilvusStore, "lexical_index", lambda self, name: None)
+    monkeypatch.setattr(MilvusStore, "doc_store", lambda self, name: side_store)
+    store.delete_by_ids("doris_docs", ["a", "c"])
+    assert side_store.deleted == ["c"]
+
+def test_first_cutover_renames_serving_collection(monkeypatch):
+    store, fake = make_store(monkeypatch, ["doris_docs", "doris_docs_v1"], {})
+
+    def rename_collection(old, new):
+        fake.collections[fake.collections.index(old)] = new
+
+    def create_alias(name, alias):
+        fake.aliases[alias] = name
+
+    fake.rename_collection, fake.create_alias = rename_collection, create_alias
+    store.activate("doris_docs", "doris_docs_v1")
+    assert fake.aliases["doris_docs"] == "doris_docs_v1"
+    assert sorted(fake.collections) == ["doris_docs_v0", "doris_docs_v1"]
+    assert store.rollback("doris_docs") == "doris_docs_v0"
@@ -0,0 +1,74 @@
+import pytest
+from pymilvus import DataType, FieldSchema
+from src.vectorstore import bulk_importer
+from src.vectorstore.bulk_importer import BulkImporter
+
+class FakeUtility:
+    def __init__(self):
+        self.dropped = []
+
+    def has_collection(self, name):
+        return name in self.dropped
+
+    def drop_collection(self, name):
+        self.dropped.append(name)
+
+    def do_bulk_insert(self, name, files, partition_name=None):
+        raise RuntimeError("导入失败")
+
+class FakeWriter:
+    batch_files = [["part.parquet"]]
+    data_path = "/nonexistent"
+
+    def append_row(self, row):
+        pass
+
+    def commit(self):
+        pass
+
+class FakeDocStore:
+    def __init__(self):
+        self.ids = []
+
+    def put_many(self, records):
+        self.ids.extend(doc_id for doc_id, _ in records)
+
+class FakeStore:
+    def __init__(self):
+        self.docs = FakeDocStore()
+
+    def next_collection_version(self, name):
+        return name + "_v2"
+
+    def doc_store(self, name):
+        return self.docs
+
+    def lexical_index(self, name):
+        return None
+
+    def _split_by_partition(self, records):
+        return {None: records}
+
+def test_side_stores_untouched_when_import_fails(monkeypatch):
+    fake_utility = FakeUtility()
+    monkeypatch.setattr(bulk_importer, "utility", fake_utility)
+    monkeypatch.setattr(BulkImporter, "_open_writer", lambda self: FakeWriter())
+    schema = type("Schema", (), {"fields": [FieldSchema(name="id", dtype=DataType.VARCHAR, max_length=64, is_primary=True)]})()
+    store = FakeStore()
+    importer = BulkImporter(store, "doris_docs", lambda name: type("Collection", (), {"schema": schema})())
+    importer.write([{"id": "a", "text": "正文", "versions": ["3.0"]}])
+    with pytest.raises(RuntimeError):
+        importer.finish()
+    assert store.docs.ids == []
+    assert fake_utility.dropped == ["doris_docs_v2"]
+    assert importer._side_path is None
+
+def test_side_stores_written_after_import(monkeypatch):
+    monkeypatch.setattr(bulk_importer, "utility", FakeUtility())
+    monkeypatch.setattr(BulkImporter, "_open_writer", lambda self: FakeWriter())
+    schema = type("Schema", (), {"fields": [FieldSchema(name="id", dtype=DataType.VARCHAR, max_length=64, is_primary=True)]})()
+    store = FakeStore()
+    importer = BulkImporter(store, "doris_docs", lambda name: type("Collection", (), {"schema": schema})())
+    importer.write([{"id": "a", "text": "正文", "versions": ["3.0"]}, {"id": "b", "text": "正文", "version": "2.0"}])
+    importer._write_side_stores()
+    assert store.docs.ids == ["a", "b"]
@@ -0,0 +1,69 @@
+import numpy as np
+from pymilvus import DataType, FieldSchema
+from src.vectorstore import bulk_writer
+from src.vectorstore.bulk_writer import BulkWriter
+
+class FakeFuture:
+    def __init__(self, count, error=None):
+        self.count, self.error = count, error
+
+    def result(self):
+        if self.error:
+            raise self.error
+        return type("Result", (), {"insert_count": self.count})()
+
+class FakeCollection:
+    def __init__(self, name):
+        self.schema = type("Schema", (), {"fields": [
+            FieldSchema(name="id", dtype=DataType.VARCHAR, max_length=64, is_primary=True),
+            FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=2),
+            FieldSchema(name="version", dtype=DataType.VARCHAR, max_length=10),
+        ]})()
+        self.inserts = []
+        self.flushes = 0
+
+    def insert(self, columns, partition_name=None, _async=False):
+        self.inserts.append(columns)
+        ids = columns[0]
+        return FakeFuture(len(ids), RuntimeError("boom") if "bad" in ids else None)
+
+    def flush(self):
+        self.flushes += 1
+
+class FakeDocStore:
+    def __init__(self):
+        self.ids = []
+
+    def put_many(self, records):
+        self.ids.extend(doc_id for doc_id, _ in records)
+
+class FakeStore:
+    def __init__(self):
+        self.docs = FakeDocStore()
+
+    def doc_store(self, name):
+        return self.docs
+
+    def lexical_index(self, name):
+        return None
+
+    def _split_by_partition(self, records):
+        return {None: records}
+
+    def _ensure_partition(self, collection, partition_name):
+        pass
+
+def test_columnar_batches_and_failures(monkeypatch):
+    monkeypatch.setattr(bulk_writer, "Collection", FakeCollection)
+    store = FakeStore()
+    writer = BulkWriter(store, "doris_docs", batch_size=2, max_in_flight=2)
+    records = [{"id": doc_id, "vector": [1, 0], "version": 3.0, "text": "x"} for doc_id in ["a", "b", "bad", "c", "d"]]
+    assert writer.write(records) == 5
+    stats = writer.close(build_index=False)
+    first = writer.collection.inserts[0]
+    assert first[0] == ["a", "b"] and first[2] == ["3.0", "3.0"]
+    assert isinstance(first[1], np.ndarray) and first[1].dtype == np.float32 and first[1].shape == (2, 2)
+    assert stats["rows"] == 3 and writer.failed_ids == ["bad", "c"]
+    # 插入失败的批次不写入文档存储
+    assert store.docs.ids == ["a", "b", "d"]
+    assert writer.collection.flushes == 1
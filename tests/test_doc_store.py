@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("zstandard")
+
+from src.vectorstore.doc_store import DocStore
+
+def test_put_get_overwrite_delete(tmp_path):
+    store = DocStore(tmp_path / "docs")
+    store.put_many([("a", "数组函数 array_contains"), ("b", "创建表")])
+    reader = DocStore(tmp_path / "docs")  # 另一个进程中的读取方
+    assert reader.get_many(["a", "b", "x"]) == {"a": "数组函数 array_contains", "b": "创建表"}
+    store.put_many([("a", "新内容")])
+    store.delete(["b"])
+    assert reader.get_many(["a", "b"]) == {"a": "新内容"}
+    assert len(reader) == 1
+    store.put_many([("c", "保留")])
+    assert store.retain({"c"}) == 1
+    assert reader.get_many(["a", "c"]) == {"c": "保留"}
+
+def test_compact_and_clear(tmp_path):
+    store = DocStore(tmp_path / "docs")
+    store.put_many([(str(i), "文本" * 50) for i in range(10)])
+    reader = DocStore(tmp_path / "docs")
+    assert len(reader) == 10
+    store.delete([str(i) for i in range(8)])
+    assert store.compact(min_garbage_ratio=0.5)
+    assert store.stats()["data_bytes"] == store.stats()["live_bytes"]
+    assert reader.get_many(["8", "9", "0"]) == {"8": "文本" * 50, "9": "文本" * 50}
+    store.clear()
+    assert len(reader) == 0 and reader.get("9") is None
@@ -0,0 +1,62 @@
+import asyncio
+import base64
+from types import SimpleNamespace
+import numpy as np
+from src.clients import embedding_client as embedding_module
+from src.clients.embedding_client import AsyncEmbeddingClient, decode_embedding, normalize_rows
+
+def encode(vector):
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode()
+
+class FakeLimiter:
+    async def acall(self, fn, **kwargs):
+        kwargs.pop("cost")
+        return await fn(**kwargs)
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.requests = []
+
+    async def create(self, model, input, encoding_format, timeout):
+        self.requests.append((list(input), encoding_format))
+        data = [SimpleNamespace(index=i, embedding=encode([float(len(text)), 0.0]))
+                for i, text in enumerate(input)]
+        # 服务端返回顺序不保证与输入一致
+        return SimpleNamespace(data=list(reversed(data)))
+
+def make_client(monkeypatch, normalize):
+    embeddings = FakeEmbeddings()
+    monkeypatch.setattr(embedding_module.async_clients, "get", lambda provider: SimpleNamespace(embeddings=embeddings))
+    client = AsyncEmbeddingClient.__new__(AsyncEmbeddingClient)
+    client.provider = "test"
+    client.model = "test"
+    client.max_batch_size = 2
+    client.max_batch_tokens = 1000
+    client.encoding_format = "base64"
+    client.normalize = normalize
+    client.timeout = 1.0
+    client.token_counter = None
+    client.rate_limiter = FakeLimiter()
+    return client, embeddings
+
+def test_decode_embedding_accepts_base64_and_lists():
+    assert decode_embedding(encode([1.5, -2.0])).tolist() == [1.5, -2.0]
+    decoded = decode_embedding([0.25, 4])
+    assert decoded.dtype == np.float32 and decoded.tolist() == [0.25, 4.0]
+
+def test_normalize_rows_keeps_zero_vectors():
+    vectors = normalize_rows(np.array([[3.0, 4.0], [0.0, 0.0]], dtype=np.float32))
+    assert np.allclose(vectors, [[0.6, 0.8], [0.0, 0.0]])
+
+def test_embed_returns_ordered_float32_matrix(monkeypatch):
+    client, embeddings = make_client(monkeypatch, normalize=False)
+    vectors = asyncio.run(client.embed(["a", "bb", "ccc", "dddd", "eeeee"]))
+    assert vectors.dtype == np.float32 and vectors.flags.c_contiguous
+    assert vectors[:, 0].tolist() == [1, 2, 3, 4, 5]
+    assert [request for request, _ in embeddings.requests] == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+    assert {encoding for _, encoding in embeddings.requests} == {"base64"}
+
+def test_embed_normalizes_in_bulk(monkeypatch):
+    client, _ = make_client(monkeypatch, normalize=True)
+    vectors = asyncio.run(client.embed(["a", "bb", "ccc"]))
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import numpy as np
+from settings import config
+from src.data_loader import doris_loader
+from src.data_loader.doris_loader import DorisLoader
+from src.data_loader.index_manifest import IndexManifest
+
+class FakeWriter:
+    def __init__(self, store):
+        self.store = store
+        self.failed_ids = []
+
+    def write(self, records):
+        return self.store.batch_insert("doris_docs", records)
+
+    def close(self):
+        return {"rows_per_sec": 0}
+
+    def abort(self):
+        pass
+
+class FakeMilvus:
+    rows = {}
+
+    @staticmethod
+    def index_params(collection_name):
+        return {"index_type": "FLAT"}
+
+    def has_collection(self, name):
+        return bool(self.rows)
+
+    def next_collection_version(self, name):
+        return name + "_v1"
+
+    def active_collection(self, name):
+        return "doris_docs_v1" if self.rows else None
+
+    def collection_versions(self, name):
+        return ["doris_docs_v1"] if self.rows else []
+
+    def create_collection(self, *args, **kwargs):
+        FakeMilvus.rows = {}
+
+    def lexical_index(self, name):
+        return None
+
+    def doc_store(self, name):
+        return None
+
+    def bulk_writer(self, name, target_name=None):
+        return FakeWriter(self)
+
+    def activate(self, *args):
+        pass
+
+    def delete_by_ids(self, name, ids):
+        for doc_id in ids:
+            self.rows.pop(doc_id, None)
+
+    def batch_insert(self, name, records):
+        for record in records:
+            assert record["id"] not in self.rows, "重复主键"
+            self.rows[record["id"]] = dict(record)
+        return len(records)
+
+    def fetch_records(self, name, ids):
+        return [dict(self.rows[doc_id]) for doc_id in ids if doc_id in self.rows]
+
+class FakeEngine:
+    embedding_cache = None
+
+    async def aembed_documents(self, texts):
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+def make_loader(monkeypatch, tmp_path, docs):
+    """docs: {文档键: (版本, [文档块正文])}，每个文档只有一个文件"""
+    monkeypatch.setattr(doris_loader, "MilvusStore", FakeMilvus)
+    monkeypatch.setattr(doris_loader, "bump_generation", lambda name: None)
+    monkeypatch.setitem(config._config["ingest"], "manifest_path", str(tmp_path / "manifest.json"))
+    monkeypatch.setitem(config._config["bulk_import"], "enabled", False)
+    loader = DorisLoader(tmp_path)
+    loader._rag_engine = FakeEngine()
+    loader._collect_doc_files = lambda: {key: [(version, False)] for key, (version, _) in docs.items()}
+    loader._doc_group_key = lambda file_path: file_path
+    loader._group_hash = lambda files: hashlib.sha256(repr([docs[path] for path in files]).encode()).hexdigest()
+    loader.iter_file_chunks = lambda doc_files: (
+        (key, [{"content": text, "version": docs[key][0], "url": f"/docs/{docs[key][0]}/{key}"}
+               for text in docs[key][1]])
+        for key in doc_files
+    )
+    loader._rebuild_moderation_profile = lambda *args: None
+    return loader
+
+def texts_to_versions():
+    return {row["text"]: sorted(row["versions"]) for row in FakeMilvus.rows.values()}
+
+def test_shared_chunk_survives_change_of_one_document(monkeypatch, tmp_path):
+    FakeMilvus.rows = {}
+    docs = {"a.md": ("3.0", ["shared", "a1"]), "b.md": ("2.0", ["shared", "b1"])}
+    loader = make_loader(monkeypatch, tmp_path, docs)
+    asyncio.run(loader.aprocess(incremental=True))
+    assert texts_to_versions() == {"shared": ["2.0", "3.0"], "a1": ["3.0"], "b1": ["2.0"]}
+    shared_id = loader._content_id("shared")
+    manifest = IndexManifest(tmp_path / "manifest.json")
+    assert manifest.references(shared_id) == {"a.md", "b.md"}
+
+    # a.md 不再包含共用文档块：记录保留，只去掉 a.md 的版本和URL
+    docs["a.md"] = ("3.0", ["a2"])
+    asyncio.run(loader.aprocess(incremental=True))
+    assert texts_to_versions() == {"shared": ["2.0"], "a2": ["3.0"], "b1": ["2.0"]}
+    assert FakeMilvus.rows[shared_id]["urls"] == ["/docs/2.0/b.md"]
+
+    # 最后一个引用它的文档删除后，记录才被删除
+    del docs["b.md"]
+    asyncio.run(loader.aprocess(incremental=True))
+    assert texts_to_versions() == {"a2": ["3.0"]}
+    assert IndexManifest(tmp_path / "manifest.json").references(shared_id) == set()
+
+def test_unchanged_documents_are_not_rewritten(monkeypatch, tmp_path):
+    FakeMilvus.rows = {}
+    docs = {"a.md": ("3.0", ["a1"]), "b.md": ("2.0", ["b1"])}
+    loader = make_loader(monkeypatch, tmp_path, docs)
+    asyncio.run(loader.aprocess(incremental=True))
+    inserted = []
+    monkeypatch.setattr(FakeMilvus, "batch_insert",
+                        lambda self, name, records: inserted.extend(r["text"] for r in records) or len(records))
+    docs["c.md"] = ("3.0", ["c1"])
+    asyncio.run(loader.aprocess(incremental=True))
+    assert inserted == ["c1"]
+
+def test_manifest_snapshot_follows_active_generation(monkeypatch, tmp_path):
+    FakeMilvus.rows = {}
+    docs = {"a.md": ("3.0", ["a1"])}
+    loader = make_loader(monkeypatch, tmp_path, docs)
+    asyncio.run(loader.aprocess(incremental=True))
+    manifest = IndexManifest(tmp_path / "manifest.json")
+    assert manifest.meta["physical_collection"] == "doris_docs_v1"
+
+    # 清单描述的不是别名当前指向的集合（如回滚后没有恢复快照）时全量重建
+    docs["b.md"] = ("3.0", ["b1"])
+    manifest.meta["physical_collection"] = "doris_docs_v0"
+    manifest.save()
+    rebuilt = []
+    create_collection = FakeMilvus.create_collection
+    monkeypatch.setattr(FakeMilvus, "create_collection",
+                        lambda self, *args, **kwargs: rebuilt.append(args) or create_collection(self))
+    asyncio.run(loader.aprocess(incremental=True))
+    assert rebuilt
+
+    # 回滚时恢复目标集合的快照
+    assert manifest.restore("doris_docs_v1")
+    assert sorted(manifest.files) == ["a.md", "b.md"]
+    assert not manifest.restore("doris_docs_v0")
+
+def test_normalize_change_forces_full_rebuild(monkeypatch, tmp_path):
+    FakeMilvus.rows = {}
+    docs = {"a.md": ("3.0", ["a1"])}
+    loader = make_loader(monkeypatch, tmp_path, docs)
+    asyncio.run(loader.aprocess(incremental=True))
+    rebuilt = []
+    create_collection = FakeMilvus.create_collection
+    monkeypatch.setattr(FakeMilvus, "create_collection",
+                        lambda self, *args, **kwargs: rebuilt.append(args) or create_collection(self))
+    monkeypatch.setitem(config.embedding_config, "normalize", not config.normalize_embeddings)
+    asyncio.run(loader.aprocess(incremental=True))
+    assert rebuilt
+
+def test_documents_sharing_a_failed_chunk_are_retried(monkeypatch, tmp_path):
+    FakeMilvus.rows = {}
+    docs = {"a.md": ("3.0", ["shared", "a1"]), "b.md": ("2.0", ["shared", "b1"])}
+    loader = make_loader(monkeypatch, tmp_path, docs)
+    monkeypatch.setitem(config._config["ingest"], "batch_size", 1)
+    batch_insert = FakeMilvus.batch_insert
+
+    def failing_insert(self, name, records):
+        if any(record["text"] == "shared" for record in records):
+            raise RuntimeError("写入失败")
+        return batch_insert(self, name, records)
+
+    monkeypatch.setattr(FakeMilvus, "batch_insert", failing_insert)
+    asyncio.run(loader.aprocess(incremental=True))
+    # a.md 写入共用文档块失败，b.md 虽然自身写入成功也不能记入清单
+    assert IndexManifest(tmp_path / "manifest.json").files == {}
+
+    monkeypatch.setattr(FakeMilvus, "batch_insert", batch_insert)
+    asyncio.run(loader.aprocess(incremental=True))
+    assert texts_to_versions() == {"shared": ["2.0", "3.0"], "a1": ["3.0"], "b1": ["2.0"]}
@@ -0,0 +1,25 @@
+import numpy as np
+from src.vectorstore.index_tuner import IndexTuner, brute_force_topk, build_candidates, recall_at_k
+
+def test_brute_force_ground_truth_and_recall():
+    base = np.eye(4, dtype=np.float32)
+    queries = np.array([[0.9, 0.1, 0, 0], [0, 0, 0.2, 0.8]], dtype=np.float32)
+    truth = brute_force_topk(base, queries, k=2, metric_type="IP")
+    assert truth.tolist() == [[0, 1], [3, 2]]
+    assert recall_at_k(truth, [[0, 1], [3, 0]]) == 0.75
+
+def test_pq_subvectors_divide_dimension():
+    candidates = dict(build_candidates(["IVF_PQ", "IVF_FLAT"], row_count=10000, dim=1024))
+    assert 1024 % candidates["IVF_PQ"]["m"] == 0
+    assert candidates["IVF_FLAT"]["nlist"] == 400
+
+def test_choose_fastest_qualified():
+    tuner = IndexTuner("doris_docs", target_recall=0.95)
+    report = [
+        {"index_type": "IVF_FLAT", "recall": 0.99, "p50_ms": 3, "p99_ms": 9},
+        {"index_type": "HNSW", "recall": 0.96, "p50_ms": 1, "p99_ms": 2},
+        {"index_type": "IVF_PQ", "recall": 0.80, "p50_ms": 0.5, "p99_ms": 1},
+    ]
+    assert tuner.choose(report)["index_type"] == "HNSW"
+    tuner.target_recall = 0.999
+    assert tuner.choose(report)["index_type"] == "IVF_FLAT"
@@ -0,0 +1,31 @@
+from src.vectorstore.lexical_index import LexicalIndex, tokenize
+from src.vectorstore.milvus_store import MilvusStore
+
+def test_identifiers_kept_whole():
+    tokens = tokenize("如何使用 ARRAY_CONTAINS 函数")
+    assert "array_contains" in tokens and "array" in tokens and "函数" in tokens
+
+def test_bm25_ranks_exact_terms_and_filters_versions(tmp_path):
+    index = LexicalIndex(tmp_path / "docs.sqlite")
+    index.add([
+        {"id": "a", "text": "array_contains 判断数组是否包含指定元素", "versions": ["3.0"]},
+        {"id": "b", "text": "数组函数概览，包括 array_size 等", "versions": ["3.0", "2.1"]},
+        {"id": "c", "text": "array_contains 的旧版说明", "versions": ["2.0"]},
+        {"id": "d", "text": "创建表时指定分桶", "version": "2.1"},
+        {"id": "e", "text": "导入数据", "version": "2.1"},
+    ])
+    assert [doc_id for doc_id, _ in index.search("array_contains 用法")][:2] in (["a", "c"], ["c", "a"])
+    assert [doc_id for doc_id, _ in index.search("array_contains", versions=["3.0", "2.1"])] == ["a"]
+    index.delete(["a"])
+    assert len(index) == 4
+    assert index.search("array_contains", versions=["3.0"]) == []
+
+def test_rrf_fuse_rewards_agreement():
+    fused = MilvusStore._rrf_fuse([["a", "b", "c"], ["c", "d"]], limit=3, k=60)
+    assert [doc_id for doc_id, _ in fused] == ["c", "a", "b"]
+
+def test_retain_drops_documents_missing_from_new_collection(tmp_path):
+    index = LexicalIndex(tmp_path / "docs.sqlite")
+    index.add([{"id": doc_id, "text": f"文档 {doc_id}", "version": "3.0"} for doc_id in "abc"])
+    assert index.retain({"a", "c"}) == 1
+    assert len(index) == 2 and index.search("b") == []
@@ -0,0 +1,48 @@
+import pytest
+from src.utils.markdown_chunker import MarkdownChunker, TokenCounter, parse_headings
+
+@pytest.fixture
+def chunker():
+    return MarkdownChunker(max_tokens=80, overlap_tokens=16, min_chars=10, token_counter=TokenCounter())
+
+def test_code_fence_comments_are_not_headings(chunker):
+    content = "# 建表\n\n建表语句示例如下，注意分桶列的选择。\n\n```sql\n# 这不是标题\nCREATE TABLE t (k INT);\n```\n"
+    chunks = chunker.split(content)
+    assert len(chunks) == 1
+    assert chunks[0]["headings"] == ["建表"]
+    assert "# 这不是标题" in chunks[0]["content"]
+
+def test_front_matter_and_license_removed(chunker):
+    content = ("---\ntitle: 导入\n---\n<!--\nLicensed to the Apache Software Foundation (ASF)\n"
+               "under the License.\n-->\n# 导入\n\n使用Stream Load导入数据到Doris表中，支持CSV和JSON格式。\n")
+    chunks = chunker.split(content)
+    assert "Licensed" not in chunks[0]["content"]
+    assert "title:" not in chunks[0]["content"]
+
+def test_chunks_respect_token_budget_with_overlap(chunker):
+    paragraphs = "\n\n".join(f"第{i}段。物化视图可以加速查询。刷新策略需要结合业务设置。" for i in range(30))
+    chunks = chunker.split(f"# 物化视图\n\n{paragraphs}\n")
+    assert len(chunks) > 1
+    assert all(chunker.counter.count(chunk["content"]) <= chunker.max_tokens for chunk in chunks)
+    assert all(chunk["content"].startswith("# 物化视图") for chunk in chunks)
+    # 相邻片段保留上一片段末尾的句子
+    assert "刷新策略需要结合业务设置。" in chunks[1]["content"].split("\n\n")[1]
+
+def test_oversized_code_block_keeps_fences(chunker):
+    sql = "\n".join(f"SELECT {i} FROM tbl; -- # comment" for i in range(60))
+    chunks = chunker.split(f"# 查询\n\n```sql\n{sql}\n```\n")
+    assert len(chunks) > 1
+    for chunk in chunks:
+        body = chunk["content"].split("\n\n", 1)[1]
+        assert body.startswith("```sql") and body.endswith("```")
+
+def test_parse_headings_ignores_code_fences():
+    headings, body = parse_headings("# A\n## B\n```shell\n# echo\n```\ntext")
+    assert headings == ["A", "B"]
+    assert "# echo" in body
+
+def test_overlong_line_keeps_original_order(chunker):
+    long_line = "".join(f"col_{i}, " for i in range(200))
+    chunks = chunker.split(f"# 查询\n\n```sql\nfirst short line\n{long_line}\nlast line\n```\n")
+    bodies = "\n".join(chunk["content"] for chunk in chunks)
+    assert bodies.index("first short line") < bodies.index("col_0,") < bodies.index("col_199,") < bodies.index("last line")
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from settings import config
+from src.moderation.domain_profile import DomainProfile, build_vocabulary, save_profile
+from src.moderation.keyword_automaton import KeywordAutomaton
+from src.moderation.verdict_cache import VerdictCache
+
+@pytest.fixture(autouse=True)
+def profile_files(tmp_path, monkeypatch):
+    monkeypatch.setitem(config._config["moderation"], "vocabulary_path", str(tmp_path / "vocabulary.json"))
+    monkeypatch.setitem(config._config["moderation"], "centroids_path", str(tmp_path / "centroids.npy"))
+
+def test_automaton_matches_on_word_boundaries():
+    automaton = KeywordAutomaton(["sum", "物化视图", "create table", "bitmap_union"])
+    assert automaton.find("如何使用 SUM 函数") == "sum"
+    assert automaton.find("summer vacation") is None
+    assert automaton.find("异步物化视图如何刷新") == "物化视图"
+    assert list(automaton.iter_matches("CREATE TABLE 后用 bitmap_union 聚合")) == ["create table", "bitmap_union"]
+
+def test_automaton_matches_terms_glued_to_version_numbers():
+    automaton = KeywordAutomaton(["doris", "v2"])
+    assert automaton.find("doris3.0 和 Doris2.1 的区别") == "doris"
+    assert automaton.find("apache-doris.") == "doris"
+    assert automaton.find("dorisdb") is None
+    assert automaton.find("v23") is None
+
+def test_vocabulary_from_headings_and_sql_docs(tmp_path):
+    sql_dir = tmp_path / "sql-manual" / "sql-functions"
+    sql_dir.mkdir(parents=True)
+    (sql_dir / "array-contains.md").write_text("# ARRAY_CONTAINS\n## 示例\n```\n# not a heading\n```\n")
+    paths = [sql_dir / "array-contains.md"]
+    for i in range(6):
+        path = tmp_path / f"doc{i}.md"
+        path.write_text(f"# 分区裁剪{i}\n## 示例\n")
+        paths.append(path)
+    vocabulary = build_vocabulary(paths, min_max_df=5)
+    assert {"array_contains", "array contains", "分区裁剪0"} <= set(vocabulary)
+    assert "示例" not in vocabulary and "not a heading" not in vocabulary
+
+def test_profile_reloads_and_scores_centroids():
+    profile = DomainProfile(["doris"])
+    assert profile.match_keyword("Apache Doris") == "doris"
+    assert profile.similarity([1.0, 0.0]) is None
+    save_profile(["物化视图"], np.array([[1.0, 0.0]], dtype=np.float32))
+    assert profile.match_keyword("物化视图") == "物化视图"
+    assert profile.similarity([2.0, 0.0]) == pytest.approx(1.0)
+
+def test_verdict_cache_normalizes_and_expires():
+    cache = VerdictCache(ttl_seconds=3600)
+    cache.put("今天 天气如何", False)
+    assert cache.get(" 今天  天气如何 ") is False
+    cache.ttl_seconds = -1
+    assert cache.get("今天 天气如何") is None
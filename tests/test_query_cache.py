@@ -0,0 +1,23 @@
+from src.qa.query_cache import LRUCache, QueryCache, normalize_query
+
+def test_lru_evicts_and_counts_hits():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.stats() == {"size": 2, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+def test_query_text_normalized():
+    assert normalize_query("  如何优化Doris  查询？ ") == normalize_query("如何优化doris 查询?")
+
+def test_search_tier_keyed_by_generation():
+    cache = QueryCache()
+    vector = [0.1, 0.2]
+    cache.put_search("docs", 1, vector, (3, "expr"), [{"text": "t", "score": 0.9}])
+    hits = cache.get_search("docs", 1, vector, (3, "expr"))
+    hits[0]["score"] = 0
+    assert cache.get_search("docs", 1, vector, (3, "expr"))[0]["score"] == 0.9
+    assert cache.get_search("docs", 2, vector, (3, "expr")) is None
+    assert cache.get_search("docs", 1, vector, (5, "expr")) is None
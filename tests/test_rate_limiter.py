@@ -0,0 +1,93 @@
+import asyncio
+import httpx
+import openai
+import pytest
+from src.clients.rate_limiter import AdaptiveRateLimiter
+
+def _rate_limit_error():
+    request = httpx.Request("POST", "http://test/v1/embeddings")
+    response = httpx.Response(429, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+def test_additive_increase_multiplicative_decrease():
+    limiter = AdaptiveRateLimiter("test", initial_concurrency=4, max_concurrency=8, base_delay=0.0)
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release()
+    assert int(limiter.limit) == 5
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert int(limiter.limit) == 2
+
+def test_backoff_is_capped():
+    limiter = AdaptiveRateLimiter("test", base_delay=1.0, max_delay=5.0)
+    assert all(2.5 <= limiter.backoff(attempt) <= 5.0 for attempt in range(10, 60))
+
+def test_call_retries_then_gives_up():
+    limiter = AdaptiveRateLimiter("test", base_delay=0.001, max_delay=0.001, max_retries=3)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise _rate_limit_error()
+        return "ok"
+
+    assert limiter.call(flaky) == "ok"
+    assert limiter.in_flight == 0
+
+    def always_limited():
+        raise _rate_limit_error()
+
+    with pytest.raises(openai.RateLimitError):
+        limiter.call(always_limited)
+    assert limiter.stats()["failures"] == 1
+
+def test_explicit_zero_retries_is_respected():
+    limiter = AdaptiveRateLimiter("test", base_delay=0.001, max_delay=0.001, max_retries=3)
+    calls = []
+
+    def always_limited():
+        calls.append(1)
+        raise _rate_limit_error()
+
+    with pytest.raises(openai.RateLimitError):
+        limiter.call(always_limited, max_retries=0)
+    assert len(calls) == 1
+
+def test_stream_holds_slot_until_consumed():
+    limiter = AdaptiveRateLimiter("test")
+    stream = limiter.call(lambda stream: iter(["a", "b"]), stream=True)
+    assert limiter.in_flight == 1
+    assert list(stream) == ["a", "b"]
+    assert limiter.in_flight == 0
+    # 中途关闭同样释放名额
+    with limiter.call(lambda stream: iter(["a", "b"]), stream=True) as stream:
+        next(stream)
+    assert limiter.in_flight == 0
+
+def test_async_stream_holds_slot_until_closed():
+    class FakeStream:
+        closed = False
+
+        async def __aiter__(self):
+            for item in "ab":
+                yield item
+
+        async def close(self):
+            self.closed = True
+
+    async def create(stream):
+        return FakeStream()
+
+    async def consume(limiter):
+        stream = await limiter.acall(create, stream=True)
+        assert limiter.in_flight == 1
+        async with stream:
+            async for _ in stream:
+                break
+        return stream
+
+    limiter = AdaptiveRateLimiter("test")
+    stream = asyncio.run(consume(limiter))
+    assert limiter.in_flight == 0 and stream._stream.closed
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+from src.vectorstore import upserter as upserter_module
+from src.vectorstore.upserter import Upserter
+
+class FakeCollection:
+    def __init__(self, name):
+        self.calls = []
+
+    def upsert(self, rows):
+        self.calls.append(("upsert", [row["id"] for row in rows]))
+        return SimpleNamespace(upsert_count=len(rows))
+
+    def load(self):
+        self.calls.append(("load",))
+
+    def compact(self):
+        self.calls.append(("compact",))
+
+class FakeStore:
+    def __init__(self):
+        self.deleted = []
+
+    def lexical_index(self, name):
+        return None
+
+    def doc_store(self, name):
+        return None
+
+    def delete_by_ids(self, name, ids, batch_size=500):
+        self.deleted.append(sorted(ids))
+
+def test_batches_upserts_and_deletes_then_compacts_once(monkeypatch):
+    monkeypatch.setattr(upserter_module, "Collection", FakeCollection)
+    store = FakeStore()
+    with Upserter(store, "jira_issues", batch_size=2, delete_batch_size=10) as upserter:
+        upserter.add([{"id": "A-1"}, {"id": "A-1"}])  # 同一批内重复的ID只写一次
+        upserter.add([{"id": "A-2"}, {"id": "A-3"}])
+        upserter.delete(["A-3", "A-9"])
+    assert upserter.collection.calls == [
+        ("upsert", ["A-1", "A-2"]), ("upsert", ["A-3"]), ("load",), ("compact",)
+    ]
+    assert store.deleted == [["A-3", "A-9"]]
+    assert (upserter.upserted, upserter.deleted) == (3, 2)
@@ -0,0 +1,29 @@
+from src.qa.rag_engine import RAGEngine
+from src.vectorstore.milvus_store import MilvusStore
+
+def _store():
+    return object.__new__(MilvusStore)
+
+def test_partition_name_roundtrip():
+    name = MilvusStore.partition_name(["3.0", "2.1"])
+    assert name == "v_2_1__3_0"
+    assert MilvusStore.partition_versions(name) == {"2.1", "3.0"}
+    assert MilvusStore.partition_versions("_default") == set()
+
+def test_route_only_partitions_with_requested_versions():
+    names = ["_default", "v_2_0", "v_2_1__3_0", "v_3_0"]
+    assert _store()._route_partitions(names, ["2.0"]) == ["v_2_0"]
+    assert _store()._route_partitions(names, ["3.0"]) == ["v_2_1__3_0", "v_3_0"]
+    assert _store()._route_partitions(["_default"], ["3.0"]) is None
+
+def test_hits_weighted_and_localized_to_requested_version():
+    hit = {"version": "3.0", "url": "/docs/3.0/a", "versions": ["3.0", "2.0"], "urls": ["/docs/3.0/a", "/docs/2.0/a"]}
+    [hit] = _store()._apply_version_weights([hit], ["2.0"])
+    assert hit["version"] == "2.0" and hit["url"] == "/docs/2.0/a"
+    assert hit["version_weight"] == 1.0
+
+def test_versions_detected_from_question():
+    engine = object.__new__(RAGEngine)
+    engine.version_weights = {"3.0": 1.5, "2.1": 1.3, "2.0": 1.0}
+    assert engine._query_versions("Doris 2.0.3 和 v3.0 的区别") == ["2.0", "3.0"]
+    assert engine._query_versions("Doris 1.2 如何建表") is None
@@ -2,7 +2,9 @@ def validate_config(config):
     required_providers = set()
     # 自动收集所有service使用的provider
     for service in config["model_config"]["services"].values():
-        required_providers.add(service["provider"])
+        # 本地嵌入后端无需提供商配置
+        if service["provider"] != "local":
+            required_providers.add(service["provider"])
     
     # 验证必要配置
     for provider in required_providers: